@@ -0,0 +1,213 @@
+"""Profile the fusion pipeline stage by stage and write the results as JSON.
+
+Scenes are synthetic by default: a smooth random MSI of ``--msi_bands`` bands
+and an HSI of ``--bands`` random mixtures of it, block-averaged by ``--scale``.
+With ``--msi_path`` (e.g. ``data/benchmark_sentinel.tif``) a crop of that
+raster is the MSI instead. Per-patch stages are timed on a random sample of
+patches; the full patch stage is run once per worker count in ``--workers``
+to give patches/sec and a scaling curve. ``--baseline`` compares against an
+earlier JSON report and exits non-zero on regressions.
+
+Run from the repository root::
+
+    python -m benchmarks.pipeline --size 120 --bands 64 --workers 1,2,4 \\
+        --output benchmarks/results/pipeline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+import rasterio
+from scipy.ndimage import gaussian_filter, zoom
+from src.data_loader import HSIDataLoader
+from src.enhancer import HSIEnhancer
+from src.patch_processor import PatchProcessor
+from src.scheduler import default_n_jobs
+from src.upsampler import HSIUpsampler
+from src.warmup import warm_up
+
+def mixed_pair(msi, bands, scale, seed=0):
+    """HSI of ``bands`` random non-negative mixtures of the MSI bands, block-averaged by ``scale``."""
+    size_rows, size_cols = msi.shape[0] - msi.shape[0] % scale, msi.shape[1] - msi.shape[1] % scale
+    msi = msi[:size_rows, :size_cols]
+    weights = np.random.default_rng(seed).random((msi.shape[2], bands)).astype(np.float32)
+    truth = msi @ (weights / weights.sum(axis=0))
+    hsi = truth.reshape(size_rows // scale, scale, size_cols // scale, scale, bands).mean(axis=(1, 3))
+    return msi, hsi
+
+def synthetic_msi(size, msi_bands, seed=0):
+    """Smooth random (size, size, msi_bands) field with a few scales of structure."""
+    rng = np.random.default_rng(seed)
+    msi = sum(gaussian_filter(rng.random((size, size, msi_bands)), (sigma, sigma, 0)) * sigma
+              for sigma in (1, 3, 9))
+    return (1000 * msi).astype(np.float32)
+
+def write_pair(msi, hsi, out_dir):
+    """Write (rows, cols, bands) MSI and HSI arrays as GeoTIFFs and return their paths."""
+    paths = []
+    for name, data in (('msi.tif', msi), ('hsi.tif', hsi)):
+        path = os.path.join(out_dir, name)
+        with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1],
+                           count=data.shape[2], dtype='float32') as dst:
+            dst.write(np.moveaxis(data, -1, 0))
+        paths.append(path)
+    return paths
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MiB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': own * unit / 2**20, 'children': children * unit / 2**20}
+
+def timed(fn, *args, **kwargs):
+    """Call ``fn`` and return its result and the elapsed wall time in seconds."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def profile_patches(processor, coords, patch_size, n_sample, seed=0):
+    """Time the per-patch stages on a random sample of patch origins."""
+    rng = np.random.default_rng(seed)
+    sample = [coords[i] for i in rng.choice(len(coords), size=min(n_sample, len(coords)), replace=False)]
+    patches = [p for p in (processor.extract_patch(x, y, patch_size) for x, y in sample) if p is not None]
+    decomposition, sparse_coding = processor.decomposition, processor.sparse_coding
+    n = processor.n_components
+    times = dict.fromkeys(('wavelet', 'fastica', 'nmf', 'train_dictionary', 'fista', 'fista_batch',
+                           'overlap_add'), 0.0)
+
+    prepared = []
+    for (x, y), (hsi_patch, msi_lr_patch, msi_hr_patch) in zip(sample, patches):
+        wt, t = timed(decomposition.wavelet_3d_transform, hsi_patch, n)
+        times['wavelet'] += t
+        ica, t = timed(decomposition.fastica_decomposition, hsi_patch, n)
+        times['fastica'] += t
+        nmf, t = timed(decomposition.nmf_decomposition, hsi_patch, n)
+        times['nmf'] += t
+        components = np.hstack([wt, ica, nmf]).reshape(patch_size, patch_size, -1)
+
+        msi_lr_flat = msi_lr_patch.reshape(-1, msi_lr_patch.shape[-1])
+        D, t = timed(sparse_coding.train_dictionary, msi_lr_flat, components.reshape(-1, components.shape[-1]),
+                     processor.n_atoms)
+        times['train_dictionary'] += t
+        D = sparse_coding.patch_dictionary(msi_lr_patch, components, processor.n_atoms, D, 0)
+        msi_hr_flat = msi_hr_patch.reshape(-1, msi_hr_patch.shape[-1]).astype(sparse_coding.dtype)
+        _, t = timed(sparse_coding.fista, msi_hr_flat, D, processor.lambda_reg)
+        times['fista'] += t
+        prepared.append((x * processor.f, y * processor.f, msi_hr_flat, D,
+                         sparse_coding.upsampled_mean(components, processor.f, D.shape[0])))
+
+    results, times['fista_batch'] = timed(processor.solve_batch, prepared)
+    hsi_hr = np.zeros(processor.msi.shape[:2] + (processor.hsi.shape[2],), dtype=np.float32)
+    counts = np.zeros(processor.msi.shape[:2], dtype=np.int32)
+    _, times['overlap_add'] = timed(processor.accumulate, results, hsi_hr, counts)
+
+    n_timed = max(len(patches), 1)
+    return {name: {'seconds': seconds, 'per_patch_ms': 1000 * seconds / n_timed}
+            for name, seconds in times.items()}, len(patches)
+
+def compare(report, baseline, tolerance):
+    """Names of stages and scaling points more than ``tolerance`` slower than ``baseline``."""
+    regressions = []
+    for name, stage in report['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old and stage['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append(name)
+    old_scaling = {point['workers']: point for point in baseline.get('scaling', [])}
+    for point in report['scaling']:
+        old = old_scaling.get(point['workers'])
+        if old and point['patches_per_sec'] < old['patches_per_sec'] / (1 + tolerance):
+            regressions.append(f"patches_per_sec@{point['workers']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage timing, throughput and memory of the fusion pipeline")
+    parser.add_argument('--msi_path', type=str, default=None,
+                        help='Crop this MSI instead of a synthetic one (e.g. data/benchmark_sentinel.tif)')
+    parser.add_argument('--size', type=int, default=120, help='MSI size in pixels')
+    parser.add_argument('--bands', type=int, default=64, help='Number of HSI bands')
+    parser.add_argument('--msi_bands', type=int, default=12, help='Number of bands of the synthetic MSI')
+    parser.add_argument('--scale', type=int, default=3)
+    parser.add_argument('--patch_size', type=int, default=12)
+    parser.add_argument('--stride', type=int, default=4)
+    parser.add_argument('--engine', type=str, default='batch', choices=['patch', 'batch', 'incremental'])
+    parser.add_argument('--scheduler', type=str, default='process', choices=['joblib', 'process'])
+    parser.add_argument('--workers', type=str, default=None,
+                        help='Comma-separated worker counts for the scaling curve (default: all cores)')
+    parser.add_argument('--sample_patches', type=int, default=16,
+                        help='Patches to time the per-patch stages on')
+    parser.add_argument('--output', type=str, default='benchmarks/results/pipeline.json')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against the baseline')
+    args = parser.parse_args()
+    workers = [int(w) for w in args.workers.split(',')] if args.workers else [default_n_jobs()]
+
+    if args.msi_path:
+        with rasterio.open(args.msi_path) as src:
+            msi = np.moveaxis(src.read()[:, :args.size, :args.size].astype(np.float32), 0, -1)
+    else:
+        msi = synthetic_msi(args.size, args.msi_bands)
+    msi, hsi = mixed_pair(msi, args.bands, args.scale)
+    warm_up()
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        msi_path, hsi_path = write_pair(msi, hsi, tmp)
+        (msi, hsi), t = timed(HSIDataLoader().load_and_preprocess, msi_path, hsi_path)
+        stages['load_and_preprocess'] = {'seconds': t}
+
+    processor = PatchProcessor(hsi, msi)
+    processor.f = msi.shape[0] // hsi.shape[0]
+    processor.msi_lr = zoom(msi, (1 / processor.f, 1 / processor.f, 1), order=2, mode='nearest')
+    coords = processor.patch_coords(args.patch_size, args.stride)
+    patch_stages, n_sampled = profile_patches(processor, coords, args.patch_size, args.sample_patches)
+    stages.update(patch_stages)
+
+    scaling = []
+    for n_jobs in workers:
+        (hsi_hr, counts), t = timed(processor.run_parallel, args.patch_size, args.stride, engine=args.engine,
+                                    normalize=False, scheduler=args.scheduler, n_jobs=n_jobs)
+        scaling.append({'workers': n_jobs, 'seconds': t, 'patches_per_sec': len(coords) / t})
+        print(f"{n_jobs:>3} workers: {t:8.2f} s, {len(coords) / t:8.2f} patches/s")
+    valid_mask = counts > 0
+    hsi_hr[valid_mask] /= counts[valid_mask, np.newaxis]
+
+    guide = msi[..., HSIEnhancer.guide_bands(msi.shape[-1])].astype(np.float32)
+    upsampled, t = timed(HSIUpsampler.enhanced_hsi_upsampling, hsi, msi, guide)
+    stages['upsampling'] = {'seconds': t}
+    _, t = timed(HSIEnhancer.guided_filter_bands, guide, upsampled, hsi_hr, 1)
+    stages['guided_filter'] = {'seconds': t}
+
+    report = {
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'cores': default_n_jobs()},
+        'scene': {'msi_shape': list(msi.shape), 'hsi_shape': list(hsi.shape), 'patches': len(coords),
+                  'sampled_patches': n_sampled},
+        'stages': stages,
+        'scaling': scaling,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    for name, stage in stages.items():
+        print(f"{name:<22}{stage['seconds']:>10.3f} s")
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare the float32 and float64 patch-stage precisions on the benchmark scene.
+
+The scene is the one of ``benchmarks.dictionary_strategies``: a crop of
+``data/benchmark_sentinel.tif`` with a block-averaged HSI, so the MSI doubles
+as ground truth. For each precision the report gives the patch-stage and
+batched-FISTA times, the bytes of the FISTA inputs and work buffers, the
+gain/offset-matched RMSE and spectral angle against the truth (see
+``dictionary_strategies.truth_errors``) and the difference of the enhanced
+output from the float64 run.
+
+Run from the repository root::
+
+    python -m benchmarks.precision --stride 4
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from scipy.ndimage import zoom
+from src.decomposition import BatchDecomposition
+from src.enhancer import HSIEnhancer
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+from src.sparse_coding import SparseCoding
+from src.warmup import warm_up
+from .dictionary_strategies import simulate_pair, truth_errors
+
+def fista_bytes(prepared):
+    """Bytes of the stacked FISTA inputs (X, D) and of its four (samples, atoms) work buffers."""
+    X = sum(item[2].size for item in prepared)
+    D = sum(item[3].size for item in prepared)
+    buffers = 4 * sum(item[2].shape[0] * item[3].shape[1] for item in prepared)
+    return (X + D + buffers) * prepared[0][3].itemsize if prepared else 0
+
+def time_solve(hsi, msi, coords, patch_size, dtype, repeats):
+    """Prepare ``coords`` in ``dtype`` and return the best batched FISTA time and the bytes it streams."""
+    processor = PatchProcessor(hsi, msi)
+    processor.f = msi.shape[0] // hsi.shape[0]
+    processor.msi_lr = zoom(msi, (1 / processor.f, 1 / processor.f, 1), order=2, mode='nearest')
+    processor.decomposer = BatchDecomposition(n_components=processor.n_components, dtype=dtype)
+    processor.sparse_coding = SparseCoding(dtype)
+    prepared = [item for item, _ in processor.prepare_chunk(coords, patch_size) if item is not None]
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        processor.solve_batch(prepared)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), fista_bytes(prepared)
+
+def main():
+    parser = argparse.ArgumentParser(description="float32 vs float64 patch-stage runtime, memory and accuracy")
+    parser.add_argument('--msi_path', type=str, default='data/benchmark_sentinel.tif')
+    parser.add_argument('--scale', type=int, default=3)
+    parser.add_argument('--size', type=int, default=180, help='Crop size of the MSI in pixels')
+    parser.add_argument('--patch_size', type=int, default=12)
+    parser.add_argument('--stride', type=int, default=4)
+    parser.add_argument('--engine', type=str, default='batch', choices=['patch', 'batch', 'incremental'])
+    parser.add_argument('--solve_patches', type=int, default=256, help='Patches in the batched FISTA timing')
+    parser.add_argument('--repeats', type=int, default=5, help='Batched FISTA timings to take the best of')
+    args = parser.parse_args()
+    warm_up()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        msi_path, hsi_path, truth = simulate_pair(args.msi_path, tmp, args.scale, args.size)
+        enhancer = HSIEnhancer(msi_path, hsi_path)
+
+        outputs, rows = {}, []
+        for precision in ('float64', 'float32'):
+            metrics = PipelineMetrics()
+            outputs[precision] = enhancer.fuse_to_enhance(patch_size=args.patch_size, stride=args.stride,
+                                                          engine=args.engine, metrics=metrics,
+                                                          precision=precision)
+            coords = PatchProcessor(enhancer.hsi, enhancer.msi).patch_coords(args.patch_size, args.stride)
+            solve_seconds, solve_bytes = time_solve(enhancer.hsi, enhancer.msi, coords[:args.solve_patches],
+                                                    args.patch_size, PatchProcessor.PRECISIONS[precision],
+                                                    args.repeats)
+            rows.append((precision, metrics.stages['patches'], np.mean(metrics.fista_iterations),
+                         solve_seconds, solve_bytes))
+
+    reference = outputs['float64']
+    data_range = float(np.ptp(truth))
+    print(f"{'precision':<11}{'patches s':>11}{'FISTA it':>10}{'FISTA s':>10}{'FISTA MiB':>11}"
+          f"{'RMSE truth':>12}{'SAM deg':>9}{'max |d| f64':>13}{'RMSE d f64':>12}")
+    for precision, patch_seconds, iterations, solve_seconds, solve_bytes in rows:
+        output = outputs[precision]
+        diff = output.astype(np.float64) - reference
+        rmse_truth, sam = truth_errors(output, truth)
+        print(f"{precision:<11}{patch_seconds:>11.2f}{iterations:>10.1f}{solve_seconds:>10.3f}"
+              f"{solve_bytes / 2**20:>11.2f}{rmse_truth:>12.3f}{sam:>9.3f}{np.abs(diff).max():>13.4f}"
+              f"{np.sqrt(np.mean(diff ** 2)):>12.5f}")
+    print(f"Truth value range: {data_range:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare the tiled pipeline with and without prefetched reads and background writes.
+
+The scene is the one of ``benchmarks.dictionary_strategies``: a crop of
+``data/benchmark_sentinel.tif`` with a block-averaged HSI. Network-attached
+storage is modelled by sleeping ``--latency`` seconds in every raster window
+read and every output tile write. For each latency the tiled enhancement runs
+with ``prefetch=0`` (read, compute and write in turn) and with ``--prefetch``,
+and the report gives the wall time, the time spent waiting for tiles and
+writes, and the largest difference between the two outputs.
+
+Run from the repository root::
+
+    python -m benchmarks.prefetch --latency 0.5
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import rasterio
+from src.data_loader import HSIDataLoader
+from src.enhancer import TiledHSIEnhancer
+from src.metrics import PipelineMetrics
+from src.warmup import warm_up
+from src.writer import GeoTiffSink
+from .dictionary_strategies import simulate_pair
+
+def with_latency(read_window, latency):
+    """Wrap ``HSIDataLoader.read_window`` so every window read takes ``latency`` seconds longer."""
+    def read(src, window, indexes=None):
+        time.sleep(latency)
+        return read_window(src, window, indexes)
+    return staticmethod(read)
+
+class RemoteSink(GeoTiffSink):
+    """A GeoTIFF sink whose every write takes ``latency`` seconds longer."""
+
+    latency = 0.0
+
+    def write(self, row, col, block):
+        time.sleep(self.latency)
+        super().write(row, col, block)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled pipeline runtime with and without I/O overlap")
+    parser.add_argument('--msi_path', type=str, default='data/benchmark_sentinel.tif')
+    parser.add_argument('--scale', type=int, default=3)
+    parser.add_argument('--size', type=int, default=180, help='Crop size of the MSI in pixels')
+    parser.add_argument('--tile_size', type=int, default=8, help='Tile size in HSI pixels')
+    parser.add_argument('--patch_size', type=int, default=12)
+    parser.add_argument('--stride', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds added to every read and write')
+    parser.add_argument('--prefetch', type=int, default=2)
+    args = parser.parse_args()
+    warm_up()
+
+    read_window = HSIDataLoader.__dict__['read_window']
+    with tempfile.TemporaryDirectory() as tmp:
+        msi_path, hsi_path, _ = simulate_pair(args.msi_path, tmp, args.scale, args.size)
+        with rasterio.open(hsi_path) as src:
+            n_tiles = len(list(HSIDataLoader.tile_cores(src, args.tile_size)))
+        print(f"{'latency s':>10}{'prefetch':>10}{'tiles':>7}{'seconds':>10}{'speedup':>9}{'read wait':>11}"
+              f"{'write wait':>12}{'max |d|':>10}")
+        for latency in (0.0, args.latency):
+            HSIDataLoader.read_window = with_latency(read_window.__func__, latency)
+            RemoteSink.latency = latency
+            reference = None
+            for depth in (0, args.prefetch):
+                enhancer = TiledHSIEnhancer(msi_path, hsi_path, tile_size=args.tile_size, prefetch=depth)
+                output_path = os.path.join(tmp, f'out_{latency}_{depth}.tif')
+                metrics = PipelineMetrics()
+                start = time.perf_counter()
+                with RemoteSink(output_path, enhancer.output_shape) as sink:
+                    enhancer.fuse_to_sink(sink, os.path.join(tmp, f'scratch_{latency}_{depth}'),
+                                          patch_size=args.patch_size, stride=args.stride, engine='batch',
+                                          metrics=metrics)
+                elapsed = time.perf_counter() - start
+                with rasterio.open(output_path) as src:
+                    output = src.read()
+                if reference is None:
+                    reference = (output, elapsed)
+                print(f"{latency:>10.2f}{depth:>10}{n_tiles:>7}{elapsed:>10.2f}{reference[1] / elapsed:>9.2f}"
+                      f"{metrics.stages.get('read_wait', 0.0):>11.2f}{metrics.stages.get('write_wait', 0.0):>12.2f}"
+                      f"{np.abs(output - reference[0]).max():>10.4f}")
+        HSIDataLoader.read_window = read_window
+
+if __name__ == "__main__":
+    main()
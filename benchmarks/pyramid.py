@@ -0,0 +1,59 @@
+"""Trade accuracy for speed with the coarse-to-fine patch stage.
+
+The scene is the one of ``benchmarks.dictionary_strategies``: a crop of
+``data/benchmark_sentinel.tif`` with a block-averaged HSI. The full patch
+stage runs first as the reference, then ``fuse_to_enhance`` with every
+``--qualities`` value. The report gives the wall time, the patches solved,
+the RMSE of each output against the full run, and its gain/offset-matched
+RMSE and spectral angle against the truth (see
+``dictionary_strategies.truth_errors``).
+
+Run from the repository root::
+
+    python -m benchmarks.pyramid --stride 4 --qualities 0,0.25,0.5
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from src.enhancer import HSIEnhancer
+from src.metrics import PipelineMetrics
+from src.warmup import warm_up
+from .dictionary_strategies import simulate_pair, truth_errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Runtime and accuracy of the coarse-to-fine quality levels")
+    parser.add_argument('--msi_path', type=str, default='data/benchmark_sentinel.tif')
+    parser.add_argument('--scale', type=int, default=3)
+    parser.add_argument('--size', type=int, default=180, help='Crop size of the MSI in pixels')
+    parser.add_argument('--patch_size', type=int, default=12)
+    parser.add_argument('--stride', type=int, default=4)
+    parser.add_argument('--qualities', type=str, default='0,0.25,0.5')
+    parser.add_argument('--quality_tile', type=int, default=None)
+    parser.add_argument('--engine', type=str, default='batch', choices=['patch', 'batch', 'incremental'])
+    args = parser.parse_args()
+    warm_up()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        msi_path, hsi_path, truth = simulate_pair(args.msi_path, tmp, args.scale, args.size)
+        enhancer = HSIEnhancer(msi_path, hsi_path)
+
+    reference = None
+    print(f"{'quality':<9}{'patches':>9}{'seconds':>10}{'speedup':>9}{'RMSE full':>11}{'RMSE truth':>12}"
+          f"{'SAM deg':>9}")
+    for quality in [None] + [float(value) for value in args.qualities.split(',')]:
+        metrics = PipelineMetrics()
+        start = time.perf_counter()
+        output = enhancer.fuse_to_enhance(patch_size=args.patch_size, stride=args.stride, engine=args.engine,
+                                          metrics=metrics, quality=quality, quality_tile=args.quality_tile)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = (output, elapsed)
+        rmse_truth, sam = truth_errors(output, truth)
+        print(f"{'full' if quality is None else quality:<9}{metrics.patches['processed']:>9}{elapsed:>10.2f}"
+              f"{reference[1] / elapsed:>9.2f}{np.sqrt(np.mean((output - reference[0]) ** 2)):>11.3f}"
+              f"{rmse_truth:>12.3f}{sam:>9.3f}")
+    print(f"Output RMS of the full run: {np.sqrt(np.mean(reference[0] ** 2)):.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare the HSI resize kernels against the original skimage order-5 resize.
+
+A many-band truth cube is made by mixing the bands of a crop of
+``data/benchmark_sentinel.tif`` with random non-negative weights; the HSI
+is that cube block-averaged by ``--scale``. Each kernel upsamples the HSI
+back to the truth grid and is scored against the truth and against the
+original ``skimage.transform.resize(order=5)`` output.
+
+Run from the repository root::
+
+    python -m benchmarks.resize_kernels --bands 200
+"""
+import argparse
+import time
+import numpy as np
+import rasterio
+from skimage.transform import resize
+from src.upsampler import HSIUpsampler
+
+def simulate_cube(msi_path, size, scale, bands, seed=0):
+    """Truth cube of ``bands`` mixtures of the MSI bands and its block-averaged HSI."""
+    with rasterio.open(msi_path) as src:
+        msi = src.read()[:, :size, :size].astype(np.float32)
+    size = min(msi.shape[1], msi.shape[2])
+    size -= size % scale
+    msi = np.moveaxis(msi[:, :size, :size], 0, -1)
+    weights = np.random.default_rng(seed).random((msi.shape[2], bands)).astype(np.float32)
+    truth = msi @ (weights / weights.sum(axis=0))
+    hsi = truth.reshape(size // scale, scale, size // scale, scale, bands).mean(axis=(1, 3))
+    return truth, hsi
+
+def main():
+    parser = argparse.ArgumentParser(description="Resize kernel runtime/accuracy comparison")
+    parser.add_argument('--msi_path', type=str, default='data/benchmark_sentinel.tif')
+    parser.add_argument('--size', type=int, default=600, help='Crop size of the MSI in pixels')
+    parser.add_argument('--scale', type=int, default=3)
+    parser.add_argument('--bands', type=int, default=200)
+    parser.add_argument('--n_jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    truth, hsi = simulate_cube(args.msi_path, args.size, args.scale, args.bands)
+    shape = truth.shape[:2]
+
+    start = time.perf_counter()
+    reference = resize(hsi, truth.shape, order=5, mode='edge', anti_aliasing=False,
+                       preserve_range=True).astype(np.float32)
+    baseline = time.perf_counter() - start
+
+    print(f"{'kernel':<16}{'seconds':>10}{'speedup':>10}{'RMSE vs truth':>16}{'max vs skimage':>16}")
+    print(f"{'skimage order5':<16}{baseline:>10.2f}{1.0:>10.1f}"
+          f"{np.sqrt(np.mean((reference - truth) ** 2)):>16.3f}{0.0:>16.3g}")
+    for kernel in HSIUpsampler.RESIZE_HALO:
+        start = time.perf_counter()
+        output = HSIUpsampler.resize_hsi(hsi, shape, kernel, n_jobs=args.n_jobs)
+        elapsed = time.perf_counter() - start
+        rmse_truth = np.sqrt(np.mean((output - truth) ** 2))
+        max_diff = np.abs(output - reference).max()
+        print(f"{kernel:<16}{elapsed:>10.2f}{baseline / elapsed:>10.1f}{rmse_truth:>16.3f}{max_diff:>16.3g}")
+
+if __name__ == "__main__":
+    main()
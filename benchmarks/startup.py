@@ -0,0 +1,57 @@
+"""Measure process startup: package import and first-patch latency, cold and warm.
+
+Every measurement runs in a fresh interpreter. The first run uses an empty
+numba cache directory, so it includes JIT compilation; the later runs load
+the kernels that run compiled to disk.
+
+Run from the repository root::
+
+    python -m benchmarks.startup --runs 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from src import HSIDataLoader
+loader = time.perf_counter() - start
+from src import PatchProcessor
+import numpy as np
+imported = time.perf_counter() - start
+rng = np.random.default_rng(0)
+processor = PatchProcessor(rng.random((12, 12, 8)).astype(np.float32), rng.random((36, 36, 3)).astype(np.float32),
+                           n_components=3, n_atoms=3)
+processor.f = 3
+processor.msi_lr = processor.msi[::3, ::3]
+patch_start = time.perf_counter()
+processor.process_patch(0, 0, 12)
+first_patch = time.perf_counter() - patch_start
+print(json.dumps({'import_loader': loader, 'import_processor': imported, 'first_patch': first_patch,
+                  'total': time.perf_counter() - start}))
+"""
+
+def probe(env):
+    """Run the probe in a fresh interpreter and return its timings."""
+    output = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and first-patch latency of fresh processes")
+    parser.add_argument('--runs', type=int, default=3, help='Fresh processes to time, the first one cold')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir, PYTHONPATH=os.getcwd())
+        print(f"{'run':<8}{'import loader':>15}{'import all':>12}{'first patch':>13}{'total':>9}")
+        for run in range(args.runs):
+            t = probe(env)
+            print(f"{'cold' if run == 0 else 'warm':<8}{t['import_loader']:>15.2f}{t['import_processor']:>12.2f}"
+                  f"{t['first_patch']:>13.2f}{t['total']:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import argparse
+import json
 import logging
-import numpy as np
 import os
-from hsi_enhancement import HSIEnhancer
+from hsi_enhancement import (HSIEnhancer, TiledHSIEnhancer, SceneShards, BatchEnhancer, PipelineMetrics, ResultCache,
+                             Checkpoint, open_sink, write_blocks)
 
 def parse_arguments():
     """Parse command-line arguments for hyperparameters."""
@@ -19,10 +20,67 @@ def parse_arguments():
                         help='Radius for guided filter')
     parser.add_argument('--detail_weight', type=float, default=3.5,
                         help='Weight for MSI detail injection')
+    parser.add_argument('--resize_kernel', type=str, default='spline5', choices=['spline5', 'bicubic', 'lanczos'],
+                        help='Kernel for upsampling the HSI to the MSI grid')
     parser.add_argument('--output_path', type=str, default='output/hsi_enhanced.npy',
-                        help='Path to save enhanced HSI')
+                        help='Path to save enhanced HSI (.tif/.tiff for a tiled GeoTIFF, else .npy)')
+    parser.add_argument('--tile_size', type=int, default=0,
+                        help='Process out-of-core in tiles of this many HSI pixels (0 loads the full scene)')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='Tiles read ahead and finished tiles queued for background writes in tiled mode '
+                             '(0 runs reads, compute and writes in turn)')
+    parser.add_argument('--scratch_dir', type=str, default=None,
+                        help='Directory for tiled-mode accumulators (default: next to the output)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='Cache patch residuals here to reuse them across runs on the same scene')
+    parser.add_argument('--decompositions', type=str, default='wavelet,ica,nmf',
+                        help='Comma-separated patch decompositions: wavelet, ica, nmf, pca, global_ica, svd, nmf_mu')
+    parser.add_argument('--sparse_stride', type=int, default=None,
+                        help='Thin homogeneous patches to this stride (a multiple of --stride, at most --patch_size)')
+    parser.add_argument('--texture_threshold', type=float, default=0.2,
+                        help='Patches whose low-res MSI std / mean is below this are homogeneous')
+    parser.add_argument('--quality', type=float, default=None,
+                        help='Coarse-to-fine mode: refine only this fraction (0-1) of tiles at the full stride '
+                             'after a coarse patch pass (omit for the full patch stage)')
+    parser.add_argument('--quality_tile', type=int, default=None,
+                        help='Tile size in HSI pixels scored for refinement (default: --patch_size)')
+    parser.add_argument('--scheduler', type=str, default='joblib', choices=['joblib', 'process'],
+                        help='Run patches as joblib tasks or in a process pool over memory-mapped inputs')
+    parser.add_argument('--n_jobs', type=int, default=None,
+                        help='Patch-stage workers (default: the available cores)')
+    parser.add_argument('--precision', type=str, default='float32', choices=['float32', 'float64'],
+                        help='Floating-point precision of the patch stage')
+    parser.add_argument('--metrics_path', type=str, default=None,
+                        help='Write stage timings, patch counts and solver statistics here as JSON')
+    parser.add_argument('--checkpoint_dir', type=str, default=None,
+                        help='Periodically checkpoint the patch stage here (removed once the output is saved)')
+    parser.add_argument('--checkpoint_interval', type=float, default=600,
+                        help='Seconds between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume from a checkpoint of an identical interrupted run in --checkpoint_dir')
+    parser.add_argument('--shard_dir', type=str, default=None,
+                        help='Shared directory coordinating a scene sharded over machines')
+    parser.add_argument('--plan_shards', type=int, default=0,
+                        help='Split the scene into this many shards, write the manifest to --shard_dir and exit')
+    parser.add_argument('--shard', type=str, default=None,
+                        help='Run shard i/N of the plan in --shard_dir (plan it first with --plan_shards)')
+    parser.add_argument('--merge_shards', action='store_true',
+                        help='Merge the finished shards in --shard_dir into --output_path')
+    parser.add_argument('--batch', type=str, default=None,
+                        help='Enhance every msi_path,hsi_path,output_path triple of this CSV or JSON manifest '
+                             'in one warm process')
+    parser.add_argument('--report_path', type=str, default=None,
+                        help='Write the per-scene batch report here as JSON')
     return parser.parse_args()
 
+def write_metrics(metrics, metrics_path):
+    """Log the run's metrics summary and write it to ``metrics_path`` as JSON, if given."""
+    summary = metrics.summary()
+    logging.info(f"Run metrics: {json.dumps(summary)}")
+    if metrics_path:
+        with open(metrics_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
 def main():
     """ HSIEnhancer class with configurable hyperparameters."""
     # Configure logging
@@ -32,23 +90,130 @@ def main():
     args = parse_arguments()
 
     try:
-        # Initialize and run the enhancer
-        enhancer = HSIEnhancer(args.msi_path, args.hsi_path)
-        hsi_enhanced = enhancer.fuse_to_enhance(
-            patch_size=args.patch_size,
-            stride=args.stride,
-            guide_radius=args.guide_radius,
-            detail_weight=args.detail_weight
-        )
-
         # Create output directory if it doesn't exist
         os.makedirs(os.path.dirname(args.output_path), exist_ok=True)
+        metrics = PipelineMetrics()
 
-        # Save the enhanced HSI
-        np.save(args.output_path, hsi_enhanced)
-        
+        if args.batch:
+            # Many scenes in one process: workers and compiled kernels stay warm
+            if args.metrics_path or args.checkpoint_dir:
+                raise ValueError("--metrics_path and --checkpoint_dir cover a single scene; with --batch, "
+                                 "per-scene metrics are written to --report_path")
+            report = BatchEnhancer().run(
+                BatchEnhancer.read_manifest(args.batch),
+                patch_size=args.patch_size,
+                stride=args.stride,
+                guide_radius=args.guide_radius,
+                detail_weight=args.detail_weight,
+                resize_kernel=args.resize_kernel,
+                cache=ResultCache(args.cache_dir) if args.cache_dir else None,
+                decompositions=args.decompositions.split(','),
+                precision=args.precision,
+                sparse_stride=args.sparse_stride,
+                texture_threshold=args.texture_threshold,
+                quality=args.quality,
+                quality_tile=args.quality_tile,
+                scheduler=args.scheduler,
+                n_jobs=args.n_jobs
+            )
+            if args.report_path:
+                with open(args.report_path, 'w') as f:
+                    json.dump(report, f, indent=2)
+            n_failed = sum(entry['status'] == 'failed' for entry in report)
+            print(f"Batch completed: {len(report) - n_failed} of {len(report)} scenes enhanced")
+            for entry in report:
+                print(f"{entry['status']:>10} {entry['seconds']:8.1f} s  {entry['hsi_path']} -> {entry['output_path']}")
+            return None
+        sharded = bool(args.plan_shards or args.shard or args.merge_shards)
+        if (args.quality is not None or args.quality_tile is not None) and (sharded or args.tile_size > 0):
+            raise ValueError("--quality and --quality_tile need a single-scene or --batch run, "
+                             "not tiled or shard mode")
+        if sharded:
+            # Shard mode: every step coordinates only through files in --shard_dir
+            if not args.shard_dir:
+                raise ValueError("Shard mode needs --shard_dir")
+            shards = SceneShards(args.shard_dir)
+            if args.plan_shards:
+                shards.plan(args.msi_path, args.hsi_path, args.plan_shards, tile_size=args.tile_size or 256,
+                            patch_size=args.patch_size, stride=args.stride, guide_radius=args.guide_radius,
+                            detail_weight=args.detail_weight, resize_kernel=args.resize_kernel,
+                            decompositions=args.decompositions.split(','), precision=args.precision,
+                            sparse_stride=args.sparse_stride, texture_threshold=args.texture_threshold,
+                            scheduler=args.scheduler, n_jobs=args.n_jobs)
+            if args.shard:
+                index, n_shards = SceneShards.parse(args.shard)
+                if len(shards.manifest()['shards']) != n_shards:
+                    raise ValueError(f"--shard {args.shard} does not match the plan in {args.shard_dir}")
+                shards.run_shard(index, metrics)
+            if not args.merge_shards:
+                # Nothing is enhanced yet: report the manifest or the shard's tiles
+                write_metrics(metrics, args.metrics_path)
+                if args.shard:
+                    print(f"Shard {args.shard} done. Tiles saved to: {os.path.join(args.shard_dir, f'shard_{index}')}")
+                else:
+                    print(f"Planned {args.plan_shards} shards. Manifest saved to: {shards.manifest_path()}")
+                return None
+            output_shape = tuple(shards.manifest()['output_shape'])
+            hsi_enhanced = None
+            with open_sink(args.output_path, output_shape, reference_path=args.msi_path) as sink:
+                shards.merge(sink, args.scratch_dir or os.path.join(args.shard_dir, 'merge_scratch'), metrics)
+        elif args.tile_size > 0:
+            # Stream tiles from disk and write each finished tile to the output
+            enhancer = TiledHSIEnhancer(args.msi_path, args.hsi_path, tile_size=args.tile_size,
+                                        prefetch=args.prefetch)
+            scratch_dir = args.scratch_dir or os.path.splitext(args.output_path)[0] + '_scratch'
+            with open_sink(args.output_path, enhancer.output_shape, reference_path=args.msi_path) as sink:
+                enhancer.fuse_to_sink(
+                    sink, scratch_dir,
+                    patch_size=args.patch_size,
+                    stride=args.stride,
+                    guide_radius=args.guide_radius,
+                    detail_weight=args.detail_weight,
+                    resize_kernel=args.resize_kernel,
+                    metrics=metrics,
+                    decompositions=args.decompositions.split(','),
+                    precision=args.precision,
+                    sparse_stride=args.sparse_stride,
+                    texture_threshold=args.texture_threshold,
+                    scheduler=args.scheduler,
+                    n_jobs=args.n_jobs
+                )
+            output_shape = enhancer.output_shape
+            hsi_enhanced = None
+        else:
+            # Initialize and run the enhancer
+            enhancer = HSIEnhancer(args.msi_path, args.hsi_path)
+            checkpoint = Checkpoint(args.checkpoint_dir, args.checkpoint_interval, args.resume) \
+                if args.checkpoint_dir else None
+            hsi_enhanced = enhancer.fuse_to_enhance(
+                patch_size=args.patch_size,
+                stride=args.stride,
+                guide_radius=args.guide_radius,
+                detail_weight=args.detail_weight,
+                resize_kernel=args.resize_kernel,
+                cache=ResultCache(args.cache_dir) if args.cache_dir else None,
+                metrics=metrics,
+                decompositions=args.decompositions.split(','),
+                checkpoint=checkpoint,
+                precision=args.precision,
+                sparse_stride=args.sparse_stride,
+                texture_threshold=args.texture_threshold,
+                quality=args.quality,
+                quality_tile=args.quality_tile,
+                scheduler=args.scheduler,
+                n_jobs=args.n_jobs
+            )
+
+            # Save the enhanced HSI
+            with open_sink(args.output_path, hsi_enhanced.shape, reference_path=args.msi_path) as sink:
+                write_blocks(sink, hsi_enhanced)
+            if checkpoint is not None:
+                checkpoint.clear()
+            output_shape = hsi_enhanced.shape
+
+        write_metrics(metrics, args.metrics_path)
         logging.info("HSI enhancement completed successfully.")
-        print(f"HSI enhancement completed. Output shape: {hsi_enhanced.shape}")
+        print(f"HSI enhancement completed. Output shape: {output_shape}")
         print(f"Enhanced HSI saved to: {args.output_path}")
         
         return hsi_enhanced
@@ -1,15 +1,42 @@
-from .data_loader import HSIDataLoader
-from .decomposition import Decomposition
-from .sparse_coding import SparseCoding
-from .patch_processor import PatchProcessor
-from .upsampler import HSIUpsampler
-from .enhancer import HSIEnhancer
-
-__all__ = [
-    "HSIDataLoader",
-    "Decomposition",
-    "SparseCoding",
-    "PatchProcessor",
-    "HSIUpsampler",
-    "HSIEnhancer",
-]
+import importlib
+
+# Public names and the submodules defining them. Submodules are imported on
+# first attribute access, so e.g. ``HSIDataLoader`` does not pull in sklearn,
+# numba or cv2.
+_EXPORTS = {
+    "HSIDataLoader": "data_loader",
+    "TilePair": "data_loader",
+    "Decomposition": "decomposition",
+    "BatchDecomposition": "decomposition",
+    "SparseCoding": "sparse_coding",
+    "PatchProcessor": "patch_processor",
+    "HSIUpsampler": "upsampler",
+    "GuidedFilter": "guided_filter",
+    "HSIEnhancer": "enhancer",
+    "TiledHSIEnhancer": "enhancer",
+    "SceneShards": "sharding",
+    "BatchEnhancer": "batch",
+    "ValidityIndex": "validity",
+    "ResultCache": "cache",
+    "Checkpoint": "checkpoint",
+    "PipelineMetrics": "metrics",
+    "NpySink": "writer",
+    "GeoTiffSink": "writer",
+    "BackgroundSink": "writer",
+    "OverlapAccumulator": "writer",
+    "open_sink": "writer",
+    "write_blocks": "writer",
+    "warm_up": "warmup",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+class ResultCache:
+    """Content-addressed on-disk cache for patch residual fields and dictionaries.
+
+    Entries are ``.npz`` files named by a hash of the input arrays and the
+    parameters that produced them. Hits refresh an entry's modification time,
+    and writes evict the least recently used entries beyond ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=20 * 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(arrays, **params):
+        """Hash array contents, shapes and dtypes together with JSON-encoded parameters."""
+        digest = hashlib.blake2b(digest_size=20)
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(f"{array.shape}{array.dtype}".encode())
+            digest.update(memoryview(array).cast('B'))
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """File backing a cache key."""
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Return the cached arrays as a dict, or None on a miss."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            logging.error(f"Dropping unreadable cache entry {key}: {str(e)}")
+            os.remove(path)
+            return None
+        os.utime(path)
+        logging.info(f"Cache hit {key}")
+        return entry
+
+    def put(self, key, **arrays):
+        """Store named arrays under ``key`` and evict old entries over the size budget."""
+        path = self.path(key)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def remove(self, key):
+        """Delete the entry stored under ``key``, if any."""
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in ``max_bytes``."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def get_dictionaries(self, key):
+        """Return cached shared dictionaries keyed by tile, or None on a miss."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return {tuple(int(v) for v in name.split('_')): D for name, D in entry.items()}
+
+    def put_dictionaries(self, key, dictionaries):
+        """Store shared dictionaries keyed by tile."""
+        self.put(key, **{f"{k[0]}_{k[1]}": D for k, D in dictionaries.items()})
@@ -0,0 +1,63 @@
+import logging
+import time
+import numpy as np
+from .cache import ResultCache
+
+class Checkpoint:
+    """Periodic on-disk checkpoints of a patch run, for resuming after a crash or preemption.
+
+    A checkpoint holds the partial overlap-add accumulators and the patch origins
+    already added into them, stored as one ``.npz`` per run in ``directory``
+    (written atomically, see ``ResultCache``) and named by the same input and
+    parameter hash the result cache uses, so a checkpoint is only ever resumed
+    by an identical run. ``complete`` is called whenever the accumulators
+    contain every patch marked done so far, and saves at most once every
+    ``interval`` seconds. Existing checkpoints are only loaded with ``resume``.
+    One checkpoint may serve several runs in turn, e.g. the levels of
+    ``PatchProcessor.run_pyramid``; ``seconds`` is the current run's save time.
+    """
+
+    def __init__(self, directory, interval=600, resume=False):
+        self.store = ResultCache(directory, max_bytes=float('inf'))
+        self.interval = interval
+        self.resume = resume
+        self.seconds = 0.0
+        self.key = None
+        self.keys = []
+
+    def start(self, key, hsi_hr, counts):
+        """Bind a run's accumulators and restore them in place; returns the set of done origins."""
+        self.key, self.hsi_hr, self.counts = key, hsi_hr, counts
+        self.keys.append(key)
+        self.seconds = 0.0
+        self.done = []
+        self.last_save = time.perf_counter()
+        entry = self.store.get(key) if self.resume else None
+        if entry is None:
+            return set()
+        hsi_hr[...] = entry['hsi_hr']
+        counts[...] = entry['counts']
+        self.done = [tuple(int(v) for v in coord) for coord in entry['done']]
+        logging.info(f"Resuming from checkpoint {key}: {len(self.done)} patches done")
+        return set(self.done)
+
+    def complete(self, coords):
+        """Mark origins whose results are in the accumulators, saving if ``interval`` has elapsed."""
+        self.done.extend(coords)
+        if time.perf_counter() - self.last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """Write the accumulators and done origins now."""
+        start = time.perf_counter()
+        self.store.put(self.key, hsi_hr=self.hsi_hr, counts=self.counts,
+                       done=np.asarray(self.done, dtype=np.int32).reshape(-1, 2))
+        self.last_save = time.perf_counter()
+        self.seconds += self.last_save - start
+        logging.info(f"Checkpoint {self.key}: {len(self.done)} patches done")
+
+    def clear(self):
+        """Remove the checkpoints of every run bound so far, e.g. once the output is written."""
+        for key in self.keys:
+            self.store.remove(key)
+        self.keys = []
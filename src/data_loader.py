@@ -1,17 +1,33 @@
 import logging
+import os
+import time
+import warnings
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import numpy as np
 import rasterio
-from scipy.ndimage import median_filter
+from rasterio.windows import Window
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, filename='processing.log', filemode='w')
 
+# A preprocessed HSI/MSI tile pair. ``origin`` is the (row, col) of the HSI tile,
+# halo included, in scene pixels; ``core`` is the (row0, row1, col0, col1) range
+# of patch origins the tile owns. The MSI tile starts at ``origin`` times the scale.
+TilePair = namedtuple('TilePair', ['hsi', 'msi', 'origin', 'core', 'nodata'], defaults=(None,))
+
 class HSIDataLoader:
     """Handles loading and initial processing of HSI and MSI data."""
-    
+
+    # HSI-grid mask of the pixels without data in the last loaded scene, see ``nodata_mask``
+    nodata = None
+
     @staticmethod
     def load_image(file_path):
         """Load image using rasterio and convert to float32."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Image file not found: {file_path}")
         with rasterio.open(file_path) as src:
             img = src.read().astype(np.float32)
             img = np.moveaxis(img, 0, -1)
@@ -19,34 +35,216 @@ class HSIDataLoader:
         return img
 
     @staticmethod
-    def preprocess_data(data, window_size=3, nan_threshold=0.5):
-        """Preprocess data by handling NaNs and applying median filter."""
+    def read_window(src, window, indexes=None):
+        """Read one window of an open dataset as a float32 (rows, cols, bands) array."""
+        img = src.read(indexes, window=window).astype(np.float32)
+        img = np.moveaxis(img, 0, -1)
+        img[img <= 0] = np.nan
+        return img
+
+    @staticmethod
+    def band_statistics(src):
+        """Fraction of invalid pixels and min and max of the valid ones per band, accumulated block by block."""
+        invalid = np.zeros(src.count, dtype=np.int64)
+        band_min = np.full(src.count, np.inf)
+        band_max = np.full(src.count, -np.inf)
+        for _, window in src.block_windows(1):
+            block = src.read(window=window).reshape(src.count, -1).astype(np.float32)
+            valid = block > 0
+            invalid += (~valid).sum(axis=1)
+            band_min = np.minimum(band_min, np.where(valid, block, np.inf).min(axis=1))
+            band_max = np.maximum(band_max, np.where(valid, block, -np.inf).max(axis=1))
+        return invalid / float(src.width * src.height), band_min, band_max
+
+    @staticmethod
+    def nodata_mask(hsi, msi, chunk_rows=256):
+        """HSI-grid mask of pixels without data, taken before the gaps are filled.
+
+        A pixel has no data when all its HSI bands are NaN, or all bands of all
+        the MSI pixels it covers. MSI pixels missing past the MSI's edge count
+        as without data.
+        """
+        rows, cols = hsi.shape[:2]
+        f = max(msi.shape[0] // rows, 1)
+        mask = np.empty((rows, cols), dtype=bool)
+        for row in range(0, rows, chunk_rows):
+            end = min(row + chunk_rows, rows)
+            msi_nodata = np.ones(((end - row) * f, cols * f), dtype=bool)
+            block = np.isnan(msi[row * f:end * f, :cols * f]).all(axis=-1)
+            msi_nodata[:block.shape[0], :block.shape[1]] = block
+            mask[row:end] = np.isnan(hsi[row:end]).all(axis=-1) | \
+                msi_nodata.reshape(end - row, f, cols, f).all(axis=(1, 3))
+        return mask
+
+    @staticmethod
+    def prefetch(items, depth=2, metrics=None):
+        """Iterate over ``items`` while the next ``depth`` are produced on a background thread.
+
+        The reads and decompression of a tile stream then overlap with the
+        consumer's compute, and at most ``depth`` produced items wait in memory.
+        Errors are raised when their item is reached; ``depth=0`` produces every
+        item in the calling thread. Time the consumer spends waiting for items
+        is added to ``metrics`` as stage 'read_wait'.
+        """
+        items = iter(items)
+        done = object()
+        try:
+            with ThreadPoolExecutor(1) if depth > 0 else nullcontext() as reader:
+                pending = deque(reader.submit(next, items, done) for _ in range(depth))
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        item = pending.popleft().result() if pending else next(items, done)
+                        if metrics is not None:
+                            metrics.add_stage('read_wait', time.perf_counter() - start)
+                        if item is done:
+                            return
+                        if depth > 0:
+                            pending.append(reader.submit(next, items, done))
+                        yield item
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            # Only after the reader stopped, so a generator is never closed while running
+            if hasattr(items, 'close'):
+                items.close()
+
+    @staticmethod
+    def tile_cores(src, tile_size):
+        """Split a dataset into (row0, row1, col0, col1) tiles aligned to its block grid."""
+        block_rows, block_cols = src.block_shapes[0]
+        tile_rows = max(1, -(-tile_size // block_rows)) * block_rows
+        tile_cols = max(1, -(-tile_size // block_cols)) * block_cols
+        for row in range(0, src.height, tile_rows):
+            for col in range(0, src.width, tile_cols):
+                yield (row, min(row + tile_rows, src.height), col, min(col + tile_cols, src.width))
+
+    @staticmethod
+    def preprocess_data(data, window_size=3, nan_threshold=0.5, chunk_rows=256, chunk_samples=2**20):
+        """Preprocess data by filling NaNs in place.
+
+        Each NaN sample takes the NaN-ignoring median of its ``window_size`` spatial
+        window in the same band (edges repeat the border). Only the NaN samples'
+        neighborhoods are read, in chunks of ``chunk_samples``, so mostly valid
+        scenes cost a scan for NaNs and no full-cube copies. Samples whose window
+        is all NaN take the mean of the valid samples; an all-NaN cube becomes 0.
+        Float32 input is filled in place and returned.
+        """
         if data.ndim != 3:
             raise ValueError("Input data must be 3D (height, width, channels)")
-        valid_mask = ~np.isnan(data)
-        if np.any(valid_mask):
-            data_filled = np.where(valid_mask, data, median_filter(data, size=window_size, mode='nearest'))
-            data_filled = np.nan_to_num(data_filled, nan=np.nanmean(data_filled))
-        else:
-            data_filled = np.nan_to_num(data, nan=0)
-        return data_filled
+        data = np.asarray(data, dtype=np.float32)
+        height, width, _ = data.shape
+        found = [np.nonzero(np.isnan(data[row:row + chunk_rows])) for row in range(0, height, chunk_rows)]
+        rows = np.concatenate([index[0] + row for index, row in zip(found, range(0, height, chunk_rows))])
+        if rows.size == 0:
+            return data
+        cols = np.concatenate([index[1] for index in found])
+        bands = np.concatenate([index[2] for index in found])
+
+        radius = window_size // 2
+        d_rows, d_cols = np.mgrid[-radius:radius + 1, -radius:radius + 1].reshape(2, 1, -1)
+        fill = np.empty(rows.size, dtype=np.float32)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN windows are handled below
+            for start in range(0, rows.size, chunk_samples):
+                part = slice(start, start + chunk_samples)
+                window_rows = np.clip(rows[part, np.newaxis] + d_rows[0], 0, height - 1)
+                window_cols = np.clip(cols[part, np.newaxis] + d_cols[0], 0, width - 1)
+                fill[part] = np.nanmedian(data[window_rows, window_cols, bands[part, np.newaxis]], axis=1)
+
+        empty = np.isnan(fill)
+        if np.any(empty):
+            total, count = 0.0, 0
+            for row in range(0, height, chunk_rows):
+                chunk = data[row:row + chunk_rows]
+                valid = ~np.isnan(chunk)
+                total += chunk[valid].sum(dtype=np.float64)
+                count += valid.sum()
+            fill[empty] = total / count if count else 0
+        data[rows, cols, bands] = fill
+        return data
 
     def load_and_preprocess(self, msi_path, hsi_path, nan_threshold=0.5):
-        """Load and preprocess MSI and HSI images."""
-        msi = self.load_image(msi_path)
-        hsi = self.load_image(hsi_path)
-
-        # Filter out invalid HSI bands
-        valid_bands = np.isnan(hsi).mean(axis=(0, 1)) <= nan_threshold
-        eliminated_bands = np.where(~valid_bands)[0]
-        if len(eliminated_bands) > 0:
-            logging.info(f"Eliminated band numbers: {eliminated_bands}")
-        else:
-            logging.info("No bands were eliminated")
-        hsi = hsi[..., valid_bands]
+        """Load and preprocess MSI and HSI images.
+
+        The MSI is read on a background thread while the HSI is read and its
+        bands are screened. The scene's ``nodata_mask`` is kept as ``self.nodata``.
+        """
+        with ThreadPoolExecutor(1) as reader:
+            msi = reader.submit(self.load_image, msi_path)
+            hsi = self.load_image(hsi_path)
+
+            # Filter out invalid HSI bands
+            valid_bands = np.isnan(hsi).mean(axis=(0, 1)) <= nan_threshold
+            eliminated_bands = np.where(~valid_bands)[0]
+            if len(eliminated_bands) > 0:
+                logging.info(f"Eliminated band numbers: {eliminated_bands}")
+            else:
+                logging.info("No bands were eliminated")
+            hsi = hsi[..., valid_bands]
+            msi = msi.result()
 
         # Preprocess images
+        self.nodata = self.nodata_mask(hsi, msi)
         msi = self.preprocess_data(msi)
         hsi = self.preprocess_data(hsi)
 
         return msi, hsi
+
+    def valid_band_indexes(self, hsi_path, nan_threshold=0.5):
+        """Return the 1-based HSI band indexes kept by the NaN threshold, read block-wise."""
+        return self.scan_bands(hsi_path, nan_threshold)[0]
+
+    def scan_bands(self, hsi_path, nan_threshold=0.5, indexes=None):
+        """Scan the HSI block-wise for the kept band indexes and the (min, max) of their valid values.
+
+        The range is that of the preprocessed scene, since gaps are filled with
+        medians and means of valid values. Passing the kept ``indexes`` skips
+        the NaN threshold.
+        """
+        if not os.path.exists(hsi_path):
+            raise FileNotFoundError(f"Image file not found: {hsi_path}")
+        with rasterio.open(hsi_path) as hsi_src:
+            nan_fraction, band_min, band_max = self.band_statistics(hsi_src)
+        if indexes is None:
+            valid_bands = nan_fraction <= nan_threshold
+            eliminated_bands = np.where(~valid_bands)[0]
+            if len(eliminated_bands) > 0:
+                logging.info(f"Eliminated band numbers: {eliminated_bands}")
+            else:
+                logging.info("No bands were eliminated")
+            indexes = [int(band) + 1 for band in np.where(valid_bands)[0]]
+        kept = np.array(indexes, dtype=int) - 1
+        low, high = band_min[kept].min(initial=np.inf), band_max[kept].max(initial=-np.inf)
+        value_range = (float(low), float(high)) if low <= high else (0.0, 0.0)
+        return list(indexes), value_range
+
+    def iter_tiles(self, msi_path, hsi_path, tile_size=256, patch_size=12, window_size=3, nan_threshold=0.5,
+                   indexes=None, halo=None, cores=None):
+        """Stream preprocessed HSI/MSI tile pairs without reading either scene whole.
+
+        Tiles follow the HSI block grid and carry a halo of ``patch_size`` plus the
+        median window radius (or ``halo`` HSI pixels), so every patch whose origin
+        lies in a tile's core can be processed from that tile alone. Band
+        elimination uses scene-wide NaN fractions gathered in a block-wise first
+        pass unless the kept ``indexes`` are passed in. ``cores`` restricts the
+        stream to those tiles (see ``tile_cores``), e.g. one shard's. Each tile
+        carries its ``nodata_mask``.
+        """
+        if indexes is None:
+            indexes = self.valid_band_indexes(hsi_path, nan_threshold)
+        if not os.path.exists(msi_path):
+            raise FileNotFoundError(f"Image file not found: {msi_path}")
+        with rasterio.open(msi_path) as msi_src, rasterio.open(hsi_path) as hsi_src:
+            f = msi_src.height // hsi_src.height
+            if halo is None:
+                halo = patch_size + window_size // 2
+            for core in self.tile_cores(hsi_src, tile_size) if cores is None else cores:
+                row0, row1 = max(core[0] - halo, 0), min(core[1] + halo, hsi_src.height)
+                col0, col1 = max(core[2] - halo, 0), min(core[3] + halo, hsi_src.width)
+                hsi = self.read_window(hsi_src, Window(col0, row0, col1 - col0, row1 - row0), indexes)
+                msi = self.read_window(msi_src, Window(col0 * f, row0 * f, (col1 - col0) * f, (row1 - row0) * f))
+                nodata = self.nodata_mask(hsi, msi)
+                yield TilePair(self.preprocess_data(hsi, window_size), self.preprocess_data(msi, window_size),
+                               (row0, col0), core, nodata)
@@ -5,33 +5,226 @@ from sklearn.decomposition import FastICA, NMF
 class Decomposition:
     """Handles signal decomposition methods for HSI data."""
     
+    @staticmethod
+    def normalize_columns(W):
+        """Scale columns to unit norm, leaving all-zero columns untouched."""
+        norms = np.linalg.norm(W, axis=0, keepdims=True)
+        return W / np.where(norms > 0, norms, 1)
+
     @staticmethod
     def wavelet_3d_transform(data, n_components):
         """Apply 3D wavelet transform and extract components."""
         coeffs = pywt.wavedecn(data, 'db1', level=3)
-        approx = pywt.waverecn([coeffs[0]] + [None] * (len(coeffs) - 1), 'db1')
+        details = [{key: np.zeros_like(val) for key, val in level.items()} for level in coeffs[1:]]
+        approx = pywt.waverecn([coeffs[0]] + details, 'db1')
+        approx = approx[tuple(slice(0, n) for n in data.shape)]
         W = approx.reshape(-1, data.shape[-1])[:, :n_components]
         if W.shape[1] < n_components:
             W = np.pad(W, ((0, 0), (0, n_components - W.shape[1])), mode='constant')
-        return W / np.linalg.norm(W, axis=0, keepdims=True)
+        return Decomposition.normalize_columns(W)
 
     @staticmethod
-    def fastica_decomposition(data, n_components):
-        """Apply FastICA decomposition."""
-        transformer = FastICA(n_components=n_components, random_state=0, max_iter=200)
+    def fastica_decomposition(data, n_components, state=None):
+        """Apply FastICA decomposition.
+
+        A dict passed as ``state`` carries the unmixing matrix, recovered from the
+        fitted ``components_`` and ``whitening_``, to the next call, which starts
+        from it instead of a random matrix.
+        """
         data_2d = data.reshape(-1, data.shape[-1])
-        W = transformer.fit_transform(data_2d.T).T
-        if W.shape[0] < n_components:
-            W = np.pad(W, ((0, n_components - W.shape[0]), (0, 0)), mode='constant')
-        return W[:, :n_components] / np.linalg.norm(W[:, :n_components], axis=0, keepdims=True)
+        w_init = state.get('ica_unmixing') if state is not None else None
+        if w_init is not None and w_init.shape != (min(n_components, *data_2d.shape),) * 2:
+            w_init = None
+        transformer = FastICA(n_components=n_components, random_state=0, max_iter=200, w_init=w_init)
+        W = transformer.fit_transform(data_2d)
+        if state is not None:
+            # components_ is the unmixing matrix times whitening_; without whitening, start cold next time
+            whitening = getattr(transformer, 'whitening_', None)
+            state['ica_unmixing'] = transformer.components_ @ np.linalg.pinv(whitening) \
+                if whitening is not None else None
+        if W.shape[1] < n_components:
+            W = np.pad(W, ((0, 0), (0, n_components - W.shape[1])), mode='constant')
+        return Decomposition.normalize_columns(W[:, :n_components])
 
     @staticmethod
-    def nmf_decomposition(data, n_components):
-        """Apply NMF decomposition."""
-        transformer = NMF(n_components=n_components, init='random', random_state=0, max_iter=200)
+    def nmf_decomposition(data, n_components, state=None):
+        """Apply NMF decomposition.
+
+        A dict passed as ``state`` carries the spectral factors H to the next call,
+        which starts from them (with W fitted to H by least squares).
+        """
         data_2d = data.reshape(-1, data.shape[-1])
         data_2d = np.abs(data_2d)
-        W = transformer.fit_transform(data_2d.T).T
-        if W.shape[0] < n_components:
-            W = np.pad(W, ((0, n_components - W.shape[0]), (0, 0)), mode='constant')
-        return W[:, :n_components] / np.linalg.norm(W[:, :n_components], axis=0, keepdims=True)
+        H = state.get('nmf_components') if state is not None else None
+        if H is not None and H.shape == (n_components, data_2d.shape[1]):
+            transformer = NMF(n_components=n_components, init='custom', random_state=0, max_iter=200)
+            W_init = np.maximum(data_2d @ np.linalg.pinv(H), 1e-10).astype(data_2d.dtype)
+            W = transformer.fit_transform(data_2d, W=W_init, H=H.astype(data_2d.dtype))
+        else:
+            transformer = NMF(n_components=n_components, init='random', random_state=0, max_iter=200)
+            W = transformer.fit_transform(data_2d)
+        if state is not None:
+            state['nmf_components'] = transformer.components_
+        if W.shape[1] < n_components:
+            W = np.pad(W, ((0, 0), (0, n_components - W.shape[1])), mode='constant')
+        return Decomposition.normalize_columns(W[:, :n_components])
+
+class BatchDecomposition:
+    """Decompose a stack of patches at once with a configurable set of methods.
+
+    'wavelet', 'ica' and 'nmf' are the per-patch methods of ``Decomposition``
+    (the wavelet is computed for the whole stack in one transform). The fast
+    methods avoid fitting an estimator per patch:
+
+    - 'pca' and 'global_ica' project patch pixels onto a PCA or FastICA basis
+      fitted once by ``fit`` on pixels sampled from the whole HSI.
+    - 'svd' takes the leading left singular vectors of each centered patch by
+      randomized SVD, batched over patches.
+    - 'nmf_mu' runs multiplicative-update NMF on all patches together, each
+      from its own seeded start, so results do not depend on how patches are
+      batched.
+
+    ``transform`` takes an optional ``state`` dict that carries the fitted
+    factors of 'ica', 'nmf' and 'nmf_mu' from one call to the next, so that a
+    caller walking overlapping patches in order warm starts every solve.
+
+    Each method contributes ``n_components`` unit-norm columns per patch.
+    Patches are decomposed in ``dtype`` (float32 by default); global bases are
+    fitted in float64 and stored in ``dtype``.
+    """
+
+    METHODS = ('wavelet', 'ica', 'nmf', 'pca', 'global_ica', 'svd', 'nmf_mu')
+    DEFAULT = ('wavelet', 'ica', 'nmf')
+
+    def __init__(self, methods=DEFAULT, n_components=5, nmf_iter=50, seed=0, dtype=np.float32):
+        unknown = [method for method in methods if method not in self.METHODS]
+        if unknown or not methods:
+            raise ValueError(f"Unknown decomposition methods: {unknown or list(methods)}")
+        self.methods = tuple(methods)
+        self.n_components = n_components
+        self.nmf_iter = nmf_iter
+        self.seed = seed
+        self.dtype = np.dtype(dtype)
+        self.mean = None
+        self.pca_basis = None
+        self.ica = None
+
+    @property
+    def needs_fit(self):
+        """Whether a global basis must be fitted before ``transform``."""
+        return ('pca' in self.methods and self.pca_basis is None) or \
+               ('global_ica' in self.methods and self.ica is None)
+
+    def fit(self, hsi, n_samples=20000):
+        """Fit the global PCA and FastICA bases on finite pixels sampled from the HSI."""
+        pixels = hsi.reshape(-1, hsi.shape[-1])
+        pixels = pixels[np.isfinite(pixels).all(axis=1)].astype(np.float64)
+        rng = np.random.default_rng(self.seed)
+        if len(pixels) > n_samples:
+            pixels = pixels[rng.choice(len(pixels), size=n_samples, replace=False)]
+        mean = pixels.mean(axis=0)
+        self.mean = mean.astype(self.dtype)
+        if 'pca' in self.methods:
+            _, _, Vt = np.linalg.svd(pixels - mean, full_matrices=False)
+            self.pca_basis = Vt[:self.n_components].T.astype(self.dtype)
+        if 'global_ica' in self.methods:
+            n = min(self.n_components, pixels.shape[1], len(pixels))
+            self.ica = FastICA(n_components=n, random_state=self.seed, max_iter=200).fit(pixels)
+            self.ica.mean_ = self.ica.mean_.astype(self.dtype)
+            self.ica.components_ = self.ica.components_.astype(self.dtype)
+        return self
+
+    @staticmethod
+    def normalize_columns(W):
+        """Scale each patch's columns to unit norm, leaving all-zero columns untouched."""
+        norms = np.linalg.norm(W, axis=1, keepdims=True)
+        return W / np.where(norms > 0, norms, 1)
+
+    def fit_columns(self, W):
+        """Pad or crop (patches, pixels, k) blocks to ``n_components`` normalized columns."""
+        W = W[..., :self.n_components]
+        if W.shape[-1] < self.n_components:
+            W = np.pad(W, ((0, 0), (0, 0), (0, self.n_components - W.shape[-1])), mode='constant')
+        return self.normalize_columns(W)
+
+    def wavelet(self, patches):
+        """Level-3 Haar approximation of every patch, from one transform of the stack."""
+        coeffs = pywt.wavedecn(patches, 'db1', level=3, axes=(1, 2, 3))
+        details = [{key: np.zeros_like(val) for key, val in level.items()} for level in coeffs[1:]]
+        approx = pywt.waverecn([coeffs[0]] + details, 'db1', axes=(1, 2, 3))
+        approx = approx[tuple(slice(0, n) for n in patches.shape)]
+        return approx.reshape(patches.shape[0], -1, patches.shape[-1])
+
+    def randomized_svd(self, X, n_oversamples=5):
+        """Leading left singular vectors of every centered patch, with one power iteration."""
+        X = X - X.mean(axis=1, keepdims=True)
+        rank = min(self.n_components + n_oversamples, X.shape[1], X.shape[2])
+        omega = np.random.default_rng(self.seed).standard_normal((X.shape[2], rank)).astype(X.dtype)
+        Q, _ = np.linalg.qr(X @ omega)
+        Q, _ = np.linalg.qr(X @ (np.swapaxes(X, 1, 2) @ Q))
+        U, S, _ = np.linalg.svd(np.swapaxes(Q, 1, 2) @ X, full_matrices=False)
+        return (Q @ U) * S[:, np.newaxis, :]
+
+    def nmf_mu(self, X, H_init=None, eps=1e-10, state=None):
+        """Batched multiplicative-update NMF; returns the pixel factors W (patches, pixels, k).
+
+        Without ``H_init``, each patch starts from a seeded random matrix scaled
+        to its mean, so a patch's factors do not depend on the other patches in
+        ``X``. With a ``state`` dict, its 'nmf_mu_components' replace the random
+        start and the last patch's factors are stored there for the next call.
+        """
+        X = np.abs(X)
+        n_patches, _, n_bands = X.shape
+        k = self.n_components
+        if H_init is None and state is not None:
+            H_init = state.get('nmf_mu_components')
+        if H_init is None:
+            # Every patch starts from the same seeded matrix scaled to its own mean
+            means = X.mean(axis=(1, 2))
+            scale = np.sqrt(np.where(means > 0, means, k) / k)
+            H_init = scale[:, np.newaxis, np.newaxis] * np.random.default_rng(self.seed).random((1, k, n_bands))
+        H = np.broadcast_to(H_init, (n_patches, k, n_bands)).astype(X.dtype)
+        W, H = self.nmf_mu_iterations(X, H, self.nmf_iter, eps)
+        if state is not None:
+            state['nmf_mu_components'] = H[-1].copy()
+        return W
+
+    @staticmethod
+    def nmf_mu_iterations(X, H, n_iter, eps=1e-10):
+        """Multiplicative updates of W and H for stacked problems, starting from H."""
+        Ht = np.swapaxes(H, 1, 2)
+        W = np.maximum(X @ Ht @ np.linalg.pinv(H @ Ht), eps)
+        for _ in range(n_iter):
+            Wt = np.swapaxes(W, 1, 2)
+            H *= (Wt @ X) / (Wt @ W @ H + eps)
+            Ht = np.swapaxes(H, 1, 2)
+            W *= (X @ Ht) / (W @ (H @ Ht) + eps)
+        return W, H
+
+    def transform(self, patches, state=None):
+        """Decompose (patches, rows, cols, bands) into (patches, rows, cols, k * len(methods))."""
+        if self.needs_fit:
+            raise RuntimeError("Global bases are not fitted; call fit first")
+        patches = patches.astype(self.dtype, copy=False)
+        n_patches, rows, cols, n_bands = patches.shape
+        X = patches.reshape(n_patches, rows * cols, n_bands)
+        blocks = []
+        for method in self.methods:
+            if method == 'wavelet':
+                W = self.wavelet(patches)
+            elif method == 'ica':
+                W = np.stack([Decomposition.fastica_decomposition(patch, self.n_components, state)
+                              for patch in patches])
+            elif method == 'nmf':
+                W = np.stack([Decomposition.nmf_decomposition(patch, self.n_components, state)
+                              for patch in patches])
+            elif method == 'pca':
+                W = (X - self.mean) @ self.pca_basis
+            elif method == 'global_ica':
+                W = (X - self.ica.mean_) @ self.ica.components_.T
+            elif method == 'svd':
+                W = self.randomized_svd(X)
+            else:
+                W = self.nmf_mu(X, state=state)
+            blocks.append(self.fit_columns(W))
+        return np.concatenate(blocks, axis=-1).reshape(n_patches, rows, cols, -1)
@@ -1,36 +1,279 @@
+import logging
+import time
 import numpy as np
-import cv2
+import rasterio
 from .data_loader import HSIDataLoader
+from .decomposition import BatchDecomposition
+from .guided_filter import GuidedFilter
+from .metrics import PipelineMetrics
 from .patch_processor import PatchProcessor
 from .upsampler import HSIUpsampler
+from .writer import BackgroundSink, OverlapAccumulator
 
 class HSIEnhancer:
     """Main class for HSI resolution enhancement by MSI fusion."""
     
     def __init__(self, msi_path, hsi_path, n_components=5, n_atoms=5, lambda_reg=0.0005):
         self.loader = HSIDataLoader()
+        start = time.perf_counter()
         self.msi, self.hsi = self.loader.load_and_preprocess(msi_path, hsi_path)
+        self.nodata = self.loader.nodata
+        self.load_seconds = time.perf_counter() - start
         self.n_components = n_components
         self.n_atoms = n_atoms
         self.lambda_reg = lambda_reg
         self.upsampler = HSIUpsampler()
 
-    def fuse_to_enhance(self, patch_size=12, stride=1, guide_radius=1, detail_weight=3.5):
-        """Perform HSI enhancement by fusing with MSI."""
-        patch_processor = PatchProcessor(self.hsi, self.msi, self.n_components, self.n_atoms, self.lambda_reg)
-        hsi_hr = patch_processor.run_parallel(patch_size, stride)
-        selected_bands = [1, 7, 11]
-        msi_guide = self.msi[..., selected_bands].astype(np.float32)
-
-        hsi_upsampled = self.upsampler.enhanced_hsi_upsampling(self.hsi, self.msi, msi_guide, detail_weight)
-
-        for band in range(hsi_upsampled.shape[-1]):
-            hsi_hr_band = cv2.ximgproc.guidedFilter(
-                guide=msi_guide,
-                src=hsi_upsampled[..., band] + hsi_hr[..., band],
-                radius=guide_radius,
-                eps=0.0001
-            )
-            hsi_upsampled[..., band] = hsi_hr_band
-
-        return hsi_upsampled
+    @staticmethod
+    def guide_bands(n_bands):
+        """MSI bands used as the guide: 1, 7 and 11 for Sentinel-2, else the first three."""
+        return [1, 7, 11] if n_bands > 11 else list(range(min(3, n_bands)))
+
+    @staticmethod
+    def guided_filter_bands(msi_guide, hsi_upsampled, hsi_hr, guide_radius):
+        """Guided-filter every band of the upsampled HSI plus residual, in place."""
+        hsi_upsampled += hsi_hr[..., :hsi_upsampled.shape[-1]]
+        return GuidedFilter(msi_guide, guide_radius, eps=0.0001).filter(hsi_upsampled, out=hsi_upsampled)
+
+    def fuse_to_enhance(self, patch_size=12, stride=1, guide_radius=1, detail_weight=3.5,
+                        engine='patch', dictionary='patch', refine_iter=0, cache=None, resize_kernel='spline5',
+                        metrics=None, return_metrics=False, decompositions=BatchDecomposition.DEFAULT,
+                        checkpoint=None, precision='float32', sparse_stride=None, texture_threshold=0.2,
+                        quality=None, quality_tile=None, scheduler='joblib', n_jobs=None):
+        """Perform HSI enhancement by fusing with MSI.
+
+        ``engine``, ``dictionary`` and ``refine_iter`` select the FISTA engine and the
+        dictionary strategy, see ``PatchProcessor.run_parallel``. A ``ResultCache``
+        as ``cache`` reuses the patch residuals of earlier runs on the same scene,
+        so sweeps over ``guide_radius`` and ``detail_weight`` skip the patch stage.
+        ``resize_kernel`` selects the upsampling kernel, see ``HSIUpsampler.resize_hsi``.
+        ``decompositions`` selects the patch decompositions, see ``BatchDecomposition``.
+        A ``Checkpoint`` as ``checkpoint`` periodically saves the patch stage, and
+        one created with ``resume=True`` skips the patches an interrupted run finished.
+        ``precision`` is the patch-stage dtype, 'float32' or 'float64'. ``sparse_stride``
+        and ``texture_threshold`` thin homogeneous patches, see ``PatchProcessor.run_parallel``.
+        A ``quality`` between 0 and 1 runs the coarse-to-fine patch stage instead,
+        refining that fraction of the ``quality_tile`` tiles at the full ``stride``
+        (see ``PatchProcessor.run_pyramid``); lower values trade accuracy for speed.
+        ``scheduler='process'`` runs the patches in a process pool over memory-mapped
+        inputs instead of joblib tasks, on ``n_jobs`` workers (default: the available cores).
+
+        Stage times, patch outcomes and solver statistics are collected in a
+        ``PipelineMetrics`` (``metrics``, or a new one), kept as ``self.metrics``,
+        and with ``return_metrics=True`` returned as ``(hsi_enhanced, metrics)``.
+        """
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        self.metrics = metrics
+        metrics.add_stage('load_and_preprocess', self.load_seconds)
+
+        patch_processor = PatchProcessor(self.hsi, self.msi, self.n_components, self.n_atoms, self.lambda_reg,
+                                         self.nodata)
+        options = dict(engine=engine, dictionary=dictionary, refine_iter=refine_iter, cache=cache, metrics=metrics,
+                       decompositions=decompositions, checkpoint=checkpoint, precision=precision,
+                       sparse_stride=sparse_stride, texture_threshold=texture_threshold, scheduler=scheduler,
+                       n_jobs=n_jobs)
+        if quality is None:
+            hsi_hr = patch_processor.run_parallel(patch_size, stride, **options)
+        else:
+            hsi_hr = patch_processor.run_pyramid(patch_size, stride, quality, quality_tile, **options)
+        msi_guide = self.msi[..., self.guide_bands(self.msi.shape[-1])].astype(np.float32)
+
+        with metrics.stage('upsampling'):
+            hsi_upsampled = self.upsampler.enhanced_hsi_upsampling(self.hsi, self.msi, msi_guide, detail_weight,
+                                                                   resize_kernel)
+
+        with metrics.stage('guided_filter'):
+            hsi_enhanced = self.guided_filter_bands(msi_guide, hsi_upsampled, hsi_hr, guide_radius)
+        return (hsi_enhanced, metrics) if return_metrics else hsi_enhanced
+
+class TiledHSIEnhancer:
+    """Out-of-core HSI enhancement that streams tiles from disk into an output sink.
+
+    Only band indexes, the HSI value range and raster sizes are read up front;
+    pass the kept 1-based ``indexes`` and their ``value_range`` to skip the band
+    scan. Every tile is upsampled and clipped to the scene's value range, as
+    the in-memory path is. The output grid is the HSI grid times the
+    integer scale factor. The next ``prefetch`` tiles are read and preprocessed
+    on a background thread while the current one is processed, and up to
+    ``prefetch`` finished tiles are written on another; 0 runs every stage in
+    turn.
+    """
+
+    def __init__(self, msi_path, hsi_path, n_components=5, n_atoms=5, lambda_reg=0.0005, tile_size=256,
+                 indexes=None, prefetch=2, value_range=None):
+        self.msi_path = msi_path
+        self.hsi_path = hsi_path
+        self.n_components = n_components
+        self.n_atoms = n_atoms
+        self.lambda_reg = lambda_reg
+        self.tile_size = tile_size
+        self.prefetch = prefetch
+        self.loader = HSIDataLoader()
+        self.upsampler = HSIUpsampler()
+        if indexes is None or value_range is None:
+            indexes, value_range = self.loader.scan_bands(hsi_path, indexes=indexes)
+        self.indexes = list(indexes)
+        self.value_range = tuple(value_range)
+        with rasterio.open(msi_path) as msi_src, rasterio.open(hsi_path) as hsi_src:
+            self.f = msi_src.height // hsi_src.height
+            self.msi_shape = (msi_src.height, msi_src.width)
+            self.msi_bands = msi_src.count
+            self.output_shape = (hsi_src.height * self.f, hsi_src.width * self.f, len(self.indexes))
+
+    def tiles(self, patch_size, halo, cores=None, metrics=None):
+        """Stream prefetched tile pairs for this scene, optionally only those with the given cores."""
+        return self.loader.prefetch(self.loader.iter_tiles(self.msi_path, self.hsi_path, self.tile_size, patch_size,
+                                                           indexes=self.indexes, halo=halo, cores=cores),
+                                    self.prefetch, metrics)
+
+    @staticmethod
+    def check_options(options):
+        """Validate patch-stage options for a tile-by-tile run and return the options to use.
+
+        Options that need the whole scene in memory are rejected. A ``'global'``
+        dictionary would be learned from each tile alone, so it is mapped to
+        ``'tile'`` dictionaries with a warning.
+        """
+        unsupported = sorted({'quality', 'quality_tile'} & set(options))
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} (the coarse-to-fine patch stage) ranks tiles across the "
+                             f"whole scene and is not supported tile by tile; use HSIEnhancer")
+        if options.get('dictionary') == 'global':
+            logging.warning("dictionary='global' cannot be learned across tiles; using dictionary='tile'")
+            options = dict(options, dictionary='tile')
+        return options
+
+    def halo(self, patch_size, guide_radius, resize_kernel='spline5', window_size=3):
+        """Tile halo in HSI pixels: the largest context any stage reads beyond a core.
+
+        Patches reach ``patch_size`` pixels. An output pixel reads the guided
+        filter's two box passes of ``guide_radius`` and the gaussian high-pass
+        (4 sigma) at MSI resolution, on top of the resize kernel's
+        ``HSIUpsampler.RESIZE_HALO``. Both read pixels filled by the median
+        window, which adds its radius.
+        """
+        patches = patch_size
+        filters = -(-(2 * guide_radius + 4) // self.f)
+        resize = HSIUpsampler.RESIZE_HALO[resize_kernel]
+        return max(patches, resize + filters) + window_size // 2
+
+    def fuse_to_sink(self, sink, scratch_dir, patch_size=12, stride=1, guide_radius=1, detail_weight=3.5,
+                     resize_kernel='spline5', metrics=None, **options):
+        """Enhance the scene tile by tile and write finished tiles to ``sink``.
+
+        The first pass overlap-adds patch residuals into disk-backed accumulators in
+        ``scratch_dir`` and gathers the scene-wide band and guide statistics the
+        upsampler normalizes with. The second pass upsamples, injects details and
+        guided-filters each tile, then writes its core. ``options`` are passed to
+        ``PatchProcessor.run_parallel``; ``quality`` is not supported and
+        ``dictionary='global'`` runs as ``'tile'``, see ``check_options``. Returns
+        the run's ``PipelineMetrics`` (``metrics``, or a new one), with stage
+        times summed over tiles.
+        """
+        options = self.check_options(options)
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        halo = self.halo(patch_size, guide_radius, resize_kernel)
+        f = self.f
+        accumulator = OverlapAccumulator(scratch_dir, self.output_shape)
+        stats = self.residual_pass(
+            self.tiles(patch_size, halo, metrics=metrics),
+            lambda tile, hsi_hr, counts: accumulator.add(tile.origin[0] * f, tile.origin[1] * f, hsi_hr, counts),
+            patch_size, stride, resize_kernel, metrics, **options)
+        accumulator.flush()
+        self.finish_pass(sink, accumulator, stats, self.tiles(patch_size, halo, metrics=metrics), guide_radius,
+                         detail_weight, resize_kernel, metrics)
+        return metrics
+
+    def residual_pass(self, tiles, on_tile, patch_size=12, stride=1, resize_kernel='spline5', metrics=None,
+                      **options):
+        """Run the patch stage over ``tiles`` and gather the statistics of their cores.
+
+        Each tile's raw residual sums and counts are passed to ``on_tile(tile, hsi_hr, counts)``.
+        Returns the statistics as a dict of arrays; the statistics of disjoint sets of
+        tiles combine with ``merge_statistics``.
+        """
+        options = self.check_options(options)
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        guide_bands = HSIEnhancer.guide_bands(self.msi_bands)
+        n_bands = self.output_shape[2]
+        processor = PatchProcessor(None, None, self.n_components, self.n_atoms, self.lambda_reg)
+        stats = {name: np.zeros(n_bands) for name in ('hsi_sum', 'hsi_sq', 'up_sum', 'up_sq', 'up_high')}
+        stats.update({name: np.zeros(()) for name in ('hsi_n', 'high_sum', 'high_sq', 'n')})
+        stats.update(guide_min=np.array(np.inf), guide_max=np.array(-np.inf))
+
+        tiles = processor.run_tiles(tiles, patch_size, stride, self.msi_shape, metrics=metrics, **options)
+        for tile, hsi_hr, counts in tiles:
+            on_tile(tile, hsi_hr, counts)
+            core, core_hr = self.core_slices(tile)
+
+            core_sum, core_sq, core_n = self.upsampler.band_moments(tile.hsi[core])
+            stats['hsi_sum'] += core_sum
+            stats['hsi_sq'] += core_sq
+            stats['hsi_n'] += core_n
+
+            msi_guide = tile.msi[..., guide_bands]
+            up = self.upsampler.resize_hsi(tile.hsi, tile.msi.shape[:2], resize_kernel,
+                                           clip_range=self.value_range)[core_hr].reshape(-1, n_bands)
+            high = self.upsampler.guide_high_pass(msi_guide)[core_hr].reshape(-1).astype(np.float64)
+            gray = np.mean(msi_guide[core_hr], axis=-1)
+            stats['guide_min'] = np.minimum(stats['guide_min'], gray.min())
+            stats['guide_max'] = np.maximum(stats['guide_max'], gray.max())
+            stats['up_sum'] += up.sum(axis=0)
+            stats['up_sq'] += (up.astype(np.float64) ** 2).sum(axis=0)
+            stats['up_high'] += high @ up
+            stats['high_sum'] += high.sum()
+            stats['high_sq'] += high @ high
+            stats['n'] += high.shape[0]
+        return stats
+
+    @staticmethod
+    def merge_statistics(parts):
+        """Combine ``residual_pass`` statistics of disjoint sets of tiles."""
+        parts = list(parts)
+        merged = {name: sum(part[name] for part in parts) for name in parts[0]}
+        merged['guide_min'] = np.min([part['guide_min'] for part in parts])
+        merged['guide_max'] = np.max([part['guide_max'] for part in parts])
+        return merged
+
+    def finish_pass(self, sink, accumulator, stats, tiles, guide_radius=1, detail_weight=3.5,
+                    resize_kernel='spline5', metrics=None):
+        """Upsample, inject details into and guided-filter each tile, and write its core to ``sink``.
+
+        ``accumulator`` holds the scene's residual sums and counts and ``stats`` the
+        scene-wide statistics of ``residual_pass``. Cores are written in the
+        background (see ``BackgroundSink``) and all are written on return.
+        """
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        f = self.f
+        guide_bands = HSIEnhancer.guide_bands(self.msi_bands)
+        hsi_means = stats['hsi_sum'] / stats['hsi_n']
+        hsi_stds = np.sqrt(np.maximum(stats['hsi_sq'] / stats['hsi_n'] - hsi_means ** 2, 0))
+        weight = detail_weight / (stats['guide_max'] - stats['guide_min'] + 1e-6)
+        band_means = (stats['up_sum'] + weight * stats['high_sum']) / stats['n']
+        band_sq = (stats['up_sq'] + 2 * weight * stats['up_high'] + weight ** 2 * stats['high_sq']) / stats['n']
+        band_stds = np.sqrt(np.maximum(band_sq - band_means ** 2, 0))
+
+        with BackgroundSink(sink, self.prefetch, metrics) as writer:
+            for tile in tiles:
+                msi_guide = tile.msi[..., guide_bands].astype(np.float32)
+                with metrics.stage('upsampling'):
+                    enhanced = self.upsampler.resize_hsi(tile.hsi, tile.msi.shape[:2], resize_kernel,
+                                                         clip_range=self.value_range)
+                    enhanced += weight * self.upsampler.guide_high_pass(msi_guide)[..., np.newaxis]
+                    self.upsampler.match_band_stats(enhanced, hsi_means, hsi_stds, band_means, band_stds)
+
+                row, col = tile.origin[0] * f, tile.origin[1] * f
+                hsi_hr = accumulator.read(row, row + enhanced.shape[0], col, col + enhanced.shape[1])
+                with metrics.stage('guided_filter'):
+                    HSIEnhancer.guided_filter_bands(msi_guide, enhanced, hsi_hr, guide_radius)
+
+                _, core_hr = self.core_slices(tile)
+                writer.write(tile.core[0] * f, tile.core[2] * f, enhanced[core_hr])
+        return metrics
+
+    def core_slices(self, tile):
+        """Slices of a tile's core at HSI and at MSI resolution, relative to the tile."""
+        row0, row1 = tile.core[0] - tile.origin[0], tile.core[1] - tile.origin[0]
+        col0, col1 = tile.core[2] - tile.origin[1], tile.core[3] - tile.origin[1]
+        f = self.f
+        return (np.s_[row0:row1, col0:col1], np.s_[row0 * f:row1 * f, col0 * f:col1 * f])
@@ -0,0 +1,109 @@
+import numpy as np
+import numba as nb
+import cv2
+
+@nb.njit(parallel=True, cache=True)
+def _guide_products(guide, p, out):
+    """Products of every guide channel with every band, as (rows, cols, channels, bands)."""
+    rows, cols, n_channels = guide.shape
+    for r in nb.prange(rows):
+        for c in range(cols):
+            for ch in range(n_channels):
+                g = guide[r, c, ch]
+                for k in range(p.shape[2]):
+                    out[r, c, ch, k] = g * p[r, c, k]
+
+@nb.njit(parallel=True, cache=True)
+def _linear_coefficients(mean_guide, inv_cov, mean_p, mean_ip, a, b):
+    """Per-pixel coefficients a = inv(cov_I + eps) cov_Ip and offsets b = mean_p - a . mean_I."""
+    rows, cols, n_channels = mean_guide.shape
+    n_bands = mean_p.shape[2]
+    for r in nb.prange(rows):
+        for c in range(cols):
+            # Bands are innermost so every update is a contiguous, vectorizable run
+            for k in range(n_bands):
+                b[r, c, k] = mean_p[r, c, k]
+            for i in range(n_channels):
+                for k in range(n_bands):
+                    a[r, c, i, k] = 0
+                for j in range(n_channels):
+                    weight = inv_cov[r, c, i, j]
+                    mean_j = mean_guide[r, c, j]
+                    for k in range(n_bands):
+                        a[r, c, i, k] += weight * (mean_ip[r, c, j, k] - mean_j * mean_p[r, c, k])
+                mean_i = mean_guide[r, c, i]
+                for k in range(n_bands):
+                    b[r, c, k] -= a[r, c, i, k] * mean_i
+
+@nb.njit(parallel=True, cache=True)
+def _combine(guide, mean_a, mean_b, out):
+    """Filter output q = mean_a . I + mean_b."""
+    rows, cols, n_channels = guide.shape
+    for r in nb.prange(rows):
+        for c in range(cols):
+            for k in range(mean_b.shape[2]):
+                out[r, c, k] = mean_b[r, c, k]
+            for ch in range(n_channels):
+                g = guide[r, c, ch]
+                for k in range(mean_b.shape[2]):
+                    out[r, c, k] += mean_a[r, c, ch, k] * g
+
+class GuidedFilter:
+    """Guided filter with one guide shared by every band of a cube.
+
+    The guide's box statistics and the per-pixel inverse of its regularized
+    covariance are computed once, then applied to bands in chunks. Results
+    match ``cv2.ximgproc.guidedFilter`` run band by band.
+    """
+
+    # cv2.boxFilter accepts at most this many channels per call
+    MAX_CHANNELS = 128
+
+    def __init__(self, guide, radius, eps=0.0001):
+        self.radius = radius
+        self.guide = np.ascontiguousarray(np.atleast_3d(guide), dtype=np.float32)
+        n_channels = self.guide.shape[-1]
+
+        self.mean_guide = self.box(self.guide)
+        cov = np.empty(self.guide.shape[:2] + (n_channels, n_channels), dtype=np.float64)
+        for i in range(n_channels):
+            for j in range(i, n_channels):
+                cov[..., i, j] = self.box(self.guide[..., i] * self.guide[..., j]) - \
+                                 self.mean_guide[..., i] * self.mean_guide[..., j]
+                cov[..., j, i] = cov[..., i, j]
+        cov += eps * np.eye(n_channels)
+        self.inv_cov = np.linalg.inv(cov).astype(np.float32)
+
+    def box(self, data):
+        """Mean over a (2r+1)^2 window with reflected borders, for any number of bands."""
+        size = (2 * self.radius + 1, 2 * self.radius + 1)
+        if data.ndim == 2 or data.shape[-1] <= self.MAX_CHANNELS:
+            return np.atleast_3d(cv2.boxFilter(np.ascontiguousarray(data), -1, size,
+                                               borderType=cv2.BORDER_REFLECT)).reshape(data.shape)
+        return np.concatenate([self.box(data[..., start:start + self.MAX_CHANNELS])
+                               for start in range(0, data.shape[-1], self.MAX_CHANNELS)], axis=-1)
+
+    def filter(self, src, out=None, chunk_size=32):
+        """Filter every band of a (rows, cols, bands) cube; ``out`` may be ``src`` itself."""
+        src = np.atleast_3d(src)
+        if out is None:
+            out = np.empty(src.shape, dtype=np.float32)
+        n_channels = self.guide.shape[-1]
+        for start in range(0, src.shape[-1], chunk_size):
+            p = np.ascontiguousarray(src[..., start:start + chunk_size], dtype=np.float32)
+
+            # Channels and bands share the last axis so each box pass is one call
+            shape = p.shape[:2] + (n_channels * p.shape[2],)
+            products = np.empty(p.shape[:2] + (n_channels, p.shape[2]), dtype=np.float32)
+            _guide_products(self.guide, p, products)
+            mean_ip = self.box(products.reshape(shape)).reshape(products.shape)
+
+            # The products are no longer needed, so the coefficients reuse their buffer
+            a, b = products, np.empty(p.shape, dtype=np.float32)
+            _linear_coefficients(self.mean_guide, self.inv_cov, self.box(p), mean_ip, a, b)
+            mean_a = self.box(a.reshape(shape)).reshape(a.shape)
+
+            q = np.empty(p.shape, dtype=np.float32)
+            _combine(self.guide, mean_a, self.box(b), q)
+            out[..., start:start + chunk_size] = q
+        return out
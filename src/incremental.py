@@ -0,0 +1,60 @@
+import numpy as np
+
+class RowStatistics:
+    """Running fill statistics for the patches of one patch row.
+
+    Patches that share a row origin ``x`` only differ by the columns they
+    cover, so the per-column sums and counts of the row strip are computed
+    once and turned into prefix sums. The fill values of any patch in the row
+    (the means ``PatchProcessor.extract_patch`` uses for missing pixels) are
+    then two lookups instead of a pass over the patch.
+    """
+
+    def __init__(self, hsi, msi_lr, msi, x, patch_size, f):
+        self.patch_size = patch_size
+        self.f = f
+        hsi_strip = hsi[x:x + patch_size]
+        lr_strip = msi_lr[x:x + patch_size]
+        hr_strip = msi[x * f:(x + patch_size) * f]
+
+        valid = np.isfinite(hsi_strip).all(axis=-1) & np.isfinite(lr_strip).all(axis=-1)
+        self.n_hsi_bands = hsi_strip.shape[-1]
+        self.n_lr_bands = lr_strip.shape[-1]
+        self.valid = self.prefix(valid.sum(axis=0))
+        self.hsi_sum = self.prefix(np.where(valid[..., np.newaxis], hsi_strip, 0).sum(axis=(0, 2), dtype=np.float64))
+        self.lr_sum = self.prefix(np.where(valid[..., np.newaxis], lr_strip, 0).sum(axis=(0, 2), dtype=np.float64))
+        finite = np.isfinite(hr_strip)
+        self.hr_sum = self.prefix(np.where(finite, hr_strip, 0).sum(axis=(0, 2), dtype=np.float64))
+        self.hr_count = self.prefix(finite.sum(axis=(0, 2)))
+
+    @staticmethod
+    def prefix(values):
+        """Prefix sums with a leading zero, so a window sum is ``p[end] - p[start]``."""
+        return np.concatenate([[0], np.cumsum(values, dtype=np.float64)])
+
+    def patch(self, y):
+        """Valid pixel count and HSI, low-res MSI and high-res MSI fill means of the patch at column ``y``."""
+        end = y + self.patch_size
+        n_valid = int(self.valid[end] - self.valid[y])
+        hr_start, hr_end = y * self.f, end * self.f
+        hr_count = self.hr_count[hr_end] - self.hr_count[hr_start]
+        if n_valid == 0:
+            return 0, np.nan, np.nan, np.nan
+        hsi_mean = (self.hsi_sum[end] - self.hsi_sum[y]) / (n_valid * self.n_hsi_bands)
+        lr_mean = (self.lr_sum[end] - self.lr_sum[y]) / (n_valid * self.n_lr_bands)
+        hr_mean = (self.hr_sum[hr_end] - self.hr_sum[hr_start]) / hr_count if hr_count else np.nan
+        return n_valid, hsi_mean, lr_mean, hr_mean
+
+def shift_coefficients(alpha, side, offset):
+    """Shift (side * side, atoms) pixel coefficients left by ``offset`` columns.
+
+    The coefficients of the previous patch in a row become the starting point of
+    the next one; the columns entering on the right start from zero. Returns None
+    when the patches do not overlap.
+    """
+    if offset >= side:
+        return None
+    grid = alpha.reshape(side, side, -1)
+    shifted = np.zeros_like(grid)
+    shifted[:, :side - offset] = grid[:, offset:]
+    return shifted.reshape(alpha.shape)
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+def worker_id():
+    """Identify the process and thread running a task."""
+    return f"{os.getpid()}:{threading.current_thread().name}"
+
+class PipelineMetrics:
+    """Stage timings, patch outcomes and solver statistics of one enhancement run.
+
+    Patch workers return a plain record dict per patch (status, seconds, worker,
+    and when available the FISTA iteration count and dictionary time), which the
+    main process passes to ``record_patch``; this works the same for thread, loky
+    and process-pool workers. Callbacks added with ``add_callback`` are called as
+    ``callback(event, data)`` for every 'stage' and 'patch' event, and for
+    'skipped' events counting patches dropped before scheduling.
+    """
+
+    STATUSES = ('processed', 'skipped', 'failed')
+
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+        self.stages = {}
+        self.patches = dict.fromkeys(self.STATUSES, 0)
+        self.workers = {}
+        self.fista_iterations = []
+        self.fista_converged = 0
+        self.dictionary_seconds = []
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """Register ``callback(event, data)``."""
+        self.callbacks.append(callback)
+
+    def emit(self, event, data):
+        """Send an event to every callback."""
+        for callback in self.callbacks:
+            callback(event, data)
+
+    def add_stage(self, name, seconds):
+        """Add wall time to a stage; repeated stages (e.g. per tile) accumulate."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.emit('stage', {'name': name, 'seconds': seconds})
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage ``name``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def record_patch(self, record):
+        """Count one patch record returned by a worker."""
+        with self._lock:
+            self.patches[record['status']] += 1
+            worker = self.workers.setdefault(record.get('worker', 'main'), {'patches': 0, 'seconds': 0.0})
+            worker['patches'] += 1
+            worker['seconds'] += record.get('seconds', 0.0)
+            if 'fista_iterations' in record:
+                self.fista_iterations.append(record['fista_iterations'])
+                self.fista_converged += bool(record.get('fista_converged'))
+            if 'dictionary_seconds' in record:
+                self.dictionary_seconds.append(record['dictionary_seconds'])
+        self.emit('patch', record)
+
+    def record_skipped(self, n):
+        """Count ``n`` patches skipped before they were scheduled."""
+        with self._lock:
+            self.patches['skipped'] += n
+        self.emit('skipped', {'patches': n})
+
+    @property
+    def failure_rate(self):
+        """Fraction of attempted patches that raised."""
+        total = sum(self.patches.values())
+        return self.patches['failed'] / total if total else 0.0
+
+    def summary(self):
+        """JSON-serializable snapshot of everything recorded so far."""
+        n_solved = len(self.fista_iterations)
+        n_dictionaries = len(self.dictionary_seconds)
+        return {
+            'stages': dict(self.stages),
+            'patches': dict(self.patches, total=sum(self.patches.values()), failure_rate=self.failure_rate),
+            'workers': {name: dict(worker, patches_per_sec=worker['patches'] / worker['seconds']
+                                   if worker['seconds'] else 0.0)
+                        for name, worker in self.workers.items()},
+            'fista': {'patches': n_solved,
+                      'mean_iterations': sum(self.fista_iterations) / n_solved if n_solved else 0.0,
+                      'max_iterations': max(self.fista_iterations, default=0),
+                      'converged_rate': self.fista_converged / n_solved if n_solved else 0.0},
+            'dictionary': {'patches': n_dictionaries, 'seconds': sum(self.dictionary_seconds),
+                           'mean_seconds': sum(self.dictionary_seconds) / n_dictionaries if n_dictionaries else 0.0},
+        }
@@ -1,73 +1,321 @@
+import time
 import numpy as np
-from scipy.ndimage import zoom
+from scipy.ndimage import map_coordinates, zoom
 from tqdm import tqdm
 from joblib import Parallel, delayed
-from .decomposition import Decomposition
+from .decomposition import BatchDecomposition, Decomposition
+from .incremental import RowStatistics, shift_coefficients
 from .sparse_coding import SparseCoding
+from .metrics import PipelineMetrics, worker_id
+from .cache import ResultCache
+from .scheduler import PatchScheduler, default_n_jobs, row_blocks
+from .validity import ValidityIndex
 import logging
 
 class PatchProcessor:
     """Handles patch-based processing for HSI enhancement."""
-    
-    def __init__(self, hsi, msi, n_components=5, n_atoms=5, lambda_reg=0.0005):
+
+    # Floating-point precisions of the patch stage and their dtypes
+    PRECISIONS = {'float32': np.float32, 'float64': np.float64}
+    # Patches with at most this many valid pixels are skipped
+    MIN_VALID_PIXELS = 5
+
+    def __init__(self, hsi, msi, n_components=5, n_atoms=5, lambda_reg=0.0005, nodata=None):
         self.hsi = hsi
         self.msi = msi
+        self.nodata = nodata
         self.n_components = n_components
         self.n_atoms = n_atoms
         self.lambda_reg = lambda_reg
         self.decomposition = Decomposition()
+        self.decomposer = BatchDecomposition(n_components=n_components)
         self.sparse_coding = SparseCoding()
+        self.shared_dictionaries = {}
+        self.dictionary_tile = None
+        self.refine_iter = 0
+        self.n_jobs = default_n_jobs()
+        # (rows, cols) of the whole scene's MSI when this processor holds one tile of it
+        self.scene_shape = None
 
-    def process_patch(self, x, y, patch_size):
-        """Process a single patch."""
-        try:
-            hsi_patch = self.hsi[x:x + patch_size, y:y + patch_size, :]
-            msi_patchLR = self.msi_lr[x:x + patch_size, y:y + patch_size, :]
-            msi_patchHR = self.msi[x * self.f:x * self.f + patch_size * self.f,
-                                  y * self.f:y * self.f + patch_size * self.f, :]
+    def extract_patch(self, x, y, patch_size, stats=None):
+        """Extract NaN-filled HSI, low-res MSI and high-res MSI patches, or None if invalid.
 
-            valid = np.isfinite(hsi_patch).all(axis=-1) & np.isfinite(msi_patchLR).all(axis=-1)
-            if np.sum(valid) > 5:
-                hsi_patch_clean = np.nan_to_num(hsi_patch, nan=np.nanmean(hsi_patch[valid]))
-                msi_patchLR_clean = np.nan_to_num(msi_patchLR, nan=np.nanmean(msi_patchLR[valid]))
-                msi_patchHR_clean = np.nan_to_num(msi_patchHR, nan=np.nanmean(msi_patchHR))
+        With the ``RowStatistics`` of the patch row as ``stats``, the validity count
+        and fill means are looked up instead of computed from the patch.
+        """
+        if stats is not None:
+            n_valid, hsi_mean, lr_mean, hr_mean = stats.patch(y)
+            if n_valid <= self.MIN_VALID_PIXELS:
+                return None
+        hsi_patch = self.hsi[x:x + patch_size, y:y + patch_size, :]
+        msi_patchLR = self.msi_lr[x:x + patch_size, y:y + patch_size, :]
+        msi_patchHR = self.msi[x * self.f:x * self.f + patch_size * self.f,
+                              y * self.f:y * self.f + patch_size * self.f, :]
 
-                wt_components = self.decomposition.wavelet_3d_transform(hsi_patch_clean, self.n_components)
-                ica_components = self.decomposition.fastica_decomposition(hsi_patch_clean, self.n_components)
-                nmf_components = self.decomposition.nmf_decomposition(hsi_patch_clean, self.n_components)
+        if stats is not None:
+            return (np.nan_to_num(hsi_patch, nan=hsi_mean), np.nan_to_num(msi_patchLR, nan=lr_mean),
+                    np.nan_to_num(msi_patchHR, nan=hr_mean))
+
+        valid = np.isfinite(hsi_patch).all(axis=-1) & np.isfinite(msi_patchLR).all(axis=-1)
+        if np.sum(valid) <= self.MIN_VALID_PIXELS:
+            return None
+        hsi_patch_clean = np.nan_to_num(hsi_patch, nan=np.nanmean(hsi_patch[valid]))
+        msi_patchLR_clean = np.nan_to_num(msi_patchLR, nan=np.nanmean(msi_patchLR[valid]))
+        msi_patchHR_clean = np.nan_to_num(msi_patchHR, nan=np.nanmean(msi_patchHR))
+        return hsi_patch_clean, msi_patchLR_clean, msi_patchHR_clean
 
-                combined_components = np.hstack([wt_components, ica_components, nmf_components])
+    def decompose_patch(self, hsi_patch_clean, patch_size, state=None):
+        """Decompose one patch with the configured methods into a (patch, patch, k) cube."""
+        return self.decomposer.transform(hsi_patch_clean[np.newaxis], state)[0]
+
+    def process_patch(self, x, y, patch_size, record=None, stats=None, state=None):
+        """Process a single patch.
+
+        A dict passed as ``record`` receives the outcome ('processed', 'skipped'
+        by the validity check, or 'failed') and the solver statistics.
+        ``stats`` and ``state`` are the row statistics and warm-start state of
+        the incremental engine (see ``process_row``).
+        """
+        record = {} if record is None else record
+        try:
+            patches = self.extract_patch(x, y, patch_size, stats)
+            if patches is not None:
+                hsi_patch_clean, msi_patchLR_clean, msi_patchHR_clean = patches
+                combined_components_2d = self.decompose_patch(hsi_patch_clean, patch_size, state)
 
-                hsi_patch_2d = hsi_patch_clean.reshape(patch_size, patch_size, -1)
                 msi_patchLR_2d = msi_patchLR_clean.reshape(patch_size, patch_size, -1)
                 msi_patchHR_2d = msi_patchHR_clean.reshape(patch_size * self.f, patch_size * self.f, -1)
-                combined_components_2d = combined_components.reshape(patch_size, patch_size, -1)
 
                 residual = self.sparse_coding.sparse_code_residual(
-                    msi_patchLR_2d, msi_patchHR_2d, combined_components_2d, self.n_atoms, self.f, self.lambda_reg)
+                    msi_patchLR_2d, msi_patchHR_2d, combined_components_2d, self.n_atoms, self.f, self.lambda_reg,
+                    self.shared_dictionary(x, y), self.refine_iter, record, state)
 
+                record['status'] = 'processed'
                 return (x * self.f, y * self.f, residual)
+            record['status'] = 'skipped'
             return None
         except Exception as e:
+            record['status'] = 'failed'
             logging.error(f"Patch ({x}, {y}) failed: {str(e)}")
             return None
 
-    def run_parallel(self, patch_size=12, stride=1):
-        """Run patch processing in parallel."""
-        self.f = self.msi.shape[0] // self.hsi.shape[0]
-        self.msi_lr = zoom(self.msi, (1/self.f, 1/self.f, 1), order=2, mode='nearest')
+    def process_row(self, x, ys, patch_size):
+        """Process the patches of one row in column order, reusing work between neighbours.
 
-        coords = [(x, y) for x in range(0, self.hsi.shape[0] - patch_size + 1, stride)
-                  for y in range(0, self.hsi.shape[1] - patch_size + 1, stride)]
+        The fill statistics come from one ``RowStatistics`` of the row strip, and
+        every solver starts from the previous processed patch: FastICA from its
+        unmixing matrix, NMF from its spectral factors, the dictionary from its
+        dictionary, and FISTA from its coefficients shifted by the column offset.
+        Returns ``record_call``-style (result, record) pairs.
+        """
+        stats = RowStatistics(self.hsi, self.msi_lr, self.msi, x, patch_size, self.f)
+        state = {}
+        side = patch_size * self.f
+        pairs, previous_y = [], None
+        for y in sorted(ys):
+            state.pop('alpha_init', None)
+            if previous_y is not None:
+                alpha_init = shift_coefficients(state['alpha'], side, (y - previous_y) * self.f)
+                if alpha_init is not None:
+                    state['alpha_init'] = alpha_init
+            result, record = self.record_call(self.process_patch, x, y, patch_size, stats=stats, state=state)
+            if record['status'] == 'processed':
+                previous_y = y
+            pairs.append((result, record))
+        return pairs
 
-        hsi_hr = np.zeros((self.msi.shape[0], self.msi.shape[1], self.hsi.shape[2]), dtype=np.float32)
-        counts = np.zeros((self.msi.shape[0], self.msi.shape[1]), dtype=np.int32)
+    def prepare_patch(self, x, y, patch_size, record=None):
+        """Run everything up to the FISTA solve for one patch (batch engine)."""
+        record = {} if record is None else record
+        try:
+            patches = self.extract_patch(x, y, patch_size)
+            if patches is not None:
+                hsi_patch_clean, msi_patchLR_clean, msi_patchHR_clean = patches
+                combined_components_2d = self.decompose_patch(hsi_patch_clean, patch_size)
+                return self.patch_item(x, y, msi_patchLR_clean, msi_patchHR_clean, combined_components_2d, record)
+            record['status'] = 'skipped'
+            return None
+        except Exception as e:
+            record['status'] = 'failed'
+            logging.error(f"Patch ({x}, {y}) failed: {str(e)}")
+            return None
 
-        backend = 'threading' if self.hsi.size < 1e6 else 'loky'
-        results = Parallel(n_jobs=4, backend=backend)(
-            delayed(self.process_patch)(x, y, patch_size) for x, y in tqdm(coords, desc="Processing patches")
-        )
+    def patch_item(self, x, y, msi_patchLR_clean, msi_patchHR_clean, combined_components_2d, record):
+        """Build the dictionary and FISTA inputs of a decomposed patch."""
+        start = time.perf_counter()
+        D = self.sparse_coding.patch_dictionary(msi_patchLR_clean, combined_components_2d, self.n_atoms,
+                                                self.shared_dictionary(x, y), self.refine_iter)
+        record['dictionary_seconds'] = time.perf_counter() - start
+        msi_hr_flat = msi_patchHR_clean.reshape(-1, msi_patchHR_clean.shape[-1])
+        hsi_mean_upsampled = self.sparse_coding.upsampled_mean(combined_components_2d, self.f, D.shape[0])
+
+        record['status'] = 'processed'
+        return (x * self.f, y * self.f, msi_hr_flat, D, hsi_mean_upsampled)
+
+    def prepare_chunk(self, coords, patch_size):
+        """Prepare a group of patches with one batched decomposition; returns (item, record) pairs.
+
+        If the batched decomposition raises, patches are decomposed one by one so
+        that only the offending patches fail.
+        """
+        start = time.perf_counter()
+        pairs, extracted = [], []
+        for x, y in coords:
+            pair = [None, {'x': x, 'y': y, 'worker': worker_id()}]
+            pairs.append(pair)
+            try:
+                patches = self.extract_patch(x, y, patch_size)
+            except Exception as e:
+                pair[1]['status'] = 'failed'
+                logging.error(f"Patch ({x}, {y}) failed: {str(e)}")
+                continue
+            if patches is None:
+                pair[1]['status'] = 'skipped'
+            else:
+                extracted.append((pair, patches))
+
+        components = [None] * len(extracted)
+        if extracted:
+            try:
+                components = list(self.decomposer.transform(np.stack([patches[0] for _, patches in extracted])))
+            except Exception as e:
+                logging.error(f"Batched decomposition of {len(extracted)} patches failed, retrying per patch: {str(e)}")
+        for (pair, (hsi_patch_clean, msi_patchLR_clean, msi_patchHR_clean)), combined in zip(extracted, components):
+            x, y = pair[1]['x'], pair[1]['y']
+            try:
+                if combined is None:
+                    combined = self.decompose_patch(hsi_patch_clean, patch_size)
+                pair[0] = self.patch_item(x, y, msi_patchLR_clean, msi_patchHR_clean, combined, pair[1])
+            except Exception as e:
+                pair[1]['status'] = 'failed'
+                logging.error(f"Patch ({x}, {y}) failed: {str(e)}")
+
+        seconds = (time.perf_counter() - start) / max(len(coords), 1)
+        for _, record in pairs:
+            record['seconds'] = seconds
+        return [tuple(pair) for pair in pairs]
+
+    @staticmethod
+    def record_call(fn, x, y, patch_size, **kwargs):
+        """Run ``fn(x, y, patch_size, record, **kwargs)`` and return its result with the filled record."""
+        record = {'x': x, 'y': y}
+        start = time.perf_counter()
+        result = fn(x, y, patch_size, record, **kwargs)
+        record.update(seconds=time.perf_counter() - start, worker=worker_id())
+        return result, record
+
+    @staticmethod
+    def rows(coords):
+        """Group patch origins by row, as (x, [y, ...]) in row order."""
+        by_row = {}
+        for x, y in coords:
+            by_row.setdefault(x, []).append(y)
+        return sorted(by_row.items())
+
+    @staticmethod
+    def unpack_records(pairs, on_record=None):
+        """Yield the results of ``record_call`` pairs, passing each record to ``on_record``."""
+        for result, record in pairs:
+            if on_record is not None:
+                on_record(record)
+            yield result
+
+    def dictionary_key(self, x, y):
+        """Map a patch origin to its shared dictionary (one per tile, or a single global one)."""
+        if self.dictionary_tile is None:
+            return (0, 0)
+        return (x // self.dictionary_tile, y // self.dictionary_tile)
+
+    def shared_dictionary(self, x, y):
+        """Return the shared dictionary covering a patch, or None to learn one per patch."""
+        return self.shared_dictionaries.get(self.dictionary_key(x, y))
+
+    def dictionary_samples(self, x, y, patch_size):
+        """Collect coupled MSI/component pixel vectors of one patch for shared training."""
+        try:
+            patches = self.extract_patch(x, y, patch_size)
+            if patches is not None:
+                hsi_patch_clean, msi_patchLR_clean, _ = patches
+                combined_components_2d = self.decompose_patch(hsi_patch_clean, patch_size)
+                return np.hstack([msi_patchLR_clean.reshape(patch_size * patch_size, -1),
+                                  combined_components_2d.reshape(patch_size * patch_size, -1)])
+            return None
+        except Exception as e:
+            logging.error(f"Dictionary sample ({x}, {y}) failed: {str(e)}")
+            return None
+
+    def train_shared_dictionaries(self, coords, patch_size, n_samples, backend):
+        """Learn the shared dictionaries online from a random sample of patches per tile."""
+        groups = {}
+        for x, y in coords:
+            groups.setdefault(self.dictionary_key(x, y), []).append((x, y))
+
+        rng = np.random.default_rng(0)
+        with Parallel(n_jobs=self.n_jobs, backend=backend) as parallel:
+            for key, group in tqdm(groups.items(), desc="Training shared dictionaries"):
+                picks = rng.choice(len(group), size=min(n_samples, len(group)), replace=False)
+                samples = parallel(
+                    delayed(self.dictionary_samples)(*group[i], patch_size) for i in picks
+                )
+                samples = [item for item in samples if item is not None]
+                if samples:
+                    self.shared_dictionaries[key] = self.sparse_coding.train_shared_dictionary(
+                        np.vstack(samples), self.n_atoms)
+
+    def solve_batch(self, prepared, records=None):
+        """Sparse-code a list of prepared patches with one batched FISTA call.
 
+        ``records``, one dict per prepared patch, receive the FISTA iteration counts.
+        """
+        if not prepared:
+            return []
+        X = np.stack([item[2] for item in prepared])
+        D = np.stack([item[3] for item in prepared])
+        coeffs, n_iter = self.sparse_coding.fista_batch(X, D, self.lambda_reg)
+        for record, iterations in zip(records or [], n_iter):
+            record.update(fista_iterations=int(iterations),
+                          fista_converged=bool(iterations < self.sparse_coding.FISTA_MAX_ITER))
+        pred = np.einsum('psa,pfa->psf', coeffs, D)
+
+        results = []
+        for item, pred_hr in zip(prepared, pred):
+            x_start, y_start, _, _, hsi_mean_upsampled = item
+            residual = pred_hr.reshape(hsi_mean_upsampled.shape) - hsi_mean_upsampled
+            results.append((x_start, y_start, residual))
+        return results
+
+    def run_batched(self, coords, patch_size, batch_size, backend, progress=True, on_record=None):
+        """Prepare patches in parallel and solve them batch by batch, yielding results as they finish.
+
+        Each batch is split into one chunk per worker, and each chunk is decomposed
+        in one call (see ``prepare_chunk``). Each patch's record is passed to
+        ``on_record``, with its share of the batch solve time.
+        """
+        with Parallel(n_jobs=self.n_jobs, backend=backend) as parallel:
+            for start in tqdm(range(0, len(coords), batch_size), desc="Processing patch batches",
+                              disable=not progress):
+                batch = coords[start:start + batch_size]
+                chunk = -(-len(batch) // self.n_jobs)
+                prepared = [pair for pairs in parallel(
+                    delayed(self.prepare_chunk)(batch[i:i + chunk], patch_size) for i in range(0, len(batch), chunk)
+                ) for pair in pairs]
+                solved = [(item, record) for item, record in prepared if item is not None]
+                solve_start = time.perf_counter()
+                results = self.solve_batch([item for item, _ in solved], [record for _, record in solved])
+                solve_share = (time.perf_counter() - solve_start) / max(len(solved), 1)
+                for item, record in prepared:
+                    if item is not None:
+                        record['seconds'] += solve_share
+                    if on_record is not None:
+                        on_record(record)
+                yield from results
+
+    def accumulate(self, results, hsi_hr, counts, row_offset=0):
+        """Overlap-add patch residuals into accumulators whose first row is ``row_offset``.
+
+        ``results`` may be any iterable; generators are consumed one result at a
+        time, so residuals are never held all at once.
+        """
         for result in results:
             if result is not None:
                 x_start, y_start, residual = result
@@ -78,10 +326,274 @@ class PatchProcessor:
                 x_end = min(x_end, self.msi.shape[0])
                 y_end = min(y_end, self.msi.shape[1])
                 n_channels = min(residual.shape[-1], hsi_hr.shape[-1])
+                x_start, x_end = x_start - row_offset, x_end - row_offset
                 hsi_hr[x_start:x_end, y_start:y_end, :n_channels] += residual[..., :n_channels]
                 counts[x_start:x_end, y_start:y_end] += 1
+        return hsi_hr, counts
+
+    def patch_coords(self, patch_size, stride, core=None, origin=(0, 0)):
+        """List patch origins on the stride grid, optionally only those in a tile's core.
+
+        ``core`` is (row0, row1, col0, col1) in scene pixels and ``origin`` is the scene
+        position of this processor's first pixel, so tiles keep the scene-wide grid.
+        """
+        rows = range(0, self.hsi.shape[0] - patch_size + 1)
+        cols = range(0, self.hsi.shape[1] - patch_size + 1)
+        if core is None:
+            return [(x, y) for x in rows[::stride] for y in cols[::stride]]
+        row0, row1, col0, col1 = core
+        rows = [x for x in rows if (x + origin[0]) % stride == 0 and row0 <= x + origin[0] < row1]
+        cols = [y for y in cols if (y + origin[1]) % stride == 0 and col0 <= y + origin[1] < col1]
+        return [(x, y) for x in rows for y in cols]
+
+    def run_parallel(self, patch_size=12, stride=1, engine='patch', batch_size=256,
+                     dictionary='patch', dictionary_tile=64, dictionary_samples=32, refine_iter=0,
+                     core=None, origin=(0, 0), normalize=True, scheduler='joblib', n_jobs=None, cache=None,
+                     metrics=None, decompositions=BatchDecomposition.DEFAULT, checkpoint=None, precision='float32',
+                     sparse_stride=None, texture_threshold=0.2, origin_mask=None):
+        """Run patch processing in parallel; the options are described under "Patch-stage options" in the README."""
+        if engine not in ('patch', 'batch', 'incremental'):
+            raise ValueError(f"Unknown engine: {engine}")
+        if dictionary not in ('patch', 'global', 'tile'):
+            raise ValueError(f"Unknown dictionary strategy: {dictionary}")
+        if scheduler not in ('joblib', 'process'):
+            raise ValueError(f"Unknown scheduler: {scheduler}")
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        if sparse_stride is not None and (sparse_stride % stride or sparse_stride > patch_size):
+            raise ValueError(f"sparse_stride must be a multiple of stride and at most patch_size: {sparse_stride}")
+        self.n_jobs = n_jobs or default_n_jobs()
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        self.f = self.msi.shape[0] // self.hsi.shape[0]
+        self.msi_lr = self.lowres_msi(origin)
+
+        hsi_hr = np.zeros((self.msi.shape[0], self.msi.shape[1], self.hsi.shape[2]), dtype=np.float32)
+        counts = np.zeros((self.msi.shape[0], self.msi.shape[1]), dtype=np.int32)
+
+        backend = 'threading' if self.hsi.size < 1e6 else 'loky'
+        self.shared_dictionaries = {}
+        self.dictionary_tile = dictionary_tile if dictionary == 'tile' else None
+        self.refine_iter = refine_iter
+        dtype = np.dtype(self.PRECISIONS[precision])
+        if self.decomposer.methods != tuple(decompositions) or self.decomposer.dtype != dtype:
+            self.decomposer = BatchDecomposition(decompositions, self.n_components, dtype=dtype)
+        if self.sparse_coding.dtype != dtype:
+            self.sparse_coding = SparseCoding(dtype)
+
+        entry = None
+        if cache is not None or checkpoint is not None:
+            inputs = [self.hsi, self.msi] + ([self.nodata] if self.nodata is not None else [])
+            params = dict(inputs=ResultCache.key(inputs), patch_size=patch_size, stride=stride,
+                          n_components=self.n_components, n_atoms=self.n_atoms, dictionary=dictionary,
+                          dictionary_tile=self.dictionary_tile, dictionary_samples=dictionary_samples,
+                          core=core, origin=origin, decompositions=list(decompositions), precision=precision,
+                          sparse_stride=sparse_stride,
+                          texture_threshold=texture_threshold if sparse_stride is not None else None,
+                          origin_mask=ResultCache.key([origin_mask]) if origin_mask is not None else None)
+            checkpoint_key = ResultCache.key([], kind='checkpoint', engine=engine, lambda_reg=self.lambda_reg,
+                                             refine_iter=refine_iter, **params)
+        if cache is not None:
+            dictionaries_key = cache.key([], kind='dictionaries', **params)
+            residuals_key = cache.key([], kind='residuals', engine=engine, lambda_reg=self.lambda_reg,
+                                      refine_iter=refine_iter, **params)
+            entry = cache.get(residuals_key)
+
+        if entry is not None:
+            hsi_hr, counts = entry['hsi_hr'], entry['counts']
+        else:
+            with metrics.stage('scheduling'):
+                coords = self.schedule_coords(patch_size, stride, core, origin, sparse_stride, texture_threshold,
+                                              metrics, origin_mask)
+            if self.decomposer.needs_fit:
+                with metrics.stage('decomposition_fit'):
+                    self.decomposer.fit(self.hsi)
+            if dictionary != 'patch':
+                cached = cache.get_dictionaries(dictionaries_key) if cache is not None else None
+                if cached is not None:
+                    self.shared_dictionaries = cached
+                else:
+                    with metrics.stage('dictionary_training'):
+                        self.train_shared_dictionaries(coords, patch_size, dictionary_samples, backend)
+                    if cache is not None:
+                        cache.put_dictionaries(dictionaries_key, self.shared_dictionaries)
+
+            with metrics.stage('patches'):
+                pending = coords
+                if checkpoint is not None:
+                    done = checkpoint.start(checkpoint_key, hsi_hr, counts)
+                    pending = [coord for coord in coords if coord not in done]
+                if scheduler == 'process':
+                    PatchScheduler(self.n_jobs).run(self, pending, patch_size, engine, batch_size, hsi_hr, counts,
+                                                    on_record=metrics.record_patch,
+                                                    on_block=checkpoint.complete if checkpoint is not None else None)
+                elif checkpoint is not None:
+                    # Checkpoints are only consistent between chunks, once every result is added
+                    n_rows = len({x for x, _ in pending})
+                    for chunk in row_blocks(pending, -(-n_rows // (4 * self.n_jobs))):
+                        self.process_coords(chunk, patch_size, engine, batch_size, backend, hsi_hr, counts, metrics)
+                        checkpoint.complete(chunk)
+                else:
+                    self.process_coords(pending, patch_size, engine, batch_size, backend, hsi_hr, counts, metrics)
+                if checkpoint is not None:
+                    checkpoint.save()
+            if checkpoint is not None:
+                metrics.add_stage('checkpoint', checkpoint.seconds)
+            if metrics.patches['failed']:
+                logging.warning(f"{metrics.patches['failed']} of {sum(metrics.patches.values())} patches failed")
+            if cache is not None:
+                cache.put(residuals_key, hsi_hr=hsi_hr, counts=counts)
+
+        if not normalize:
+            return hsi_hr, counts
 
         valid_mask = counts > 0
         hsi_hr[valid_mask] = hsi_hr[valid_mask] / counts[valid_mask, np.newaxis]
 
         return hsi_hr
+
+    def lowres_msi(self, origin=(0, 0)):
+        """Order-2 zoom of the MSI onto the HSI grid.
+
+        For a tile of a scene (see ``scene_shape``) the MSI is sampled where the
+        zoom of the whole scene, whose grid stretches with the scene size,
+        samples it; ``origin`` is the tile's HSI position.
+        """
+        if self.scene_shape is None:
+            return zoom(self.msi, (1/self.f, 1/self.f, 1), order=2, mode='nearest')
+        coords = []
+        for axis in range(2):
+            n_out = int(round(self.scene_shape[axis] / self.f))
+            step = (self.scene_shape[axis] - 1) / (n_out - 1) if n_out > 1 else 0
+            coords.append((np.arange(self.hsi.shape[axis]) + origin[axis]) * step - origin[axis] * self.f)
+        grid = np.meshgrid(*coords, indexing='ij')
+        return np.stack([map_coordinates(self.msi[..., band], grid, order=2, mode='nearest')
+                         for band in range(self.msi.shape[-1])], axis=-1)
+
+    def schedule_coords(self, patch_size, stride, core=None, origin=(0, 0), sparse_stride=None,
+                        texture_threshold=0.2, metrics=None, origin_mask=None):
+        """List the patch origins worth processing; see ``run_parallel``.
+
+        The dropped invalid patches are counted as skipped in ``metrics``.
+        """
+        coords = self.patch_coords(patch_size, stride, core, origin)
+        if origin_mask is not None:
+            coords = [(x, y) for x, y in coords if origin_mask[x, y]]
+        index = ValidityIndex(self.hsi, self.msi_lr, self.nodata)
+        valid = index.valid_coords(coords, patch_size, self.MIN_VALID_PIXELS)
+        if metrics is not None:
+            metrics.record_skipped(len(coords) - len(valid))
+        if sparse_stride is not None:
+            valid = index.adaptive_coords(valid, patch_size, sparse_stride, texture_threshold, origin)
+        return valid
+
+    def run_pyramid(self, patch_size=12, stride=1, quality=0.5, tile_size=None, core=None, origin=(0, 0),
+                    normalize=True, metrics=None, **options):
+        """Coarse-to-fine patch stage: a coarse grid everywhere, the full ``stride`` grid only where it pays off.
+
+        The coarse level processes the origins on the largest multiple of ``stride``
+        not above ``patch_size``, so patches barely overlap and the level costs a
+        fraction of the full grid. Its residual is then screened in tiles of
+        ``tile_size`` HSI pixels (default ``patch_size``, see ``refine_mask``), and
+        the ``quality`` fraction of the tiles with the highest scores get the
+        remaining ``stride``-grid origins. ``quality=0`` returns the coarse level,
+        and ``quality=1`` matches ``run_parallel`` at ``stride``; runtime grows
+        about linearly in between. ``core`` and ``origin`` restrict both levels to
+        one tile on the scene-wide grids (see ``patch_coords``). ``options`` are
+        passed to ``run_parallel``; ``sparse_stride`` only applies to the refined origins.
+        """
+        if not 0 <= quality <= 1:
+            raise ValueError(f"quality must be between 0 and 1: {quality}")
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        coarse_stride = max(patch_size // stride, 1) * stride
+        if coarse_stride == stride:
+            return self.run_parallel(patch_size, stride, core=core, origin=origin, normalize=normalize,
+                                     metrics=metrics, **options)
+
+        hsi_hr, counts = self.run_parallel(patch_size, coarse_stride, core=core, origin=origin, normalize=False,
+                                           metrics=metrics, **dict(options, sparse_stride=None))
+        with metrics.stage('screening'):
+            origin_mask = self.refine_mask(hsi_hr, counts, coarse_stride, quality, tile_size or patch_size, origin)
+        if origin_mask.any():
+            refined_hr, refined_counts = self.run_parallel(patch_size, stride, core=core, origin=origin,
+                                                           normalize=False, metrics=metrics,
+                                                           origin_mask=origin_mask, **options)
+            hsi_hr += refined_hr
+            counts += refined_counts
+
+        if not normalize:
+            return hsi_hr, counts
+        valid_mask = counts > 0
+        hsi_hr[valid_mask] = hsi_hr[valid_mask] / counts[valid_mask, np.newaxis]
+        return hsi_hr
+
+    def refine_mask(self, hsi_hr, counts, coarse_stride, quality, tile_size, origin=(0, 0)):
+        """HSI-grid mask of the origins to add to a coarse level in the ``quality`` fraction of tiles.
+
+        A tile's score is the mean energy of the coarse residual (``hsi_hr`` sums
+        over ``counts``) relative to the mean band variance of the MSI over it:
+        the coarse residual is least reliable where it is large compared with
+        the structure the MSI supports. Tiles without coarse patches score 0.
+        The coarse origins themselves, on the scene-wide grid seen from
+        ``origin``, are left out of the mask.
+        """
+        f = self.f
+        n_channels = min(hsi_hr.shape[-1], self.msi.shape[-1])
+        tiles, scores = [], []
+        for row in range(0, self.hsi.shape[0], tile_size):
+            for col in range(0, self.hsi.shape[1], tile_size):
+                window = np.s_[row * f:(row + tile_size) * f, col * f:(col + tile_size) * f]
+                covered = counts[window] > 0
+                score = 0.0
+                if covered.any():
+                    residual = hsi_hr[window][covered, :n_channels] / counts[window][covered, np.newaxis]
+                    variance = np.var(self.msi[window], axis=(0, 1), dtype=np.float64).mean()
+                    score = np.mean(residual.astype(np.float64) ** 2) / max(variance, np.finfo(np.float32).tiny)
+                tiles.append((row, col))
+                scores.append(score)
+
+        n_refined = int(round(quality * len(tiles)))
+        origin_mask = np.zeros(self.hsi.shape[:2], dtype=bool)
+        for i in np.argsort(scores)[::-1][:n_refined]:
+            row, col = tiles[i]
+            origin_mask[row:row + tile_size, col:col + tile_size] = True
+        origin_mask[-origin[0] % coarse_stride::coarse_stride, -origin[1] % coarse_stride::coarse_stride] = False
+        logging.info(f"Refining {n_refined} of {len(tiles)} tiles")
+        return origin_mask
+
+    def process_coords(self, coords, patch_size, engine, batch_size, backend, hsi_hr, counts, metrics):
+        """Process patch origins with joblib workers and overlap-add them into the accumulators."""
+        if engine == 'batch':
+            self.accumulate(self.run_batched(coords, patch_size, batch_size, backend,
+                                             on_record=metrics.record_patch), hsi_hr, counts)
+        elif engine == 'incremental':
+            rows = self.rows(coords)
+            row_pairs = Parallel(n_jobs=self.n_jobs, backend=backend, return_as='generator_unordered')(
+                delayed(self.process_row)(x, ys, patch_size) for x, ys in rows
+            )
+            results = (pair for pairs in tqdm(row_pairs, total=len(rows), desc="Processing patch rows")
+                       for pair in pairs)
+            self.accumulate(self.unpack_records(results, metrics.record_patch), hsi_hr, counts)
+        else:
+            results = Parallel(n_jobs=self.n_jobs, backend=backend, return_as='generator_unordered')(
+                delayed(self.record_call)(self.process_patch, x, y, patch_size) for x, y in coords
+            )
+            results = tqdm(results, total=len(coords), desc="Processing patches")
+            self.accumulate(self.unpack_records(results, metrics.record_patch), hsi_hr, counts)
+        return hsi_hr, counts
+
+    def run_tiles(self, tiles, patch_size=12, stride=1, scene_shape=None, **options):
+        """Process a stream of ``TilePair`` objects, one tile in memory at a time.
+
+        Yields ``(tile, hsi_hr_sum, counts)`` with the raw overlap-add sums at MSI
+        resolution over the tile extent; tiles overlap by their halo, so callers
+        add sums and counts across tiles before dividing. With the (rows, cols) of
+        the scene's MSI as ``scene_shape``, tiles sample the low-res MSI like the
+        whole scene (see ``lowres_msi``). ``options`` are passed to ``run_parallel``.
+        """
+        for tile in tiles:
+            processor = PatchProcessor(tile.hsi, tile.msi, self.n_components, self.n_atoms, self.lambda_reg,
+                                       tile.nodata)
+            processor.scene_shape = scene_shape
+            hsi_hr, counts = processor.run_parallel(patch_size, stride, core=tile.core, origin=tile.origin,
+                                                    normalize=False, **options)
+            yield tile, hsi_hr, counts
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+
+def default_n_jobs():
+    """Number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def row_blocks(coords, n_blocks):
+    """Split patch origins into at most ``n_blocks`` groups of contiguous rows."""
+    by_row = {}
+    for x, y in coords:
+        by_row.setdefault(x, []).append((x, y))
+    rows = sorted(by_row)
+    if not rows:
+        return []
+    return [[coord for x in chunk for coord in by_row[x]]
+            for chunk in np.array_split(rows, min(n_blocks, len(rows)))]
+
+def save_layout(path, array):
+    """Save ``array`` to ``.npy`` in its memory order and return the axes that restore its shape.
+
+    Band-major views such as the loader's keep their strides in the workers, so
+    the patch solvers round the same way as in-process.
+    """
+    order = np.argsort(array.strides, kind='stable')[::-1]
+    np.save(path, np.ascontiguousarray(array.transpose(order)))
+    return tuple(np.argsort(order))
+
+# Per-worker processor, built once by the pool initializer
+_worker = None
+
+def _init_worker(processor_cls, paths, params):
+    """Attach the memmapped inputs and rebuild the processor state in a worker."""
+    global _worker
+    hsi, msi, msi_lr = (np.load(paths[name], mmap_mode='r').transpose(params['axes'][name])
+                        for name in ('hsi', 'msi', 'msi_lr'))
+    _worker = processor_cls(hsi, msi, params['n_components'], params['n_atoms'], params['lambda_reg'])
+    _worker.msi_lr = msi_lr
+    _worker.f = params['f']
+    _worker.shared_dictionaries = params['shared_dictionaries']
+    _worker.dictionary_tile = params['dictionary_tile']
+    _worker.refine_iter = params['refine_iter']
+    _worker.decomposer = params['decomposer']
+    _worker.sparse_coding = params['sparse_coding']
+    _worker.n_jobs = 1
+
+def _run_block(coords, patch_size, engine, batch_size):
+    """Process a row block and overlap-add it into a strip-sized partial accumulator.
+
+    Returns the strip's first row, the strip, its counts and the per-patch records.
+    """
+    f = _worker.f
+    row0 = min(x for x, _ in coords) * f
+    row1 = min((max(x for x, _ in coords) + patch_size) * f, _worker.msi.shape[0])
+    hsi_hr = np.zeros((row1 - row0, _worker.msi.shape[1], _worker.hsi.shape[2]), dtype=np.float32)
+    counts = np.zeros((row1 - row0, _worker.msi.shape[1]), dtype=np.int32)
+
+    records = []
+    if engine == 'batch':
+        results = _worker.run_batched(coords, patch_size, batch_size, 'sequential', progress=False,
+                                      on_record=records.append)
+    elif engine == 'incremental':
+        results = _worker.unpack_records((pair for x, ys in _worker.rows(coords)
+                                          for pair in _worker.process_row(x, ys, patch_size)), records.append)
+    else:
+        results = _worker.unpack_records((_worker.record_call(_worker.process_patch, x, y, patch_size)
+                                          for x, y in coords), records.append)
+    _worker.accumulate(results, hsi_hr, counts, row_offset=row0)
+    return row0, hsi_hr, counts, records
+
+class PatchScheduler:
+    """Process-pool patch scheduler over memory-mapped inputs.
+
+    The HSI, MSI and low-res MSI are written once to ``.npy`` files that every
+    worker maps read-only, so tasks carry only patch origins. Origins are sent
+    as contiguous row blocks, and each worker returns one overlap-added strip
+    per block instead of a residual per patch. At most ``max_in_flight`` blocks
+    are queued at once and strips are merged as they complete, which bounds
+    peak memory by the number of in-flight tasks.
+    """
+
+    def __init__(self, n_jobs=None, blocks_per_worker=4, scratch_dir=None, max_in_flight=None):
+        self.n_jobs = n_jobs or default_n_jobs()
+        self.blocks_per_worker = blocks_per_worker
+        self.scratch_dir = scratch_dir
+        self.max_in_flight = max_in_flight or 2 * self.n_jobs
+
+    def run(self, processor, coords, patch_size, engine, batch_size, hsi_hr, counts, on_record=None,
+            on_block=None):
+        """Process ``coords`` with ``processor``'s inputs and add the strips into the accumulators.
+
+        Per-patch records from the workers are passed to ``on_record`` as blocks complete,
+        and each block's origins to ``on_block`` once its strip is merged.
+        """
+        blocks = row_blocks(coords, self.n_jobs * self.blocks_per_worker)
+        if not blocks:
+            return hsi_hr, counts
+
+        tmp = tempfile.mkdtemp(prefix='hsi_inputs_', dir=self.scratch_dir)
+        try:
+            paths, axes = {}, {}
+            for name in ('hsi', 'msi', 'msi_lr'):
+                paths[name] = os.path.join(tmp, f'{name}.npy')
+                axes[name] = save_layout(paths[name], getattr(processor, name))
+            params = {'n_components': processor.n_components, 'n_atoms': processor.n_atoms,
+                      'lambda_reg': processor.lambda_reg, 'f': processor.f, 'axes': axes,
+                      'shared_dictionaries': processor.shared_dictionaries,
+                      'dictionary_tile': processor.dictionary_tile, 'refine_iter': processor.refine_iter,
+                      'decomposer': processor.decomposer, 'sparse_coding': processor.sparse_coding}
+
+            # Forked children would inherit numba's thread pool, which is not fork-safe
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(blocks)), initializer=_init_worker,
+                                     initargs=(type(processor), paths, params),
+                                     mp_context=multiprocessing.get_context(method)) as pool:
+                pending, submitted = set(), {}
+                for block in blocks:
+                    if len(pending) >= self.max_in_flight:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.merge(done, hsi_hr, counts, on_record, on_block, submitted)
+                    future = pool.submit(_run_block, block, patch_size, engine, batch_size)
+                    submitted[future] = block
+                    pending.add(future)
+                self.merge(wait(pending).done, hsi_hr, counts, on_record, on_block, submitted)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return hsi_hr, counts
+
+    @staticmethod
+    def merge(futures, hsi_hr, counts, on_record=None, on_block=None, blocks=None):
+        """Add the strips of completed futures into the scene accumulators.
+
+        ``blocks`` maps each future to its origins, which are passed to ``on_block``.
+        """
+        for future in futures:
+            row0, strip, strip_counts, records = future.result()
+            hsi_hr[row0:row0 + strip.shape[0]] += strip
+            counts[row0:row0 + strip.shape[0]] += strip_counts
+            if on_record is not None:
+                for record in records:
+                    on_record(record)
+            if on_block is not None:
+                on_block(blocks.pop(future))
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import numpy as np
+import rasterio
+from .data_loader import HSIDataLoader
+from .enhancer import TiledHSIEnhancer
+from .metrics import PipelineMetrics
+from .writer import OverlapAccumulator
+
+class SceneShards:
+    """Split the tiled enhancement of one scene into shards that run on separate machines.
+
+    Workers coordinate only through files in ``shard_dir``:
+
+    - ``manifest.json`` (written by ``plan``) holds the scene paths, the run
+      parameters, the kept band indexes and the scene's value range, the tile
+      halo and every shard's tile cores.
+    - ``shard_<i>/tile_<row>_<col>.npz`` holds one tile's raw residual sums and
+      counts and the statistics of its core, written atomically once the tile
+      is done, so an interrupted shard resumes at its first missing tile.
+
+    ``merge`` overlap-adds the tiles of every shard. Each patch origin belongs to
+    exactly one tile core, so the seams are summed exactly as in an unsharded
+    ``TiledHSIEnhancer.fuse_to_sink``, and every shard clips its upsampled tiles
+    to the planned scene range. The merge then upsamples, filters and
+    writes the scene with the merged scene-wide statistics.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+
+    @staticmethod
+    def parse(spec):
+        """Parse an ``'i/N'`` shard spec into (i, N)."""
+        try:
+            index, n_shards = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise ValueError(f"Invalid shard spec {spec!r}, expected i/N")
+        if not 0 <= index < n_shards:
+            raise ValueError(f"Shard index {index} out of range for {n_shards} shards")
+        return index, n_shards
+
+    def manifest_path(self):
+        """Path of the shard manifest."""
+        return os.path.join(self.shard_dir, self.MANIFEST)
+
+    def plan(self, msi_path, hsi_path, n_shards, tile_size=256, patch_size=12, stride=1, guide_radius=1,
+             detail_weight=3.5, resize_kernel='spline5', n_components=5, n_atoms=5, lambda_reg=0.0005, **options):
+        """Split the scene's tiles into ``n_shards`` contiguous groups and write the manifest.
+
+        ``options`` are passed to ``PatchProcessor.run_parallel`` by every shard and
+        must be JSON-serializable. Returns the manifest.
+        """
+        options = TiledHSIEnhancer.check_options(options)
+        enhancer = TiledHSIEnhancer(msi_path, hsi_path, n_components, n_atoms, lambda_reg, tile_size)
+        with rasterio.open(hsi_path) as src:
+            cores = [[int(v) for v in core] for core in HSIDataLoader.tile_cores(src, tile_size)]
+        bounds = np.linspace(0, len(cores), n_shards + 1).round().astype(int)
+        manifest = {
+            'msi_path': os.path.abspath(msi_path), 'hsi_path': os.path.abspath(hsi_path),
+            'enhancer': dict(n_components=n_components, n_atoms=n_atoms, lambda_reg=lambda_reg, tile_size=tile_size,
+                             indexes=enhancer.indexes, value_range=list(enhancer.value_range)),
+            'params': dict(patch_size=patch_size, stride=stride, guide_radius=guide_radius,
+                           detail_weight=detail_weight, resize_kernel=resize_kernel),
+            'options': options,
+            'halo': enhancer.halo(patch_size, guide_radius, resize_kernel),
+            'output_shape': list(enhancer.output_shape),
+            'shards': [cores[bounds[i]:bounds[i + 1]] for i in range(n_shards)],
+        }
+        os.makedirs(self.shard_dir, exist_ok=True)
+        tmp_path = f'{self.manifest_path()}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path())
+        logging.info(f"Planned {len(cores)} tiles over {n_shards} shards in {self.shard_dir}")
+        return manifest
+
+    def manifest(self):
+        """Read the manifest written by ``plan``."""
+        if not os.path.exists(self.manifest_path()):
+            raise FileNotFoundError(f"No shard manifest in {self.shard_dir}; plan the shards first")
+        with open(self.manifest_path()) as f:
+            return json.load(f)
+
+    def enhancer(self, manifest):
+        """Rebuild the tiled enhancer described by a manifest, without rescanning the bands or the range."""
+        return TiledHSIEnhancer(manifest['msi_path'], manifest['hsi_path'], **manifest['enhancer'])
+
+    def tile_path(self, index, core):
+        """File holding one tile's results."""
+        return os.path.join(self.shard_dir, f'shard_{index}', f'tile_{core[0]}_{core[2]}.npz')
+
+    def run_shard(self, index, metrics=None):
+        """Run the patch stage of shard ``index``, reading only its tile windows.
+
+        Tiles already written by an earlier attempt are skipped, and the next
+        tiles are prefetched while one is processed. Returns the run's
+        ``PipelineMetrics`` (``metrics``, or a new one).
+        """
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        manifest = self.manifest()
+        enhancer = self.enhancer(manifest)
+        params = manifest['params']
+        os.makedirs(os.path.dirname(self.tile_path(index, (0, 0, 0, 0))), exist_ok=True)
+
+        missing = [tuple(core) for core in manifest['shards'][index]
+                   if not os.path.exists(self.tile_path(index, core))]
+        for tile in enhancer.tiles(params['patch_size'], manifest['halo'], missing, metrics):
+            path = self.tile_path(index, tile.core)
+            results = {}
+
+            def keep(tile, hsi_hr, counts):
+                results.update(sums=hsi_hr, counts=counts, origin=np.array(tile.origin))
+            stats = enhancer.residual_pass([tile], keep, params['patch_size'], params['stride'],
+                                           params['resize_kernel'], metrics, **manifest['options'])
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, **results, **{f'stats_{name}': value for name, value in stats.items()})
+            os.replace(tmp_path, path)
+        logging.info(f"Shard {index} of {len(manifest['shards'])} done")
+        return metrics
+
+    def merge(self, sink, scratch_dir, metrics=None):
+        """Overlap-add every shard's tiles, then upsample, filter and write the scene to ``sink``.
+
+        Raises ``RuntimeError`` naming the shards with missing tiles.
+        """
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        manifest = self.manifest()
+        missing = [index for index, cores in enumerate(manifest['shards'])
+                   if not all(os.path.exists(self.tile_path(index, core)) for core in cores)]
+        if missing:
+            raise RuntimeError(f"Shards {missing} are not finished")
+
+        enhancer = self.enhancer(manifest)
+        params = manifest['params']
+        accumulator = OverlapAccumulator(scratch_dir, enhancer.output_shape)
+        parts = []
+        for index, cores in enumerate(manifest['shards']):
+            for core in cores:
+                with np.load(self.tile_path(index, core)) as data:
+                    row, col = data['origin'] * enhancer.f
+                    accumulator.add(row, col, data['sums'], data['counts'])
+                    parts.append({name[len('stats_'):]: data[name] for name in data.files
+                                  if name.startswith('stats_')})
+        accumulator.flush()
+
+        stats = enhancer.merge_statistics(parts)
+        tiles = enhancer.tiles(params['patch_size'], manifest['halo'])
+        enhancer.finish_pass(sink, accumulator, stats, tiles, params['guide_radius'], params['detail_weight'],
+                             params['resize_kernel'], metrics)
+        return metrics
@@ -1,59 +1,270 @@
+import time
 import numpy as np
 import numba as nb
-from sklearn.decomposition import DictionaryLearning
+from sklearn.decomposition import DictionaryLearning, MiniBatchDictionaryLearning
 from scipy.ndimage import zoom
 
+@nb.njit(cache=True)
+def _soft_threshold(x, thresh):
+    """Elementwise soft-thresholding operator."""
+    return np.sign(x) * np.maximum(np.abs(x) - thresh, 0)
+
+@nb.njit(parallel=True, cache=True)
+def _fista_batch_kernel(X, D, L, lambda_reg, momentum, tol, alpha, alpha_prev, y, XD, G, n_iter):
+    """FISTA over a stack of problems; all work buffers are preallocated by the caller.
+
+    Every array and scalar argument has the dtype of ``X``, and all constants are
+    made in it too, so a float32 call runs in float32 throughout.
+    """
+    n_patches, n_samples, n_features = X.shape
+    n_atoms = D.shape[2]
+    max_iter = momentum.shape[0]
+    zero = X.dtype.type(0)
+    one = X.dtype.type(1)
+    for p in nb.prange(n_patches):
+        if L[p] == 0:
+            n_iter[p] = 0
+            continue
+
+        # Gradient is X D - y D^T D, so both products are formed once per patch
+        for i in range(n_samples):
+            for j in range(n_atoms):
+                acc = zero
+                for k in range(n_features):
+                    acc += X[p, i, k] * D[p, k, j]
+                XD[p, i, j] = acc
+        for j in range(n_atoms):
+            for m in range(n_atoms):
+                acc = zero
+                for k in range(n_features):
+                    acc += D[p, k, j] * D[p, k, m]
+                G[p, j, m] = acc
+
+        step = one / L[p]
+        thresh = lambda_reg / L[p]
+        n_iter[p] = max_iter
+        for it in range(max_iter):
+            max_delta = zero
+            for i in range(n_samples):
+                for j in range(n_atoms):
+                    acc = XD[p, i, j]
+                    for m in range(n_atoms):
+                        acc -= y[p, i, m] * G[p, m, j]
+                    v = y[p, i, j] + acc * step
+                    alpha_prev[p, i, j] = alpha[p, i, j]
+                    if v > thresh:
+                        alpha[p, i, j] = v - thresh
+                    elif v < -thresh:
+                        alpha[p, i, j] = v + thresh
+                    else:
+                        alpha[p, i, j] = zero
+                    delta = abs(alpha[p, i, j] - alpha_prev[p, i, j])
+                    if delta > max_delta:
+                        max_delta = delta
+                for j in range(n_atoms):
+                    y[p, i, j] = alpha[p, i, j] + momentum[it] * (alpha[p, i, j] - alpha_prev[p, i, j])
+            if it > 5 and max_delta < tol[p]:
+                n_iter[p] = it + 1
+                break
+
+@nb.njit(cache=True)
+def _fista_kernel(X, D, L, lambda_reg, momentum, tol, alpha_init):
+    """FISTA on one problem from ``alpha_init``, returning the coefficients and the iterations run.
+
+    As in ``_fista_batch_kernel``, all arguments share the dtype of ``X``.
+    """
+    if L == 0:
+        return np.zeros_like(alpha_init), 0
+
+    alpha = alpha_init.copy()
+    y = alpha_init.copy()
+    max_iter = momentum.shape[0]
+
+    for k in range(max_iter):
+        alpha_prev = alpha.copy()
+        grad = np.dot(np.dot(y, D.T) - X, D) / L
+        alpha = _soft_threshold(y - grad, lambda_reg / L)
+        y = alpha + momentum[k] * (alpha - alpha_prev)
+        if k > 5 and np.max(np.abs(alpha - alpha_prev)) < tol:
+            return alpha, k + 1
+
+    return alpha, max_iter
+
 class SparseCoding:
-    """Handles dictionary learning and sparse coding with FISTA."""
-    
-    @staticmethod
-    @nb.njit
-    def fista(X, D, lambda_reg, max_iter=75, tol=1e-6):
-        """Fast Iterative Shrinkage-Thresholding Algorithm (FISTA)."""
-        n_samples, n_features = X.shape
-        n_atoms = D.shape[1]
-        L = np.linalg.norm(D, ord=2)**2
-        if L == 0:
-            return np.zeros((n_samples, n_atoms))
-
-        alpha = np.zeros((n_samples, n_atoms))
-        y = np.zeros((n_samples, n_atoms))
-        t = 1.0
+    """Handles dictionary learning and sparse coding with FISTA.
+
+    ``dtype`` is the precision of the dictionaries, the FISTA inputs and the
+    residuals, float32 by default (see ``PatchProcessor.run_parallel``).
+    """
+
+    FISTA_MAX_ITER = 75
+    # DictionaryLearning passes when warm-started from a neighbouring patch's dictionary
+    WARM_DICTIONARY_ITER = 5
+    # FISTA stops once no coefficient moves more than the tolerance, which is floored at
+    # this many units in the last place of the data, since float32 cannot resolve smaller steps
+    TOL_ULPS = 4
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+
+    @staticmethod
+    def solve_dtype(*arrays):
+        """Floating dtype a FISTA solve runs in: float32 unless an input is float64."""
+        return np.result_type(*arrays, np.float32)
 
+    @staticmethod
+    def momentum(max_iter, dtype):
+        """FISTA momentum (t_k - 1) / t_k+1 of every iteration; it does not depend on the data."""
+        momentum = np.empty(max_iter)
+        t = 1.0
         for k in range(max_iter):
-            alpha_prev = alpha.copy()
-            grad = np.dot(X - np.dot(y, D.T), D) / L
-            alpha = nb.njit(lambda x, t: np.sign(x) * np.maximum(np.abs(x) - t, 0))(y - grad, lambda_reg / L)
             t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
-            y = alpha + ((t - 1) / t_next) * (alpha - alpha_prev)
+            momentum[k] = (t - 1) / t_next
             t = t_next
-            if k > 5 and np.max(np.abs(alpha - alpha_prev)) < tol:
-                break
+        return momentum.astype(dtype)
 
-        return alpha
+    @staticmethod
+    def tolerance(X, tol, axis=None):
+        """Convergence tolerance of FISTA on ``X``: ``tol``, but at least ``TOL_ULPS`` ulps of its largest value."""
+        floor = SparseCoding.TOL_ULPS * np.finfo(X.dtype).eps * np.abs(X).max(axis=axis, initial=0)
+        return np.maximum(tol, floor).astype(X.dtype)
 
     @staticmethod
-    def train_dictionary(msi_lr_flat, hsi_comp_flat, n_atoms):
-        """Train dictionary for sparse coding."""
-        data = np.hstack([msi_lr_flat.T, hsi_comp_flat.T]).T
-        dict_learner = DictionaryLearning(n_components=n_atoms, alpha=1, max_iter=20)
+    def fista(X, D, lambda_reg, max_iter=FISTA_MAX_ITER, tol=1e-6, return_n_iter=False, alpha_init=None):
+        """Fast Iterative Shrinkage-Thresholding Algorithm (FISTA).
+
+        With ``return_n_iter`` the iteration count is returned too; a count below
+        ``max_iter`` means the solve converged and stopped early. ``alpha_init``
+        warm-starts the coefficients (zeros by default). The solve runs in
+        ``solve_dtype`` of the inputs, with the ``tolerance`` of X.
+        """
+        dtype = SparseCoding.solve_dtype(X, D)
+        X = np.ascontiguousarray(X, dtype=dtype)
+        D = np.ascontiguousarray(D, dtype=dtype)
+        if alpha_init is None:
+            alpha_init = np.zeros((X.shape[0], D.shape[1]), dtype=dtype)
+        L = dtype.type(np.linalg.norm(D, ord=2)**2)
+        alpha, n_iter = _fista_kernel(X, D, L, dtype.type(lambda_reg), SparseCoding.momentum(max_iter, dtype),
+                                      SparseCoding.tolerance(X, tol)[()],
+                                      np.ascontiguousarray(alpha_init, dtype=dtype))
+        return (alpha, n_iter) if return_n_iter else alpha
+
+    @staticmethod
+    def fista_batch(X, D, lambda_reg, max_iter=FISTA_MAX_ITER, tol=1e-6):
+        """Run FISTA on stacked problems X (patches, samples, features) and D (patches, features, atoms).
+
+        Returns the coefficients and the per-patch iteration count; a count below
+        ``max_iter`` means that patch converged and stopped early. The solve runs
+        in ``solve_dtype`` of the inputs, with the ``tolerance`` of each patch's X.
+        """
+        dtype = SparseCoding.solve_dtype(X, D)
+        X = np.ascontiguousarray(X, dtype=dtype)
+        D = np.ascontiguousarray(D, dtype=dtype)
+        n_patches, n_samples, _ = X.shape
+        n_atoms = D.shape[2]
+        L = (np.linalg.norm(D, ord=2, axis=(1, 2))**2 if n_patches else np.zeros(0)).astype(dtype)
+
+        alpha = np.zeros((n_patches, n_samples, n_atoms), dtype=dtype)
+        alpha_prev = np.zeros_like(alpha)
+        y = np.zeros_like(alpha)
+        XD = np.empty_like(alpha)
+        G = np.empty((n_patches, n_atoms, n_atoms), dtype=dtype)
+        n_iter = np.zeros(n_patches, dtype=np.int64)
+
+        _fista_batch_kernel(X, D, L, dtype.type(lambda_reg), SparseCoding.momentum(max_iter, dtype),
+                            SparseCoding.tolerance(X, tol, axis=(1, 2)), alpha, alpha_prev, y, XD, G, n_iter)
+        return alpha, n_iter
+
+    @staticmethod
+    def train_dictionary(msi_lr_flat, hsi_comp_flat, n_atoms, dict_init=None, max_iter=20):
+        """Train a coupled dictionary over MSI bands and HSI components, optionally from ``dict_init``."""
+        data = np.hstack([msi_lr_flat, hsi_comp_flat])
+        if dict_init is None:
+            dict_learner = DictionaryLearning(n_components=n_atoms, alpha=1, max_iter=max_iter, random_state=0)
+        else:
+            # The code is re-encoded before the first dictionary update, so zeros suffice
+            dict_learner = DictionaryLearning(n_components=n_atoms, alpha=1, max_iter=max_iter, random_state=0,
+                                              dict_init=dict_init.T,
+                                              code_init=np.zeros((data.shape[0], n_atoms), dtype=data.dtype))
+        dict_learner.fit(data)
+        return dict_learner.components_.T
+
+    @staticmethod
+    def train_shared_dictionary(samples, n_atoms, batch_size=256, max_iter=10):
+        """Train one coupled dictionary online from mini-batches of sampled patch pixels."""
+        dict_learner = MiniBatchDictionaryLearning(n_components=n_atoms, alpha=1, batch_size=batch_size,
+                                                   max_iter=max_iter, random_state=0)
+        dict_learner.fit(samples)
+        return dict_learner.components_.T
+
+    @staticmethod
+    def refine_dictionary(D, msi_lr_flat, hsi_comp_flat, n_iter=3):
+        """Warm-start a few online passes from a shared dictionary on one patch."""
+        data = np.hstack([msi_lr_flat, hsi_comp_flat])
+        dict_learner = MiniBatchDictionaryLearning(n_components=D.shape[1], alpha=1, dict_init=D.T,
+                                                   batch_size=data.shape[0], max_iter=n_iter, random_state=0)
         dict_learner.fit(data)
         return dict_learner.components_.T
 
-    def sparse_code_residual(self, msi_lr_patch, msi_hr_patch, hsi_components, n_atoms, f, lambda_reg):
-        """Compute residual using sparse coding."""
-        msi_lr_flat = msi_lr_patch.reshape(-1, msi_lr_patch.shape[-1])
-        msi_hr_flat = msi_hr_patch.reshape(-1, msi_hr_patch.shape[-1])
-        hsi_comp_flat = hsi_components.reshape(-1, hsi_components.shape[-1])
+    def patch_dictionary(self, msi_lr_patch, hsi_components, n_atoms, shared_dictionary=None, refine_iter=0,
+                         state=None):
+        """Get the patch dictionary and keep its normalized MSI block for coding.
+
+        Without ``shared_dictionary`` a dictionary is learned from the patch alone;
+        otherwise the shared one is used as is, or refined for ``refine_iter`` passes.
+        A dict passed as ``state`` carries the learned dictionary from patch to
+        patch, and a carried one warm-starts a shorter ``WARM_DICTIONARY_ITER`` fit.
+        """
+        msi_lr_flat = msi_lr_patch.reshape(-1, msi_lr_patch.shape[-1]).astype(self.dtype, copy=False)
+        hsi_comp_flat = hsi_components.reshape(-1, hsi_components.shape[-1]).astype(self.dtype, copy=False)
+
+        previous = state.get('dictionary') if state is not None else None
+        if shared_dictionary is None and previous is not None and \
+                previous.shape == (msi_lr_flat.shape[1] + hsi_comp_flat.shape[1], n_atoms):
+            D = self.train_dictionary(msi_lr_flat, hsi_comp_flat, n_atoms, previous, self.WARM_DICTIONARY_ITER)
+            state['dictionary'] = D
+        elif shared_dictionary is None:
+            D = self.train_dictionary(msi_lr_flat, hsi_comp_flat, n_atoms)
+            if state is not None:
+                state['dictionary'] = D
+        elif refine_iter > 0:
+            D = self.refine_dictionary(shared_dictionary, msi_lr_flat, hsi_comp_flat, refine_iter)
+        else:
+            D = shared_dictionary
+        D = D[:msi_lr_flat.shape[1]]
+        norms = np.linalg.norm(D, axis=0, keepdims=True)
+        return (D / np.where(norms > 0, norms, 1)).astype(self.dtype)
+
+    @staticmethod
+    def upsampled_mean(hsi_components, f, n_bands):
+        """Upsample the mean HSI component to the MSI grid, repeated over bands."""
+        return zoom(hsi_components.mean(axis=-1, keepdims=True),
+                    (f, f, n_bands), order=3, mode='nearest')
+
+    def sparse_code_residual(self, msi_lr_patch, msi_hr_patch, hsi_components, n_atoms, f, lambda_reg,
+                             shared_dictionary=None, refine_iter=0, record=None, state=None):
+        """Compute residual using sparse coding.
 
-        D = self.train_dictionary(msi_lr_flat, hsi_comp_flat, n_atoms)
-        D = D / np.linalg.norm(D, axis=0, keepdims=True)
+        A dict passed as ``record`` receives the dictionary time and FISTA iterations.
+        A dict passed as ``state`` warm-starts the dictionary (see ``patch_dictionary``)
+        and FISTA from its 'alpha_init', and receives the coefficients as 'alpha'.
+        """
+        msi_hr_flat = msi_hr_patch.reshape(-1, msi_hr_patch.shape[-1]).astype(self.dtype, copy=False)
+        start = time.perf_counter()
+        D = self.patch_dictionary(msi_lr_patch, hsi_components, n_atoms, shared_dictionary, refine_iter, state)
+        dictionary_seconds = time.perf_counter() - start
 
-        coeffs_hr = self.fista(msi_hr_flat, D, lambda_reg)
+        alpha_init = state.get('alpha_init') if state is not None else None
+        if alpha_init is not None and alpha_init.shape != (msi_hr_flat.shape[0], D.shape[1]):
+            alpha_init = None
+        coeffs_hr, n_iter = self.fista(msi_hr_flat, D, lambda_reg, return_n_iter=True, alpha_init=alpha_init)
+        if state is not None:
+            state['alpha'] = coeffs_hr
+        if record is not None:
+            record.update(dictionary_seconds=dictionary_seconds, fista_iterations=int(n_iter),
+                          fista_converged=bool(n_iter < self.FISTA_MAX_ITER))
         pred_hr = np.dot(coeffs_hr, D.T).reshape(msi_hr_patch.shape[0], msi_hr_patch.shape[1], -1)
 
-        hsi_mean_upsampled = zoom(hsi_components.mean(axis=-1, keepdims=True),
-                                (f, f, pred_hr.shape[-1]), order=3, mode='nearest')
-        residual = pred_hr - hsi_mean_upsampled
+        residual = pred_hr - self.upsampled_mean(hsi_components, f, pred_hr.shape[-1])
 
         return residual
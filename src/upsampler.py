@@ -1,39 +1,121 @@
 import numpy as np
-from skimage.transform import resize
-from scipy.ndimage import gaussian_filter
+import cv2
+from joblib import Parallel, delayed
+from scipy.ndimage import gaussian_filter, zoom
+from .scheduler import default_n_jobs
 
 class HSIUpsampler:
     """Handles enhanced HSI upsampling with MSI detail injection."""
-    
+
+    # Input pixels each kernel reads beyond a tile; the order-5 spline prefilter is
+    # recursive, and its slowest pole has decayed below 1e-6 after 16 pixels
+    RESIZE_HALO = {'spline5': 16, 'bicubic': 2, 'lanczos': 4}
+
+    @staticmethod
+    def resize_band(band, shape, kernel='spline5'):
+        """Resize one (rows, cols) float32 band to ``shape`` on pixel-center grids."""
+        if kernel == 'spline5':
+            return zoom(band, (shape[0] / band.shape[0], shape[1] / band.shape[1]), output=np.float32,
+                        order=5, mode='nearest', grid_mode=True)
+        interpolation = cv2.INTER_CUBIC if kernel == 'bicubic' else cv2.INTER_LANCZOS4
+        return cv2.resize(band, (shape[1], shape[0]), interpolation=interpolation)
+
+    @staticmethod
+    def resize_band_tiled(band, out, f, kernel, tile_size):
+        """Resize one band by an integer factor tile by tile, writing each core into ``out``."""
+        halo = HSIUpsampler.RESIZE_HALO[kernel]
+        rows, cols = band.shape
+        for row in range(0, rows, tile_size):
+            for col in range(0, cols, tile_size):
+                row0, col0 = max(row - halo, 0), max(col - halo, 0)
+                row1, col1 = min(row + tile_size + halo, rows), min(col + tile_size + halo, cols)
+                tile = HSIUpsampler.resize_band(band[row0:row1, col0:col1],
+                                                ((row1 - row0) * f, (col1 - col0) * f), kernel)
+                core_rows, core_cols = min(tile_size, rows - row) * f, min(tile_size, cols - col) * f
+                out[row * f:row * f + core_rows, col * f:col * f + core_cols] = \
+                    tile[(row - row0) * f:(row - row0) * f + core_rows, (col - col0) * f:(col - col0) * f + core_cols]
+
+    @staticmethod
+    def resize_hsi(hsi, shape, kernel='spline5', tile_size=256, n_jobs=None, clip_range=None):
+        """Resize the HSI to a (rows, cols) grid along the spatial axes only.
+
+        ``kernel`` is 'spline5' (order-5 spline, the original resize), 'bicubic' or
+        'lanczos'. Bands are resized in float32 on a thread pool; for integer scale
+        factors each band is processed in ``tile_size`` tiles with a kernel halo.
+        Like ``skimage.transform.resize``, the output is clipped to the input range,
+        or to ``clip_range`` (min, max), e.g. the scene's range when ``hsi`` is a tile.
+        """
+        if kernel not in HSIUpsampler.RESIZE_HALO:
+            raise ValueError(f"Unknown resize kernel: {kernel}")
+        planes = np.ascontiguousarray(np.moveaxis(hsi, -1, 0), dtype=np.float32)
+        out = np.empty((shape[0], shape[1], hsi.shape[2]), dtype=np.float32)
+        f = shape[0] // hsi.shape[0]
+        tiled = f >= 1 and (hsi.shape[0] * f, hsi.shape[1] * f) == tuple(shape[:2])
+
+        def resize_one(band):
+            if tiled:
+                HSIUpsampler.resize_band_tiled(planes[band], out[..., band], f, kernel, tile_size)
+            else:
+                out[..., band] = HSIUpsampler.resize_band(planes[band], shape[:2], kernel)
+
+        Parallel(n_jobs=n_jobs or default_n_jobs(), backend='threading')(
+            delayed(resize_one)(band) for band in range(hsi.shape[2]))
+        if clip_range is not None:
+            np.clip(out, *clip_range, out=out)
+        elif hsi.size:
+            np.clip(out, planes.min(), planes.max(), out=out)
+        return out
+
+    @staticmethod
+    def guide_high_pass(msi_guide):
+        """High-frequency part of the grayscale guide, before range normalization."""
+        msi_guide_gray = np.mean(msi_guide, axis=-1)
+        return msi_guide_gray - gaussian_filter(msi_guide_gray, sigma=1, mode='reflect')
+
+    @staticmethod
+    def band_moments(cube, chunk_rows=256):
+        """Per-band sums and sums of squares in float64, plus the pixel count, in one pass."""
+        n_bands = cube.shape[-1]
+        band_sum, band_sq = np.zeros(n_bands), np.zeros(n_bands)
+        for row in range(0, cube.shape[0], chunk_rows):
+            chunk = cube[row:row + chunk_rows].reshape(-1, n_bands).astype(np.float64)
+            band_sum += chunk.sum(axis=0)
+            band_sq += np.einsum('ij,ij->j', chunk, chunk)
+        return band_sum, band_sq, cube.shape[0] * cube.shape[1]
+
     @staticmethod
-    def enhanced_hsi_upsampling(hsi, msi, msi_guide, detail_weight=3.5):
-        """Upsample HSI while injecting MSI details."""
+    def band_stats(cube):
+        """Per-band mean and std of a (rows, cols, bands) cube from one pass over it."""
+        band_sum, band_sq, n = HSIUpsampler.band_moments(cube)
+        means = band_sum / n
+        return means, np.sqrt(np.maximum(band_sq / n - means ** 2, 0))
+
+    @staticmethod
+    def match_band_stats(enhanced, target_means, target_stds, band_means, band_stds):
+        """Shift and scale every band in place to the target mean and std."""
+        nonflat = band_stds > 0
+        scale = np.where(nonflat, target_stds / np.where(nonflat, band_stds, 1), 1)
+        shift = np.where(nonflat, target_means - band_means * scale, 0)
+        enhanced *= scale.astype(enhanced.dtype)
+        enhanced += shift.astype(enhanced.dtype)
+        return enhanced
+
+    @staticmethod
+    def enhanced_hsi_upsampling(hsi, msi, msi_guide, detail_weight=3.5, kernel='spline5'):
+        """Upsample HSI while injecting MSI details; ``kernel`` selects the resize kernel."""
         if hsi.shape[2] < 1 or msi.shape[:2] != msi_guide.shape[:2]:
             raise ValueError("Inconsistent input dimensions.")
 
-        original_means = np.mean(hsi, axis=(0, 1))
-        original_stds = np.std(hsi, axis=(0, 1))
+        original_means, original_stds = HSIUpsampler.band_stats(hsi)
 
-        hsi_upsampled = resize(
-            hsi, (msi.shape[0], msi.shape[1], hsi.shape[2]),
-            order=5, mode='edge', anti_aliasing=False, preserve_range=True
-        ).astype(np.float32)
+        hsi_upsampled = HSIUpsampler.resize_hsi(hsi, msi.shape[:2], kernel)
 
+        # The gaussian high-pass is linear and ignores offsets, so normalizing the
+        # guide to [0, 1] reduces to dividing its high-pass by the guide's range
         msi_guide_gray = np.mean(msi_guide, axis=-1)
-        msi_guide_gray = (msi_guide_gray - msi_guide_gray.min()) / \
-                        (msi_guide_gray.max() - msi_guide_gray.min() + 1e-6)
-
-        msi_low = gaussian_filter(msi_guide_gray, sigma=1, mode='reflect')
-        msi_high = msi_guide_gray - msi_low
-
-        for band in range(hsi_upsampled.shape[2]):
-            enhanced = hsi_upsampled[..., band] + detail_weight * msi_high
-            band_mean = np.mean(enhanced)
-            band_std = np.std(enhanced)
-            if band_std > 0:
-                hsi_upsampled[..., band] = original_means[band] + \
-                                         (enhanced - band_mean) * (original_stds[band] / band_std)
-            else:
-                hsi_upsampled[..., band] = enhanced
+        msi_high = HSIUpsampler.guide_high_pass(msi_guide) / \
+                   (msi_guide_gray.max() - msi_guide_gray.min() + 1e-6)
 
-        return hsi_upsampled
+        hsi_upsampled += detail_weight * msi_high[..., np.newaxis]
+        return HSIUpsampler.match_band_stats(hsi_upsampled, original_means, original_stds,
+                                             *HSIUpsampler.band_stats(hsi_upsampled))
@@ -0,0 +1,77 @@
+import numpy as np
+
+class ValidityIndex:
+    """Summed-area tables of valid pixels and MSI texture on the HSI grid.
+
+    A pixel is valid when all its HSI and low-res MSI bands are finite, the rule
+    of ``PatchProcessor.extract_patch``, and it is not in the ``nodata`` mask
+    (see ``HSIDataLoader.nodata_mask``). The mask marks pixels whose gaps were
+    filled during preprocessing. The tables are built once per run in
+    row chunks. Any patch's valid pixel count, and the mean and variance of the
+    grayscale low-res MSI over those pixels, then take four lookups each, so
+    patches can be filtered before they are scheduled.
+    """
+
+    def __init__(self, hsi, msi_lr, nodata=None, chunk_rows=256):
+        rows, cols = hsi.shape[:2]
+        valid = np.empty((rows, cols), dtype=bool)
+        gray = np.zeros((rows, cols))
+        for row in range(0, rows, chunk_rows):
+            hsi_chunk, lr_chunk = hsi[row:row + chunk_rows], msi_lr[row:row + chunk_rows]
+            chunk_valid = np.isfinite(hsi_chunk).all(axis=-1) & np.isfinite(lr_chunk).all(axis=-1)
+            if nodata is not None:
+                chunk_valid &= ~nodata[row:row + chunk_rows]
+            valid[row:row + chunk_rows] = chunk_valid
+            gray[row:row + chunk_rows] = np.where(chunk_valid, lr_chunk.mean(axis=-1, dtype=np.float64), 0)
+        self.valid = self.table(valid)
+        self.gray_sum = self.table(gray)
+        self.gray_sq = self.table(gray * gray)
+
+    @staticmethod
+    def table(values):
+        """Summed-area table with a leading zero row and column."""
+        out = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        np.cumsum(np.cumsum(values, axis=0, dtype=np.float64), axis=1, out=out[1:, 1:])
+        return out
+
+    @staticmethod
+    def window(table, coords, size):
+        """Sums of ``table``'s values over the size x size windows at (x, y) origins."""
+        xs, ys = np.asarray(coords, dtype=np.int64).reshape(-1, 2).T
+        return table[xs + size, ys + size] - table[xs, ys + size] - table[xs + size, ys] + table[xs, ys]
+
+    def counts(self, coords, patch_size):
+        """Valid pixel count of every patch."""
+        return self.window(self.valid, coords, patch_size).round().astype(np.int64)
+
+    def texture(self, coords, patch_size):
+        """Coefficient of variation (std / |mean|) of the grayscale low-res MSI over every patch's valid pixels.
+
+        Patches without valid pixels get 0, and patches with a zero mean infinity.
+        """
+        n = np.maximum(self.counts(coords, patch_size), 1)
+        mean = self.window(self.gray_sum, coords, patch_size) / n
+        std = np.sqrt(np.maximum(self.window(self.gray_sq, coords, patch_size) / n - mean * mean, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(std > 0, std / np.abs(mean), 0.0)
+
+    def valid_coords(self, coords, patch_size, min_valid=5):
+        """The origins of patches with more than ``min_valid`` valid pixels."""
+        if not coords:
+            return []
+        keep = self.counts(coords, patch_size) > min_valid
+        return [coord for coord, kept in zip(coords, keep) if kept]
+
+    def adaptive_coords(self, coords, patch_size, sparse_stride, texture_threshold, origin=(0, 0)):
+        """Thin the origins of homogeneous patches to a ``sparse_stride`` grid.
+
+        Origins on the sparse grid (in scene coordinates, so tiles share it) are
+        always kept. Other origins are kept only if their patch's ``texture``
+        is at least ``texture_threshold``. The decision depends on the patch
+        alone, so tiled and whole-scene runs keep the same origins.
+        """
+        if not coords:
+            return []
+        textured = self.texture(coords, patch_size) >= texture_threshold
+        return [(x, y) for (x, y), dense in zip(coords, textured)
+                if dense or ((x + origin[0]) % sparse_stride == 0 and (y + origin[1]) % sparse_stride == 0)]
@@ -0,0 +1,33 @@
+"""Compile and load everything a fresh process needs before its first patch.
+
+The numba kernels are cached on disk (``cache=True``), so only the first
+process after an install or code change compiles them. Run this module once
+after deployment, e.g. when building an image, so that no worker pays for
+compilation::
+
+    python -m src.warmup
+"""
+import time
+import numpy as np
+from .guided_filter import GuidedFilter
+from .patch_processor import PatchProcessor
+
+def warm_up():
+    """Run every compiled kernel and solver once on tiny inputs; returns the time taken in seconds.
+
+    The inputs have the dtypes of a real run, so the compiled signatures are the
+    ones the pipeline uses.
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng(0)
+    processor = PatchProcessor(rng.random((8, 8, 4)).astype(np.float32), rng.random((16, 16, 3)).astype(np.float32),
+                               n_components=2, n_atoms=2)
+    processor.f = 2
+    processor.msi_lr = processor.msi[::2, ::2]
+    processor.process_patch(0, 0, 8)
+    processor.solve_batch([processor.prepare_patch(0, 0, 8)])
+    GuidedFilter(processor.msi, 1).filter(rng.random((16, 16, 2)).astype(np.float32))
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    print(f"Warm-up took {warm_up():.2f} s")
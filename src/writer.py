@@ -0,0 +1,167 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+class NpySink:
+    """Writes output blocks into a memory-mapped .npy file."""
+
+    def __init__(self, path, shape, dtype=np.float32):
+        self.path = path
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+    def write(self, row, col, block):
+        """Write a (rows, cols, bands) block with its top-left corner at (row, col)."""
+        self.data[row:row + block.shape[0], col:col + block.shape[1], :] = block
+
+    def close(self):
+        """Flush and release the memory map."""
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class GeoTiffSink:
+    """Writes output blocks into a tiled, compressed GeoTIFF."""
+
+    def __init__(self, path, shape, reference_path=None, block_size=256, compress='deflate'):
+        height, width, bands = shape
+        profile = {'driver': 'GTiff', 'height': height, 'width': width, 'count': bands, 'dtype': 'float32',
+                   'tiled': True, 'blockxsize': block_size, 'blockysize': block_size, 'compress': compress,
+                   'BIGTIFF': 'IF_SAFER'}
+        if reference_path is not None:
+            with rasterio.open(reference_path) as ref:
+                profile.update(crs=ref.crs, transform=ref.transform)
+        self.path = path
+        self.dst = rasterio.open(path, 'w', **profile)
+
+    def write(self, row, col, block):
+        """Write a (rows, cols, bands) block with its top-left corner at (row, col)."""
+        window = Window(col, row, block.shape[1], block.shape[0])
+        self.dst.write(np.moveaxis(block.astype(np.float32), -1, 0), window=window)
+
+    def close(self):
+        """Close the dataset, flushing pending blocks."""
+        if self.dst is not None:
+            self.dst.close()
+            self.dst = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BackgroundSink:
+    """Writes blocks to another sink on a background thread.
+
+    Compression and disk writes then overlap with the caller's compute. At
+    most ``depth`` blocks wait to be written; a further ``write`` blocks until
+    the oldest is done, which bounds the memory held by queued blocks. Blocks
+    are queued without a copy, so callers must not modify them afterwards.
+    Write errors are raised by a later ``write`` or by ``close``. ``close``
+    waits for every pending write but leaves the wrapped sink open. With
+    ``depth=0`` blocks are written in the calling thread. Time the caller
+    spends waiting for writes is added to ``metrics`` as stage 'write_wait'.
+    """
+
+    def __init__(self, sink, depth=2, metrics=None):
+        self.sink = sink
+        self.depth = depth
+        self.metrics = metrics
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(1) if depth > 0 else None
+
+    def wait(self, n_pending):
+        """Wait until at most ``n_pending`` writes are queued."""
+        start = time.perf_counter()
+        try:
+            while len(self.pending) > n_pending:
+                self.pending.popleft().result()
+        finally:
+            if self.metrics is not None:
+                self.metrics.add_stage('write_wait', time.perf_counter() - start)
+
+    def write(self, row, col, block):
+        """Queue a (rows, cols, bands) block with its top-left corner at (row, col)."""
+        if self.executor is None:
+            start = time.perf_counter()
+            self.sink.write(row, col, block)
+            if self.metrics is not None:
+                self.metrics.add_stage('write_wait', time.perf_counter() - start)
+            return
+        self.wait(self.depth - 1)
+        self.pending.append(self.executor.submit(self.sink.write, row, col, block))
+
+    def close(self):
+        """Finish every pending write and stop the background thread."""
+        if self.executor is not None:
+            try:
+                self.wait(0)
+            finally:
+                for future in self.pending:
+                    future.cancel()
+                self.executor.shutdown()
+                self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_sink(path, shape, reference_path=None):
+    """Pick a sink from the output extension: GeoTIFF for .tif/.tiff, .npy otherwise."""
+    if os.path.splitext(path)[1].lower() in ('.tif', '.tiff'):
+        return GeoTiffSink(path, shape, reference_path)
+    return NpySink(path, shape)
+
+def write_blocks(sink, array, block_size=256):
+    """Write an in-memory (rows, cols, bands) array to a sink block by block."""
+    for row in range(0, array.shape[0], block_size):
+        for col in range(0, array.shape[1], block_size):
+            sink.write(row, col, array[row:row + block_size, col:col + block_size])
+
+class OverlapAccumulator:
+    """Disk-backed overlap-add sums and counts at output resolution.
+
+    Tile contributions are added as they complete, so neither accumulator is
+    ever held in RAM in full; ``read`` returns the averaged field for a window.
+    """
+
+    def __init__(self, directory, shape):
+        os.makedirs(directory, exist_ok=True)
+        height, width, bands = shape
+        self.sums = np.lib.format.open_memmap(os.path.join(directory, 'sums.npy'), mode='w+',
+                                              dtype=np.float32, shape=(height, width, bands))
+        self.counts = np.lib.format.open_memmap(os.path.join(directory, 'counts.npy'), mode='w+',
+                                                dtype=np.int32, shape=(height, width))
+
+    def add(self, row, col, sums, counts):
+        """Add a tile's raw sums and counts with its top-left corner at (row, col)."""
+        rows = min(sums.shape[0], self.sums.shape[0] - row)
+        cols = min(sums.shape[1], self.sums.shape[1] - col)
+        bands = min(sums.shape[2], self.sums.shape[2])
+        self.sums[row:row + rows, col:col + cols, :bands] += sums[:rows, :cols, :bands]
+        self.counts[row:row + rows, col:col + cols] += counts[:rows, :cols]
+
+    def read(self, row0, row1, col0, col1):
+        """Return the averaged field over a window, zero where nothing was added."""
+        sums = np.array(self.sums[row0:row1, col0:col1])
+        counts = self.counts[row0:row1, col0:col1]
+        valid_mask = counts > 0
+        sums[valid_mask] = sums[valid_mask] / counts[valid_mask, np.newaxis]
+        return sums
+
+    def flush(self):
+        """Flush both memory maps to disk."""
+        self.sums.flush()
+        self.counts.flush()
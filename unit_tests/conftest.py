@@ -0,0 +1,25 @@
+import pytest
+import numpy as np
+import rasterio
+
+@pytest.fixture
+def synthetic_patch_data():
+    """Create seeded synthetic MSI and HSI data for patch processing."""
+    rng = np.random.default_rng(0)
+    hsi = rng.random((50, 50, 10)).astype(np.float32)
+    msi = rng.random((100, 100, 3)).astype(np.float32)
+    return hsi, msi
+
+@pytest.fixture
+def write_scene(tmp_path):
+    """Return a function writing an MSI/HSI array pair as float32 GeoTIFFs that returns their paths."""
+    def write(name, msi, hsi):
+        paths = []
+        for suffix, data in (('msi', msi), ('hsi', hsi)):
+            path = str(tmp_path / f"{name}_{suffix}.tif")
+            with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1],
+                               count=data.shape[2], dtype='float32') as dst:
+                dst.write(np.moveaxis(data.astype(np.float32), -1, 0))
+            paths.append(path)
+        return paths
+    return write
@@ -0,0 +1,34 @@
+import json
+import pytest
+import numpy as np
+from src.batch import BatchEnhancer
+
+def test_read_manifest(tmp_path):
+    """Test reading scene triples from CSV and JSON manifests."""
+    csv_path = tmp_path / "scenes.csv"
+    csv_path.write_text("# msi,hsi,output\na.tif, b.tif, out/c.npy\n\n")
+    assert BatchEnhancer.read_manifest(str(csv_path)) == [('a.tif', 'b.tif', 'out/c.npy')]
+    json_path = tmp_path / "scenes.json"
+    json_path.write_text(json.dumps([{'msi_path': 'a.tif', 'hsi_path': 'b.tif', 'output_path': 'c.npy'}]))
+    assert BatchEnhancer.read_manifest(str(json_path)) == [('a.tif', 'b.tif', 'c.npy')]
+    csv_path.write_text("a.tif,b.tif\n")
+    with pytest.raises(ValueError):
+        BatchEnhancer.read_manifest(str(csv_path))
+
+def test_batch_run(tmp_path, write_scene):
+    """Test that a batch enhances every scene, reports timings and survives a failing scene."""
+    rng = np.random.default_rng(0)
+    scenes = [(*write_scene(f"scene{i}", rng.random((40, 40, 3)), rng.random((20, 20, 6))),
+               str(tmp_path / "out" / f"scene{i}.npy")) for i in range(2)]
+    scenes.insert(1, ("missing_msi.tif", "missing_hsi.tif", str(tmp_path / "out" / "missing.npy")))
+
+    batch = BatchEnhancer(n_components=3, n_atoms=3)
+    report = batch.run(scenes, patch_size=8, stride=6, dictionary='global')
+
+    assert [entry['status'] for entry in report] == ['processed', 'failed', 'processed']
+    expected = batch.load(*scenes[2][:2]).fuse_to_enhance(patch_size=8, stride=6, dictionary='global')
+    assert np.allclose(np.load(scenes[2][2]), expected)
+    for entry in (report[0], report[2]):
+        assert entry['seconds'] >= entry['load_wait_seconds'] >= 0
+        assert entry['write_seconds'] > 0
+        assert entry['metrics']['patches']['processed'] == 9
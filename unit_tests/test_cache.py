@@ -0,0 +1,41 @@
+import os
+import numpy as np
+from src.cache import ResultCache
+from src.patch_processor import PatchProcessor
+
+def test_cache_keys_and_eviction(tmp_path):
+    """Test content-addressed keys and least-recently-used eviction."""
+    data = np.arange(12, dtype=np.float32).reshape(3, 4)
+    key = ResultCache.key([data], patch_size=12, stride=1)
+    assert key == ResultCache.key([data.copy()], stride=1, patch_size=12)
+    assert key != ResultCache.key([data + 1], patch_size=12, stride=1)
+    assert key != ResultCache.key([data], patch_size=12, stride=2)
+
+    cache = ResultCache(str(tmp_path), max_bytes=10**9)
+    assert cache.get(key) is None
+    cache.put(key, values=data)
+    assert np.array_equal(cache.get(key)['values'], data)
+
+    entry_size = os.path.getsize(cache.path(key))
+    cache.max_bytes = 2 * entry_size
+    os.utime(cache.path(key), (0, 0))
+    cache.put("other0", values=data)
+    assert len(os.listdir(tmp_path)) == 2
+    cache.put("other1", values=data)
+    assert cache.get(key) is None
+    assert sorted(os.listdir(tmp_path)) == ["other0.npz", "other1.npz"]
+
+def test_run_parallel_uses_cache(synthetic_patch_data, tmp_path):
+    """Test that a repeated run is served from the cache without processing patches."""
+    hsi, msi = synthetic_patch_data
+    cache = ResultCache(str(tmp_path))
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    expected = processor.run_parallel(patch_size=8, stride=8, dictionary='global', cache=cache)
+    assert len(os.listdir(tmp_path)) == 2
+
+    def fail(*args):
+        raise AssertionError("patch was recomputed")
+    processor.process_patch = fail
+    processor.train_shared_dictionaries = fail
+    hsi_hr = processor.run_parallel(patch_size=8, stride=8, dictionary='global', cache=cache)
+    assert np.array_equal(hsi_hr, expected)
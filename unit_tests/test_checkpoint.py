@@ -0,0 +1,38 @@
+import pytest
+import numpy as np
+from src.checkpoint import Checkpoint
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+
+def test_resume_after_interruption(synthetic_patch_data, tmp_path):
+    """Test that a resumed run only processes the remaining patches and matches an uninterrupted run."""
+    hsi, msi = synthetic_patch_data
+    options = dict(patch_size=8, stride=6, engine='batch', dictionary='global', n_jobs=1)
+    expected = PatchProcessor(hsi, msi, n_components=3, n_atoms=3).run_parallel(**options)
+
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3)
+    process_coords = processor.process_coords
+    calls = []
+
+    def interrupted(coords, *args):
+        if calls:
+            raise KeyboardInterrupt
+        calls.append(coords)
+        return process_coords(coords, *args)
+    processor.process_coords = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        processor.run_parallel(checkpoint=Checkpoint(tmp_path, interval=0), **options)
+
+    metrics = PipelineMetrics()
+    checkpoint = Checkpoint(tmp_path, resume=True)
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3)
+    hsi_hr = processor.run_parallel(checkpoint=checkpoint, metrics=metrics, **options)
+
+    n_patches = len(processor.patch_coords(8, 6))
+    assert 0 < len(calls[0]) < n_patches
+    assert metrics.patches['processed'] == n_patches - len(calls[0])
+    assert len(checkpoint.done) == n_patches
+    assert np.allclose(hsi_hr, expected, rtol=1e-5, atol=1e-6)
+
+    checkpoint.clear()
+    assert not list(tmp_path.iterdir())
@@ -1,3 +1,4 @@
+import time
 import pytest
 import numpy as np
 from src.data_loader import HSIDataLoader
@@ -43,9 +44,99 @@ def test_load_and_preprocess(synthetic_data, tmp_path):
     # Check data integrity (values should be similar to original non-NaN regions)
     assert np.allclose(msi_processed[0:10, 0:10, :], msi[0:10, 0:10, :], rtol=1e-5, atol=1e-5)
 
+    # The filled pixels are remembered as having no data
+    expected = np.zeros((50, 50), dtype=bool)
+    expected[5:10, 5:10] = True
+    assert np.array_equal(loader.nodata, expected)
+
 def test_preprocess_data_invalid_input():
     """Test preprocessing with invalid input dimensions."""
     loader = HSIDataLoader()
     invalid_data = np.random.rand(100, 100)  # 2D instead of 3D
     with pytest.raises(ValueError, match="Input data must be 3D"):
-        loader.preprocess_data(invalid_data)
\ No newline at end of file
+        loader.preprocess_data(invalid_data)
+
+def test_iter_tiles(synthetic_data, tmp_path):
+    """Test that streamed tiles cover the scene and carry aligned MSI windows."""
+    msi, hsi = synthetic_data
+    import rasterio
+    msi_path = tmp_path / "msi.tif"
+    hsi_path = tmp_path / "hsi.tif"
+    for path, data in ((msi_path, msi), (hsi_path, hsi)):
+        with rasterio.open(path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=data.shape[2],
+                           dtype='float32', tiled=True, blockxsize=16, blockysize=16) as dst:
+            dst.write(np.moveaxis(data, -1, 0))
+
+    loader = HSIDataLoader()
+    tiles = list(loader.iter_tiles(str(msi_path), str(hsi_path), tile_size=20, patch_size=8))
+
+    owned = np.zeros(hsi.shape[:2], dtype=np.int32)
+    for tile in tiles:
+        row0, row1, col0, col1 = tile.core
+        owned[row0:row1, col0:col1] += 1
+        assert tile.origin[0] <= row0 and tile.origin[1] <= col0
+        assert tile.msi.shape[:2] == (tile.hsi.shape[0] * 2, tile.hsi.shape[1] * 2)
+        assert not np.any(np.isnan(tile.hsi)) and not np.any(np.isnan(tile.msi))
+        # Block grid is 16 px, so 20 px tiles are rounded up to 32 px cores
+        assert row0 % 32 == 0 and col0 % 32 == 0
+    assert np.all(owned == 1)
+
+def test_preprocess_data_fills_in_place():
+    """Test that NaNs take the NaN-ignoring spatial median of their window, filled in place."""
+    rng = np.random.default_rng(0)
+    data = rng.random((12, 10, 4)).astype(np.float32)
+    data[rng.random(data.shape) < 0.1] = np.nan
+    data[0:5, 0:5, 1] = np.nan
+    original = data.copy()
+
+    result = HSIDataLoader.preprocess_data(data, chunk_rows=5, chunk_samples=7)
+    assert result is data
+    assert not np.any(np.isnan(result))
+    assert np.array_equal(result[~np.isnan(original)], original[~np.isnan(original)])
+
+    padded = np.pad(original, ((1, 1), (1, 1), (0, 0)), mode='edge')
+    valid_mean = np.nanmean(original)
+    for row, col, band in zip(*np.nonzero(np.isnan(original))):
+        window = padded[row:row + 3, col:col + 3, band]
+        expected = np.nanmedian(window) if np.any(~np.isnan(window)) else valid_mean
+        assert np.isclose(result[row, col, band], expected)
+
+def test_nodata_mask_uneven_msi():
+    """Test the nodata mask of an MSI that is not an exact multiple of the HSI grid."""
+    hsi = np.random.rand(50, 50, 4).astype(np.float32)
+    hsi[:2, :2] = np.nan
+    for shape in ((100, 99, 3), (100, 101, 3)):
+        msi = np.random.rand(*shape).astype(np.float32)
+        msi[:2, 98:] = np.nan
+        msi[98:, :2] = np.nan
+        mask = HSIDataLoader.nodata_mask(hsi, msi, chunk_rows=16)
+
+        expected = np.zeros((50, 50), dtype=bool)
+        expected[:2, :2] = True
+        expected[0, 49] = expected[49, 0] = True
+        assert np.array_equal(mask, expected)
+
+def test_prefetch():
+    """Test that prefetching keeps the order, reads at most ``depth`` items ahead and raises errors in place."""
+    produced = []
+
+    def items():
+        for i in range(6):
+            produced.append(i)
+            yield i
+        raise ValueError("unreadable tile")
+
+    stream = HSIDataLoader.prefetch(items(), depth=2)
+    assert next(stream) == 0
+    time.sleep(0.2)
+    assert len(produced) <= 3
+    assert [next(stream) for _ in range(5)] == [1, 2, 3, 4, 5]
+    with pytest.raises(ValueError, match="unreadable tile"):
+        next(stream)
+
+    source = items()
+    stream = HSIDataLoader.prefetch(source, depth=2)
+    assert next(stream) == 0
+    stream.close()
+    assert source.gi_frame is None
+    assert list(HSIDataLoader.prefetch(range(4), depth=0)) == [0, 1, 2, 3]
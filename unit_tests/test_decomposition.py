@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+from src.decomposition import Decomposition, BatchDecomposition
+from src.patch_processor import PatchProcessor
+
+@pytest.fixture
+def synthetic_patches():
+    """Create a stack of synthetic HSI patches."""
+    return np.random.default_rng(0).random((6, 8, 8, 12))
+
+def test_batch_default_matches_per_patch(synthetic_patches):
+    """Test that the default method set reproduces the per-patch decompositions."""
+    result = BatchDecomposition(n_components=3, dtype=np.float64).transform(synthetic_patches)
+    for patch, components in zip(synthetic_patches, result):
+        expected = np.hstack([Decomposition.wavelet_3d_transform(patch, 3),
+                              Decomposition.fastica_decomposition(patch, 3),
+                              Decomposition.nmf_decomposition(patch, 3)])
+        assert np.allclose(components.reshape(-1, 9), expected)
+
+def test_fastica_warm_start(synthetic_patches):
+    """Test that the ICA state carries the fitted unmixing matrix to the next patch."""
+    state = {}
+    first = Decomposition.fastica_decomposition(synthetic_patches[0], 3, state)
+    assert state['ica_unmixing'].shape == (3, 3)
+    # Warm started from its own unmixing matrix, a patch converges to the same components
+    again = Decomposition.fastica_decomposition(synthetic_patches[0], 3, state)
+    assert np.all(np.abs(np.sum(again * first, axis=0)) > 0.99)
+
+def test_batch_fast_methods(synthetic_patches):
+    """Test the global, randomized SVD and multiplicative-update NMF methods."""
+    methods = ('pca', 'global_ica', 'svd', 'nmf_mu')
+    decomposer = BatchDecomposition(methods, n_components=3)
+    with pytest.raises(RuntimeError, match="not fitted"):
+        decomposer.transform(synthetic_patches)
+    decomposer.fit(synthetic_patches.reshape(-1, 8, 12))
+
+    result = decomposer.transform(synthetic_patches)
+    assert result.shape == (6, 8, 8, 12) and result.dtype == np.float32
+    norms = np.linalg.norm(result.reshape(6, 64, 12), axis=1)
+    assert np.allclose(norms, 1)
+    with pytest.raises(ValueError, match="Unknown decomposition methods"):
+        BatchDecomposition(('pca', 'lda'))
+
+def test_nmf_mu_independent_of_batching(synthetic_patches):
+    """Test that each patch's multiplicative-update NMF does not depend on the patches batched with it."""
+    decomposer = BatchDecomposition(('nmf_mu',), n_components=3)
+    whole = decomposer.transform(synthetic_patches)
+    split = np.concatenate([decomposer.transform(synthetic_patches[:1]), decomposer.transform(synthetic_patches[1:])])
+    assert np.allclose(whole, split, atol=1e-6)
+
+def test_run_parallel_fast_decompositions():
+    """Test the batch engine with a configured set of fast decompositions."""
+    hsi = np.random.rand(40, 40, 10).astype(np.float32)
+    msi = np.random.rand(80, 80, 3).astype(np.float32)
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    hsi_hr = processor.run_parallel(patch_size=8, stride=4, engine='batch', decompositions=('pca', 'nmf_mu'))
+    assert processor.decomposer.methods == ('pca', 'nmf_mu')
+    assert np.any(hsi_hr != 0) and np.all(np.isfinite(hsi_hr))
@@ -38,7 +38,65 @@ def test_fuse_to_enhance(synthetic_enhancer_data):
     # Check that output contains non-zero values
     assert np.any(hsi_enhanced != 0)
 
+    # Check that the run's metrics cover every stage and patch
+    summary = enhancer.metrics.summary()
+    assert set(summary['stages']) >= {'load_and_preprocess', 'patches', 'upsampling', 'guided_filter'}
+    assert summary['patches']['total'] == len(range(0, 43, 4)) ** 2
+
+    # The coarse-to-fine mode only refines part of the scene at the full stride
+    hsi_enhanced = enhancer.fuse_to_enhance(patch_size=8, stride=4, guide_radius=1, detail_weight=2.0,
+                                            engine='batch', quality=0.25)
+    assert hsi_enhanced.shape == (100, 100, 10) and np.all(np.isfinite(hsi_enhanced))
+    assert enhancer.metrics.summary()['patches']['total'] < len(range(0, 43, 4)) ** 2
+
 def test_enhancer_invalid_file():
     """Test HSIEnhancer with invalid file paths."""
     with pytest.raises(FileNotFoundError):
-        enhancer = HSIEnhancer("nonexistent_msi.tif", "nonexistent_hsi.dat")
\ No newline at end of file
+        enhancer = HSIEnhancer("nonexistent_msi.tif", "nonexistent_hsi.dat")
+
+def test_tiled_fuse_to_sink(synthetic_enhancer_data, tmp_path):
+    """Test out-of-core tiled enhancement against the in-memory path."""
+    from src.enhancer import TiledHSIEnhancer
+    from src.writer import NpySink
+    import rasterio
+    msi_path, hsi_path = synthetic_enhancer_data
+    # A bright corner gives the tiles value ranges other than the scene's
+    with rasterio.open(hsi_path) as src:
+        hsi, profile = src.read(), src.profile
+    hsi[:, :20, :20] *= 3
+    hsi_path = str(tmp_path / "bright_hsi.tif")
+    with rasterio.open(hsi_path, 'w', **profile) as dst:
+        dst.write(hsi)
+    enhancer = HSIEnhancer(msi_path, hsi_path, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    expected = enhancer.fuse_to_enhance(patch_size=8, stride=4, guide_radius=1, detail_weight=2.0)
+
+    tiled = TiledHSIEnhancer(msi_path, hsi_path, n_components=3, n_atoms=3, lambda_reg=0.0005, tile_size=20)
+    assert tiled.output_shape == (100, 100, 10)
+    assert tiled.halo(8, 1, 'spline5') == 16 + 3 + 1 and tiled.halo(8, 1, 'bicubic') == 8 + 1
+    with NpySink(str(tmp_path / "out.npy"), tiled.output_shape) as sink:
+        tiled.fuse_to_sink(sink, str(tmp_path / "scratch"), patch_size=8, stride=4, guide_radius=1,
+                           detail_weight=2.0)
+    hsi_enhanced = np.load(tmp_path / "out.npy")
+
+    # Halos cover every stage's context and tiles clip to the scene's range
+    assert tiled.value_range == (float(hsi.min()), float(hsi.max()))
+    assert np.allclose(hsi_enhanced, expected, rtol=0, atol=1e-4)
+
+    # Reading, compute and writing in turn gives the same output as the prefetching pipeline
+    tiled.prefetch = 0
+    with NpySink(str(tmp_path / "sequential.npy"), tiled.output_shape) as sink:
+        tiled.fuse_to_sink(sink, str(tmp_path / "scratch_sequential"), patch_size=8, stride=4, guide_radius=1,
+                           detail_weight=2.0)
+    assert np.array_equal(np.load(tmp_path / "sequential.npy"), hsi_enhanced)
+
+    # The coarse-to-fine stage ranks tiles across the whole scene, so tiles reject it
+    with pytest.raises(ValueError, match="quality"):
+        tiled.fuse_to_sink(sink, str(tmp_path / "scratch_quality"), patch_size=8, stride=4, quality=0.5)
+
+def test_tiled_global_dictionary(caplog):
+    """Test that tiled runs map the global dictionary strategy to per-tile dictionaries."""
+    from src.enhancer import TiledHSIEnhancer
+    options = {'engine': 'batch', 'dictionary': 'global'}
+    assert TiledHSIEnhancer.check_options(options) == {'engine': 'batch', 'dictionary': 'tile'}
+    assert "dictionary='global'" in caplog.text and options['dictionary'] == 'global'
+    assert TiledHSIEnhancer.check_options({'dictionary': 'patch'}) == {'dictionary': 'patch'}
@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+from src.incremental import RowStatistics, shift_coefficients
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+
+@pytest.fixture
+def small_patch_data(synthetic_patch_data):
+    """Crop the shared synthetic data to a small scene with a few missing pixels."""
+    hsi, msi = synthetic_patch_data
+    hsi, msi = hsi[:20, :20, :8].copy(), msi[:40, :40]
+    hsi[2:4, 5:7] = np.nan
+    return hsi, msi
+
+def test_row_statistics_match_nanmean(small_patch_data):
+    """Test that the prefix-sum fill means equal the per-patch nanmeans."""
+    hsi, msi = small_patch_data
+    processor = PatchProcessor(hsi, msi)
+    processor.f = 2
+    processor.msi_lr = msi[::2, ::2].copy()
+    processor.msi_lr[3:5, 1] = np.nan
+    msi = msi.copy()
+    msi[6:9, 1:3, 0] = np.nan
+    processor.msi = msi
+    stats = RowStatistics(hsi, processor.msi_lr, msi, 1, 8, 2)
+    for y in range(0, 13, 3):
+        expected = processor.extract_patch(1, y, 8)
+        result = processor.extract_patch(1, y, 8, stats)
+        for a, b in zip(expected, result):
+            assert np.allclose(a, b)
+
+def test_shift_coefficients():
+    """Test that coefficients move left by the column offset."""
+    alpha = np.arange(2 * 4 * 4, dtype=float).reshape(16, 2)
+    shifted = shift_coefficients(alpha, 4, 1).reshape(4, 4, 2)
+    assert np.array_equal(shifted[:, :3], alpha.reshape(4, 4, 2)[:, 1:])
+    assert np.all(shifted[:, 3] == 0)
+    assert shift_coefficients(alpha, 4, 4) is None
+
+def test_run_parallel_incremental_engine(small_patch_data):
+    """Test that the incremental engine stays close to the patch engine."""
+    hsi, msi = small_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    expected = processor.run_parallel(patch_size=8, stride=4, engine='patch', n_jobs=1)
+    metrics = PipelineMetrics()
+    hsi_hr = processor.run_parallel(patch_size=8, stride=4, engine='incremental', n_jobs=1, metrics=metrics)
+
+    assert metrics.patches['processed'] == len(processor.patch_coords(8, 4))
+    assert np.all(np.isfinite(hsi_hr))
+    assert np.linalg.norm(hsi_hr - expected) < 0.1 * np.linalg.norm(expected)
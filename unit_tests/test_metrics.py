@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+
+def test_metrics_summary():
+    """Test stage accumulation, patch counting and callbacks."""
+    events = []
+    metrics = PipelineMetrics(callbacks=[lambda event, data: events.append(event)])
+    metrics.add_stage('patches', 1.0)
+    with metrics.stage('patches'):
+        pass
+    metrics.record_patch({'status': 'processed', 'seconds': 0.5, 'worker': 'w0',
+                          'fista_iterations': 10, 'fista_converged': True, 'dictionary_seconds': 0.2})
+    metrics.record_patch({'status': 'failed', 'seconds': 0.5, 'worker': 'w0'})
+
+    summary = metrics.summary()
+    assert summary['stages']['patches'] >= 1.0
+    assert summary['patches'] == {'processed': 1, 'skipped': 0, 'failed': 1, 'total': 2, 'failure_rate': 0.5}
+    assert summary['workers']['w0']['patches_per_sec'] == 2.0
+    assert summary['fista']['converged_rate'] == 1.0
+    assert summary['dictionary']['mean_seconds'] == 0.2
+    assert events == ['stage', 'stage', 'patch', 'patch']
+
+@pytest.mark.parametrize("engine", ["patch", "batch"])
+def test_run_parallel_metrics(synthetic_patch_data, engine):
+    """Test that every patch is counted as processed, skipped or failed."""
+    hsi, msi = synthetic_patch_data
+    hsi, msi = hsi[:32, :32, :6].copy(), msi[:64, :64]
+    hsi[:8, :8] = np.nan  # an all-NaN corner patch is skipped
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    transform = processor.decomposer.transform
+
+    def flaky(patches, state=None):
+        if np.any(patches[:, 0, 0, 0] > 0.9):
+            raise RuntimeError("decomposition failed")
+        return transform(patches, state)
+    processor.decomposer.transform = flaky
+
+    metrics = PipelineMetrics()
+    processor.run_parallel(patch_size=8, stride=8, engine=engine, metrics=metrics)
+    coords = processor.patch_coords(8, 8)
+    expected_failed = sum(1 for x, y in coords if hsi[x, y, 0] > 0.9)
+
+    assert sum(metrics.patches.values()) == len(coords)
+    assert metrics.patches['skipped'] == 1
+    assert metrics.patches['failed'] == expected_failed
+    assert len(metrics.fista_iterations) == metrics.patches['processed']
+    assert len(metrics.dictionary_seconds) == metrics.patches['processed']
+    assert 'patches' in metrics.stages
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+import pytest
+import src
+
+def test_lazy_imports():
+    """Test that loading data does not import the solver stacks, and that every export resolves."""
+    code = "import sys, src; src.HSIDataLoader; print(sorted({'sklearn', 'numba', 'cv2'} & set(sys.modules)))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
+    for name in src.__all__:
+        assert getattr(src, name) is not None
+    with pytest.raises(AttributeError):
+        src.NotAnExport
+
+def test_warm_up():
+    """Test that the warm-up entry point runs every kernel."""
+    assert src.warm_up() > 0
@@ -2,13 +2,6 @@ import pytest
 import numpy as np
 from src.patch_processor import PatchProcessor
 
-@pytest.fixture
-def synthetic_patch_data():
-    """Create synthetic MSI and HSI data for patch processing."""
-    hsi = np.random.rand(50, 50, 10).astype(np.float32)
-    msi = np.random.rand(100, 100, 3).astype(np.float32)
-    return hsi, msi
-
 def test_patch_processor_run_parallel(synthetic_patch_data):
     """Test PatchProcessor's run_parallel method."""
     hsi, msi = synthetic_patch_data
@@ -37,4 +30,130 @@ def test_process_patch_invalid_data(synthetic_patch_data):
     processor.msi_lr[0:8, 0:8, :] = np.nan
     
     result = processor.process_patch(0, 0, patch_size=8)
-    assert result is None  # Should return None for invalid patch
\ No newline at end of file
+    assert result is None  # Should return None for invalid patch
+
+def test_run_parallel_batch_engine(synthetic_patch_data):
+    """Test that the batched FISTA engine matches the per-patch engine."""
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    hsi_hr_patch = processor.run_parallel(patch_size=8, stride=8, engine='patch')
+    hsi_hr_batch = processor.run_parallel(patch_size=8, stride=8, engine='batch', batch_size=10)
+
+    assert np.any(hsi_hr_batch != 0)
+    assert np.allclose(hsi_hr_batch, hsi_hr_patch, rtol=1e-4, atol=1e-5)
+
+def test_run_parallel_shared_dictionary(synthetic_patch_data):
+    """Test the global and per-tile shared dictionary strategies."""
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    hsi_hr = processor.run_parallel(patch_size=8, stride=8, dictionary='global', refine_iter=2)
+    assert len(processor.shared_dictionaries) == 1
+    assert np.any(hsi_hr != 0) and np.all(np.isfinite(hsi_hr))
+
+    hsi_hr = processor.run_parallel(patch_size=8, stride=8, dictionary='tile', dictionary_tile=24)
+    assert len(processor.shared_dictionaries) == 4
+    assert np.any(hsi_hr != 0) and np.all(np.isfinite(hsi_hr))
+
+    with pytest.raises(ValueError, match="Unknown dictionary strategy"):
+        processor.run_parallel(patch_size=8, stride=8, dictionary='bogus')
+
+def test_run_parallel_precision():
+    """Test that the patch stage runs in the configured precision, close to float64."""
+    from src.decomposition import BatchDecomposition
+    rng = np.random.default_rng(0)
+    hsi = rng.random((50, 50, 10)).astype(np.float32)
+    msi = rng.random((100, 100, 3)).astype(np.float32)
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    hsi_hr = processor.run_parallel(patch_size=8, stride=8, engine='batch', decompositions=('wavelet', 'pca'))
+    assert processor.sparse_coding.dtype == np.float32 and processor.decomposer.dtype == np.float32
+    hsi_hr_64 = processor.run_parallel(patch_size=8, stride=8, engine='batch', decompositions=('wavelet', 'pca'),
+                                       precision='float64')
+    assert processor.sparse_coding.dtype == np.float64 and processor.decomposer.dtype == np.float64
+    assert np.any(hsi_hr != 0) and np.sqrt(np.mean((hsi_hr - hsi_hr_64) ** 2)) < 1e-3
+
+    # The decompositions are deterministic, so float32 stays within float32 rounding of float64
+    patches = np.stack([hsi[x:x + 8, y:y + 8] for x in range(0, 42, 8) for y in range(0, 42, 8)])
+    components = [BatchDecomposition(('wavelet', 'pca'), 3, dtype=dtype).fit(hsi).transform(patches)
+                  for dtype in (np.float32, np.float64)]
+    assert components[0].dtype == np.float32
+    assert np.allclose(components[0], components[1], atol=1e-5)
+
+    with pytest.raises(ValueError, match="Unknown precision"):
+        processor.run_parallel(patch_size=8, stride=8, precision='float16')
+
+def test_run_pyramid(synthetic_patch_data):
+    """Test that the coarse-to-fine stage spans the coarse level and the full stride grid."""
+    from src.metrics import PipelineMetrics
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    options = dict(patch_size=8, stride=4, engine='batch', decompositions=('wavelet', 'pca'))
+    full_hr, full_counts = processor.run_parallel(normalize=False, **options)
+
+    metrics = PipelineMetrics()
+    _, coarse_counts = processor.run_pyramid(quality=0, normalize=False, metrics=metrics, **options)
+    assert metrics.patches['processed'] == len(range(0, 43, 8)) ** 2
+    assert coarse_counts.sum() < full_counts.sum()
+
+    metrics = PipelineMetrics()
+    processor.run_pyramid(quality=0.5, normalize=False, metrics=metrics, **options)
+    assert len(range(0, 43, 8)) ** 2 < metrics.patches['processed'] < len(range(0, 43, 4)) ** 2
+    assert 'screening' in metrics.stages
+
+    hsi_hr, counts = processor.run_pyramid(quality=1, normalize=False, **options)
+    assert np.array_equal(counts, full_counts)
+    assert np.allclose(hsi_hr, full_hr, rtol=1e-4, atol=1e-3)
+
+    # A tile off the stride grid keeps the scene-wide coarse and full grids
+    tile = PatchProcessor(hsi[3:, 5:], msi[6:, 10:], n_components=3, n_atoms=3, lambda_reg=0.0005)
+    tile_options = dict(options, core=(8, 40, 8, 40), origin=(3, 5))
+    _, tile_counts = tile.run_parallel(normalize=False, **tile_options)
+    _, counts = tile.run_pyramid(quality=1, normalize=False, **tile_options)
+    assert np.array_equal(counts, tile_counts)
+
+    with pytest.raises(ValueError, match="quality"):
+        processor.run_pyramid(quality=1.5, **options)
+
+def test_run_tiles_matches_scene_coverage(synthetic_patch_data):
+    """Test that tile-by-tile processing covers the same patches as the whole scene."""
+    from src.data_loader import TilePair
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    _, scene_counts = processor.run_parallel(patch_size=8, stride=4, dictionary='global', normalize=False)
+
+    halo = 9
+    tiles = []
+    for row in range(0, 50, 25):
+        for col in range(0, 50, 25):
+            row0, col0 = max(row - halo, 0), max(col - halo, 0)
+            row1, col1 = min(row + 25 + halo, 50), min(col + 25 + halo, 50)
+            tiles.append(TilePair(hsi[row0:row1, col0:col1], msi[2 * row0:2 * row1, 2 * col0:2 * col1],
+                                  (row0, col0), (row, row + 25, col, col + 25)))
+
+    counts = np.zeros_like(scene_counts)
+    for tile, hsi_hr, tile_counts in processor.run_tiles(tiles, patch_size=8, stride=4, dictionary='global'):
+        assert hsi_hr.shape[:2] == tile_counts.shape == tile.msi.shape[:2]
+        row, col = 2 * tile.origin[0], 2 * tile.origin[1]
+        counts[row:row + tile_counts.shape[0], col:col + tile_counts.shape[1]] += tile_counts
+    assert np.array_equal(counts, scene_counts)
+
+def test_accumulate_streams_results(synthetic_patch_data):
+    """Test that accumulation consumes a lazy stream of results, skipping failed patches."""
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+    hsi_hr = np.zeros((100, 100, 10), dtype=np.float32)
+    counts = np.zeros((100, 100), dtype=np.int32)
+
+    consumed = []
+    def results():
+        for x in range(0, 60, 20):
+            consumed.append(x)
+            yield (x, x, np.ones((16, 16, 3), dtype=np.float32))
+        yield None
+
+    processor.accumulate(results(), hsi_hr, counts)
+    assert consumed == [0, 20, 40]
+    assert counts.sum() == 3 * 16 * 16
+    assert np.all(hsi_hr[:16, :16, :3] == 1) and np.all(hsi_hr[..., 3:] == 0)
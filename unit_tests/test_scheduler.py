@@ -0,0 +1,48 @@
+import numpy as np
+from src.checkpoint import Checkpoint
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+from src.scheduler import row_blocks, default_n_jobs
+
+def test_row_blocks():
+    """Test that row blocks are contiguous, complete and bounded in number."""
+    coords = [(x, y) for x in range(0, 40, 4) for y in range(0, 40, 4)]
+    blocks = row_blocks(coords, 3)
+
+    assert len(blocks) == 3
+    assert sorted(c for block in blocks for c in block) == sorted(coords)
+    last_row = -1
+    for block in blocks:
+        rows = sorted({x for x, _ in block})
+        assert rows[0] > last_row
+        last_row = rows[-1]
+    assert row_blocks([], 4) == []
+    assert default_n_jobs() >= 1
+
+def test_process_scheduler_matches_joblib(synthetic_patch_data, tmp_path):
+    """Test that the process-pool scheduler reproduces the joblib path."""
+    hsi, msi = synthetic_patch_data
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    expected = processor.run_parallel(patch_size=8, stride=6, engine='batch', dictionary='global')
+    metrics = PipelineMetrics()
+    checkpoint = Checkpoint(tmp_path, interval=0)
+    hsi_hr = processor.run_parallel(patch_size=8, stride=6, engine='batch', dictionary='global',
+                                    scheduler='process', n_jobs=2, metrics=metrics, checkpoint=checkpoint)
+
+    assert metrics.patches['processed'] == len(processor.patch_coords(8, 6))
+    assert sorted(checkpoint.done) == processor.patch_coords(8, 6)
+    assert len(metrics.fista_iterations) == metrics.patches['processed']
+    assert np.any(hsi_hr != 0)
+    assert np.allclose(hsi_hr, expected, rtol=1e-5, atol=1e-6)
+
+def test_fuse_to_enhance_process_scheduler(write_scene):
+    """Test that fuse_to_enhance passes the scheduler and worker count to the patch stage."""
+    from src.enhancer import HSIEnhancer
+    rng = np.random.default_rng(0)
+    enhancer = HSIEnhancer(*write_scene('scene', rng.random((40, 40, 3)), rng.random((20, 20, 6))),
+                           n_components=3, n_atoms=3)
+    options = dict(patch_size=8, stride=6, engine='batch', dictionary='global')
+    expected = enhancer.fuse_to_enhance(**options)
+    hsi_enhanced = enhancer.fuse_to_enhance(scheduler='process', n_jobs=2, **options)
+    assert np.allclose(hsi_enhanced, expected, rtol=1e-5, atol=1e-5)
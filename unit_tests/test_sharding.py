@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+from src.enhancer import TiledHSIEnhancer
+from src.sharding import SceneShards
+from src.writer import NpySink
+
+@pytest.fixture
+def synthetic_scene(write_scene):
+    """Create synthetic MSI and HSI rasters."""
+    rng = np.random.default_rng(0)
+    hsi = rng.random((30, 30, 6))
+    hsi[:10, :10] *= 3  # tiles and shards then see value ranges other than the scene's
+    return write_scene('scene', rng.random((60, 60, 3)), hsi)
+
+def test_parse_shard_spec():
+    """Test parsing of i/N shard specs."""
+    assert SceneShards.parse('1/4') == (1, 4)
+    for spec in ('4/4', 'a/b', '1'):
+        with pytest.raises(ValueError):
+            SceneShards.parse(spec)
+
+def test_sharded_run_matches_tiled_run(synthetic_scene, tmp_path):
+    """Test that merging independently run shards reproduces the tiled and the in-memory output."""
+    from src.enhancer import HSIEnhancer
+    msi_path, hsi_path = synthetic_scene
+    params = dict(patch_size=6, stride=4, guide_radius=1, detail_weight=2.0)
+    options = dict(n_jobs=1)
+    enhancer_params = dict(n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    tiled = TiledHSIEnhancer(msi_path, hsi_path, tile_size=10, **enhancer_params)
+    with NpySink(str(tmp_path / "tiled.npy"), tiled.output_shape) as sink:
+        tiled.fuse_to_sink(sink, str(tmp_path / "scratch"), **params, **options)
+
+    shards = SceneShards(str(tmp_path / "shards"))
+    manifest = shards.plan(msi_path, hsi_path, 2, tile_size=10, **params, **enhancer_params, **options)
+    assert sum(len(cores) for cores in manifest['shards']) == 3
+    with pytest.raises(RuntimeError, match=r"\[0, 1\]"):
+        shards.merge(None, str(tmp_path / "merge"))
+    for index in (1, 0):
+        SceneShards(str(tmp_path / "shards")).run_shard(index)
+    with NpySink(str(tmp_path / "sharded.npy"), tuple(manifest['output_shape'])) as sink:
+        shards.merge(sink, str(tmp_path / "merge"))
+
+    sharded = np.load(tmp_path / "sharded.npy")
+    assert np.allclose(sharded, np.load(tmp_path / "tiled.npy"), atol=1e-5)
+    assert manifest['enhancer']['value_range'] == list(tiled.value_range)
+
+    expected = HSIEnhancer(msi_path, hsi_path, **enhancer_params).fuse_to_enhance(**params, **options)
+    assert np.allclose(sharded, expected, rtol=0, atol=1e-4)
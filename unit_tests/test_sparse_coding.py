@@ -0,0 +1,43 @@
+import pytest
+import numpy as np
+from src.sparse_coding import SparseCoding
+
+@pytest.fixture
+def synthetic_coding_problems():
+    """Create a stack of small sparse coding problems."""
+    rng = np.random.default_rng(0)
+    D = rng.random((6, 3, 5))
+    D /= np.linalg.norm(D, axis=1, keepdims=True)
+    X = rng.random((6, 64, 3))
+    return X, D
+
+def test_fista_batch_matches_fista(synthetic_coding_problems):
+    """Test that the batched FISTA kernel reproduces the per-patch solver."""
+    X, D = synthetic_coding_problems
+    coeffs, n_iter = SparseCoding.fista_batch(X, D, 0.0005)
+
+    assert coeffs.shape == (6, 64, 5)
+    assert np.all((n_iter > 0) & (n_iter <= 75))
+    for p in range(X.shape[0]):
+        expected = SparseCoding.fista(X[p], D[p], 0.0005)
+        assert np.allclose(coeffs[p], expected, rtol=1e-6, atol=1e-8)
+
+def test_fista_batch_zero_dictionary(synthetic_coding_problems):
+    """Test that an all-zero dictionary yields zero coefficients."""
+    X, D = synthetic_coding_problems
+    D[2] = 0
+    coeffs, n_iter = SparseCoding.fista_batch(X, D, 0.0005)
+
+    assert np.all(coeffs[2] == 0)
+    assert n_iter[2] == 0
+
+def test_fista_float32(synthetic_coding_problems):
+    """Test that float32 problems are solved in float32, close to the float64 solution."""
+    X, D = synthetic_coding_problems
+    coeffs, _ = SparseCoding.fista_batch(X.astype(np.float32), D.astype(np.float32), 0.0005)
+    alpha = SparseCoding.fista(X[0].astype(np.float32), D[0].astype(np.float32), 0.0005)
+
+    assert coeffs.dtype == np.float32 and alpha.dtype == np.float32
+    expected, _ = SparseCoding.fista_batch(X, D, 0.0005)
+    assert np.allclose(coeffs, expected, atol=1e-3)
+    assert np.allclose(alpha, expected[0], atol=1e-3)
@@ -36,4 +36,38 @@ def test_upsampling_invalid_dimensions():
     msi_guide = np.random.rand(100, 100, 3).astype(np.float32)
     
     with pytest.raises(ValueError, match="Inconsistent input dimensions"):
-        upsampler.enhanced_hsi_upsampling(hsi, msi, msi_guide)
\ No newline at end of file
+        upsampler.enhanced_hsi_upsampling(hsi, msi, msi_guide)
+
+def test_match_band_stats():
+    """Test one-pass band stats and in-place matching, leaving flat bands untouched."""
+    cube = np.random.rand(30, 20, 4).astype(np.float32)
+    cube[..., 2] = 7.0
+    means, stds = HSIUpsampler.band_stats(cube)
+    assert np.allclose(means, np.mean(cube, axis=(0, 1)), atol=1e-5)
+    assert np.allclose(stds, np.std(cube, axis=(0, 1)), atol=1e-5)
+
+    target_means, target_stds = np.array([1.0, 2.0, 3.0, 4.0]), np.array([0.5, 1.0, 2.0, 3.0])
+    HSIUpsampler.match_band_stats(cube, target_means, target_stds, means, stds)
+    matched_means, matched_stds = HSIUpsampler.band_stats(cube)
+    assert np.allclose(matched_means[[0, 1, 3]], target_means[[0, 1, 3]], atol=1e-4)
+    assert np.allclose(matched_stds[[0, 1, 3]], target_stds[[0, 1, 3]], atol=1e-4)
+    assert np.all(cube[..., 2] == 7.0)
+
+@pytest.mark.parametrize("kernel", ["spline5", "bicubic", "lanczos"])
+def test_resize_hsi_tiled(kernel):
+    """Test that tiled, band-parallel resizing matches resizing whole bands."""
+    hsi = np.random.rand(40, 30, 5).astype(np.float32)
+    whole = HSIUpsampler.resize_hsi(hsi, (120, 90), kernel, tile_size=1000)
+    tiled = HSIUpsampler.resize_hsi(hsi, (120, 90), kernel, tile_size=8, n_jobs=2)
+    assert tiled.shape == (120, 90, 5) and tiled.dtype == np.float32
+    assert np.allclose(tiled, whole, atol=1e-4)
+
+def test_resize_hsi_matches_skimage():
+    """Test that the order-5 spline path reproduces skimage's 3-D resize."""
+    from skimage.transform import resize
+    hsi = np.random.rand(20, 24, 4).astype(np.float32)
+    expected = resize(hsi, (60, 72, 4), order=5, mode='edge', anti_aliasing=False, preserve_range=True)
+    assert np.allclose(HSIUpsampler.resize_hsi(hsi, (60, 72)), expected, atol=1e-5)
+    assert HSIUpsampler.resize_hsi(hsi, (50, 61)).shape == (50, 61, 4)
+    with pytest.raises(ValueError, match="Unknown resize kernel"):
+        HSIUpsampler.resize_hsi(hsi, (60, 72), 'nearest')
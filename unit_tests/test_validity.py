@@ -0,0 +1,93 @@
+import pytest
+import numpy as np
+from src.metrics import PipelineMetrics
+from src.patch_processor import PatchProcessor
+from src.validity import ValidityIndex
+
+@pytest.fixture
+def masked_pair():
+    """Create an HSI and low-res MSI with a NaN border and scattered NaNs."""
+    rng = np.random.default_rng(0)
+    hsi = rng.random((30, 40, 6)).astype(np.float32)
+    msi_lr = rng.random((30, 40, 3)).astype(np.float32) + 0.5
+    hsi[:, :12] = np.nan
+    hsi[rng.random((30, 40)) < 0.2, 2] = np.nan
+    msi_lr[rng.random((30, 40)) < 0.1, 0] = np.nan
+    return hsi, msi_lr
+
+def test_index_matches_patches(masked_pair):
+    """Test valid counts and texture against direct computation on the patches."""
+    hsi, msi_lr = masked_pair
+    index = ValidityIndex(hsi, msi_lr, chunk_rows=7)
+    coords = [(x, y) for x in range(0, 23, 3) for y in range(0, 33, 4)]
+    counts = index.counts(coords, 8)
+    texture = index.texture(coords, 8)
+
+    for (x, y), count, cv in zip(coords, counts, texture):
+        valid = np.isfinite(hsi[x:x + 8, y:y + 8]).all(axis=-1) & np.isfinite(msi_lr[x:x + 8, y:y + 8]).all(axis=-1)
+        assert count == valid.sum()
+        gray = msi_lr[x:x + 8, y:y + 8][valid].mean(axis=-1, dtype=np.float64)
+        expected = gray.std() / abs(gray.mean()) if valid.any() else 0.0
+        assert cv == pytest.approx(expected, rel=1e-6, abs=1e-9)
+
+def test_index_nodata_mask(masked_pair):
+    """Test that pixels in the nodata mask count as invalid."""
+    hsi, msi_lr = masked_pair
+    hsi, msi_lr = np.nan_to_num(hsi, nan=1.0), np.nan_to_num(msi_lr, nan=1.0)
+    nodata = np.zeros(hsi.shape[:2], dtype=bool)
+    nodata[:, :12] = True
+    index = ValidityIndex(hsi, msi_lr, nodata)
+
+    assert list(index.counts([(0, 0), (0, 8), (0, 12)], 8)) == [0, 32, 64]
+    assert index.valid_coords([(0, 0), (0, 8), (0, 12)], 8) == [(0, 8), (0, 12)]
+
+def test_adaptive_coords_keeps_sparse_grid_and_texture():
+    """Test that homogeneous patches are thinned to the sparse grid and textured ones are kept."""
+    hsi = np.ones((24, 24, 4), dtype=np.float32)
+    msi_lr = np.ones((24, 24, 3), dtype=np.float32)
+    msi_lr[:, 12:] += np.random.default_rng(0).random((24, 12, 3)).astype(np.float32)
+    index = ValidityIndex(hsi, msi_lr)
+    coords = [(x, y) for x in range(0, 17, 2) for y in range(0, 17, 2)]
+
+    kept = index.adaptive_coords(coords, 8, 4, 0.05, origin=(2, 0))
+    for x, y in coords:
+        flat = y + 8 <= 12
+        on_grid = (x + 2) % 4 == 0 and y % 4 == 0
+        assert ((x, y) in kept) == (on_grid if flat else True)
+
+def test_run_parallel_skips_invalid_patches():
+    """Test that invalid patches are never scheduled, with results unchanged."""
+    rng = np.random.default_rng(1)
+    hsi = rng.random((32, 32, 6)).astype(np.float32)
+    msi = rng.random((64, 64, 3)).astype(np.float32)
+    hsi[:, :16] = np.nan
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    metrics = PipelineMetrics()
+    sums, counts = processor.run_parallel(patch_size=8, stride=8, metrics=metrics, normalize=False)
+    assert metrics.patches == {'processed': 8, 'skipped': 8, 'failed': 0}
+
+    all_sums = np.zeros_like(sums)
+    all_counts = np.zeros_like(counts)
+    processor.process_coords(processor.patch_coords(8, 8), 8, 'patch', 256, 'threading', all_sums, all_counts,
+                             PipelineMetrics())
+    assert np.array_equal(counts, all_counts) and np.allclose(sums, all_sums)
+
+def test_run_parallel_sparse_stride():
+    """Test that the adaptive stride drops dense patches in a flat region only."""
+    rng = np.random.default_rng(2)
+    hsi = rng.random((24, 24, 6)).astype(np.float32)
+    msi = np.ones((48, 48, 3), dtype=np.float32)
+    msi[:24] += rng.random((24, 48, 3)).astype(np.float32)
+    processor = PatchProcessor(hsi, msi, n_components=3, n_atoms=3, lambda_reg=0.0005)
+
+    metrics = PipelineMetrics()
+    sums, counts = processor.run_parallel(patch_size=8, stride=4, engine='batch', sparse_stride=8,
+                                          texture_threshold=0.05, metrics=metrics,
+                                          normalize=False)
+    assert 0 < metrics.patches['processed'] < len(processor.patch_coords(8, 4))
+    assert np.all(np.isfinite(sums)) and np.all(counts > 0)
+    assert counts[:24].sum() > counts[24:].sum()
+
+    with pytest.raises(ValueError, match="sparse_stride"):
+        processor.run_parallel(patch_size=8, stride=4, sparse_stride=6)
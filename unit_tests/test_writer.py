@@ -0,0 +1,67 @@
+import time
+import pytest
+import numpy as np
+import rasterio
+from affine import Affine
+from src.writer import NpySink, GeoTiffSink, BackgroundSink, OverlapAccumulator, write_blocks
+
+TRANSFORM = Affine(10.0, 0.0, 638190.0, 0.0, -10.0, 5363070.0)
+
+@pytest.fixture
+def synthetic_output():
+    """Create a synthetic enhanced cube."""
+    return np.random.rand(40, 50, 4).astype(np.float32)
+
+def test_sinks_round_trip(synthetic_output, tmp_path):
+    """Test that block-wise writes reproduce the array in both sinks."""
+    reference_path = tmp_path / "reference.tif"
+    with rasterio.open(reference_path, 'w', driver='GTiff', height=40, width=50, count=1, dtype='float32',
+                       crs='EPSG:32632', transform=TRANSFORM) as dst:
+        dst.write(synthetic_output[..., 0], 1)
+
+    with NpySink(str(tmp_path / "out.npy"), synthetic_output.shape) as sink:
+        write_blocks(sink, synthetic_output, block_size=16)
+    assert np.array_equal(np.load(tmp_path / "out.npy"), synthetic_output)
+
+    with GeoTiffSink(str(tmp_path / "out.tif"), synthetic_output.shape, reference_path=str(reference_path),
+                     block_size=16) as sink:
+        write_blocks(sink, synthetic_output, block_size=16)
+    with rasterio.open(tmp_path / "out.tif") as src:
+        assert src.crs.to_epsg() == 32632
+        assert src.transform == TRANSFORM
+        assert src.profile['tiled'] and src.compression is not None
+        assert np.array_equal(np.moveaxis(src.read(), 0, -1), synthetic_output)
+
+def test_overlap_accumulator(tmp_path):
+    """Test overlap-add of two overlapping tile contributions."""
+    accumulator = OverlapAccumulator(str(tmp_path / "scratch"), (10, 10, 2))
+    accumulator.add(0, 0, np.full((6, 6, 2), 2.0, dtype=np.float32), np.ones((6, 6), dtype=np.int32))
+    accumulator.add(4, 4, np.full((8, 8, 2), 4.0, dtype=np.float32), np.ones((8, 8), dtype=np.int32))
+
+    averaged = accumulator.read(0, 10, 0, 10)
+    assert np.allclose(averaged[0, 0], 2.0)
+    assert np.allclose(averaged[5, 5], 3.0)
+    assert np.allclose(averaged[9, 9], 4.0)
+    assert np.allclose(averaged[0, 9], 0.0)
+
+def test_background_sink(synthetic_output, tmp_path):
+    """Test that background writes are complete on close, bounded by the depth, and raise write errors."""
+    class SlowSink(NpySink):
+        def write(self, row, col, block):
+            time.sleep(0.01)
+            super().write(row, col, block)
+
+    with SlowSink(str(tmp_path / "out.npy"), synthetic_output.shape) as sink:
+        with BackgroundSink(sink, depth=2) as writer:
+            for row in range(0, 40, 8):
+                writer.write(row, 0, synthetic_output[row:row + 8])
+                assert len(writer.pending) <= 2
+    assert np.array_equal(np.load(tmp_path / "out.npy"), synthetic_output)
+
+    class FullSink:
+        def write(self, row, col, block):
+            raise OSError("No space left on device")
+
+    with pytest.raises(OSError, match="No space left"):
+        with BackgroundSink(FullSink(), depth=2) as writer:
+            writer.write(0, 0, synthetic_output)